@@ -0,0 +1,132 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pymysql
+
+from SQL.cache import cached_query
+from SQL.logs import get_logger
+from SQL.queries import DIVE_TABLES, DBConnString, pooled_connection, schema_registry
+from SQL.totals import read_totals
+
+log = get_logger(__name__)
+
+# Aggregations run in MySQL (GROUP BY, window functions), only the small result crosses the wire.
+# Every function is cached per table like the other reads and invalidated by the same write paths.
+
+
+def _number(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+def _numeric_expression(table: str, column: str) -> str:
+    # TIME columns are aggregated as seconds
+    if schema_registry.column_type(table, column).upper().startswith('TIME'):
+        return f"TIME_TO_SEC({column})"
+    return column
+
+
+def numeric_columns(server_name: DBConnString, table: str) -> list:
+    return [column for column in schema_registry.columns(server_name, table) if column != 'id']
+
+
+def _fetch_all(server_name: DBConnString, sql_query: str, params: tuple = ()) -> list:
+    with pooled_connection(server_name) as connection, connection.cursor() as cursor:
+        cursor.execute(sql_query, params)
+        return [{key: _number(value) for key, value in row.items()} for row in cursor.fetchall()]
+
+
+# {column: {count, min, max, avg, sum}} for every column of a table, in one SELECT
+@cached_query()
+def query_column_summary(server_name: DBConnString, table: str) -> dict:
+    columns = numeric_columns(server_name, table)
+    if not columns:
+        return {}
+    select_list = ['COUNT(*) AS dives']
+    for column in columns:
+        expression = _numeric_expression(table, column)
+        select_list.extend([f"MIN({expression}) AS {column}__min", f"MAX({expression}) AS {column}__max",
+                            f"AVG({expression}) AS {column}__avg", f"SUM({expression}) AS {column}__sum",
+                            f"COUNT({column}) AS {column}__count"])
+    try:
+        row = _fetch_all(server_name, f"SELECT {', '.join(select_list)} FROM {table}")[0]
+    except pymysql.MySQLError as e:
+        log.error("Error summarizing table '%s': %s", table, e)
+        return None
+    return {column: {stat: row[f"{column}__{stat}"] for stat in ('count', 'min', 'max', 'avg', 'sum')}
+            for column in columns}
+
+
+# Rolling average of columns over a window of dives, for the last `last` dives (newest first):
+# [{id, column: avg of this dive and the window - 1 dives before it}]
+# Only the last + window - 1 newest rows are read, through the primary key
+@cached_query()
+def query_rolling_averages(server_name: DBConnString, table: str, columns: list, window: int = 10,
+                           last: int = 50) -> list:
+    select_list = ', '.join(f"AVG({_numeric_expression(table, column)}) OVER w AS {column}" for column in columns)
+    sql_query = (f"SELECT id, {select_list} FROM (SELECT * FROM {table} ORDER BY id DESC LIMIT %s) recent "
+                 f"WINDOW w AS (ORDER BY id ROWS BETWEEN %s PRECEDING AND CURRENT ROW) "
+                 f"ORDER BY id DESC LIMIT %s")
+    try:
+        return _fetch_all(server_name, sql_query, (last + window - 1, window - 1, last))
+    except pymysql.MySQLError as e:
+        log.error("Error computing rolling averages for table '%s': %s", table, e)
+        return None
+
+
+# GROUP BY one column: [{group_by value, dives, avg of each column}]
+@cached_query()
+def query_grouped_averages(server_name: DBConnString, table: str, group_by: str, columns: list) -> list:
+    select_list = ', '.join(f"AVG({_numeric_expression(table, column)}) AS {column}" for column in columns)
+    sql_query = (f"SELECT {group_by}, COUNT(*) AS dives, {select_list} FROM {table} "
+                 f"GROUP BY {group_by} ORDER BY {group_by}")
+    try:
+        return _fetch_all(server_name, sql_query)
+    except pymysql.MySQLError as e:
+        log.error("Error grouping table '%s' by '%s': %s", table, group_by, e)
+        return None
+
+
+# Samples per mission, split by how many main objectives were completed (dives joined on id)
+@cached_query(tables=lambda arguments: ['samples_gained', 'objectives_completed'])
+def query_samples_per_mission(server_name: DBConnString) -> list:
+    sql_query = ("SELECT o.main_objectives, COUNT(*) AS dives, "
+                 "AVG(s.green_samples) AS green_samples, AVG(s.orange_samples) AS orange_samples, "
+                 "AVG(s.violet_samples) AS violet_samples, "
+                 "AVG(COALESCE(s.green_samples, 0) + COALESCE(s.orange_samples, 0) + COALESCE(s.violet_samples, 0)) "
+                 "AS total_samples "
+                 "FROM samples_gained s JOIN objectives_completed o ON o.id = s.id "
+                 "GROUP BY o.main_objectives ORDER BY o.main_objectives")
+    try:
+        return _fetch_all(server_name, sql_query)
+    except pymysql.MySQLError as e:
+        log.error("Error computing samples per mission: %s", e)
+        return None
+
+
+# Lifetime totals from the summary table SQL/totals.py keeps up to date: {table: {column: total, '__rows': dives}}
+@cached_query(tables=lambda arguments: DIVE_TABLES)
+def query_career_totals(server_name: DBConnString) -> dict:
+    try:
+        with pooled_connection(server_name) as connection:
+            return read_totals(connection)
+    except pymysql.MySQLError as e:
+        log.error("Error reading career totals: %s", e)
+        return None
+
+
+# Everything the /stats page shows
+def query_dive_stats(server_name: DBConnString, window: int = 10, last: int = 50) -> dict:
+    tables = [table for table in DIVE_TABLES if table in schema_registry.table_names(server_name)]
+    stats = {'summary': {table: query_column_summary(server_name, table) for table in tables},
+             'career_totals': query_career_totals(server_name)}
+    if 'combat' in tables:
+        stats['combat_trend'] = query_rolling_averages(server_name, 'combat', ['kills', 'accuracy', 'deaths'],
+                                                       window, last)
+        stats['deaths_vs_stims'] = query_grouped_averages(server_name, 'combat', 'deaths', ['stims_used'])
+    if 'samples_gained' in tables and 'objectives_completed' in tables:
+        stats['samples_per_mission'] = query_samples_per_mission(server_name)
+    return stats
@@ -0,0 +1,168 @@
+import numpy as np
+import pymysql
+
+from SQL.cache import cached_query
+from SQL.logs import get_logger
+from SQL.queries import DIVE_TABLES, DBConnString, pooled_connection, query_get_columns, schema_registry
+
+log = get_logger(__name__)
+
+# Dive history as NumPy arrays: every numeric column of the dive tables loaded once into a float64 array
+# aligned on dive id (NaN where a table has no row or the value is NULL). All statistics below are whole-array
+# operations, no Python loop runs per dive.
+
+# Length of a mission, mission_time_remaining is subtracted from it to get the time spent
+MISSION_SECONDS = 40 * 60
+
+# Per-dive ratios built from the loaded columns
+DERIVED_METRICS = ('kills_per_death', 'samples_per_minute', 'total_samples')
+
+
+class DiveArrays:
+    def __init__(self, ids: np.ndarray, columns: dict, tables: dict):
+        self.ids = ids  # sorted dive ids
+        self.columns = columns  # column name -> float64 array, same length as ids
+        self.tables = tables  # table -> column names
+        self._add_derived()
+
+    # tables: {table: (column names, rows)}, first column of every row is the id
+    @classmethod
+    def from_rows(cls, tables: dict):
+        loaded = {}
+        for table, (names, rows) in tables.items():
+            values = np.array(rows, dtype=np.float64).reshape(len(rows), len(names))
+            loaded[table] = (names, values)
+
+        ids = np.unique(np.concatenate([values[:, 0] for _, values in loaded.values()] or [np.empty(0)]))
+        columns = {}
+        table_columns = {}
+        for table, (names, values) in loaded.items():
+            positions = np.searchsorted(ids, values[:, 0])
+            table_columns[table] = list(names[1:])
+            for index, name in enumerate(names[1:], start=1):
+                column = np.full(len(ids), np.nan)
+                column[positions] = values[:, index]
+                columns[name] = column
+        return cls(ids.astype(np.int64), columns, table_columns)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _add_derived(self) -> None:
+        missing = np.full(len(self.ids), np.nan)
+        kills, deaths = self.columns.get('kills', missing), self.columns.get('deaths', missing)
+        samples = sum(self.columns.get(name, missing) for name in ('green_samples', 'orange_samples', 'violet_samples'))
+        minutes = (MISSION_SECONDS - self.columns.get('mission_time_remaining', missing)) / 60
+        self.columns['total_samples'] = samples
+        self.columns['kills_per_death'] = ratio(kills, deaths)
+        self.columns['samples_per_minute'] = ratio(samples, minutes)
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.columns:
+            raise KeyError(f"Unknown metric '{name}'")
+        return self.columns[name]
+
+    # Mean of each dive and the window - 1 dives before it, NULLs skipped (NaN while a window has no values)
+    def rolling_mean(self, name: str, window: int = 10) -> np.ndarray:
+        values = self.column(name)
+        present = np.isfinite(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(present)))
+        end = np.arange(1, len(values) + 1)
+        start = np.maximum(end - window, 0)
+        return ratio(sums[end] - sums[start], counts[end] - counts[start])
+
+    def percentiles(self, name: str, q=(5, 25, 50, 75, 95)) -> dict:
+        values = self.column(name)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return {percentile: None for percentile in q}
+        return dict(zip(q, np.percentile(values, q).tolist()))
+
+    def describe(self, name: str) -> dict:
+        values = self.column(name)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+        return {'count': int(len(values)), 'mean': float(values.mean()), 'std': float(values.std()),
+                'min': float(values.min()), 'max': float(values.max())}
+
+    # Dives whose value is more than `threshold` standard deviations from the mean: {id: z-score}
+    def outliers(self, name: str, threshold: float = 3.0) -> dict:
+        values = self.column(name)
+        present = np.isfinite(values)
+        if not present.any():
+            return {}
+        std = values[present].std()
+        if std == 0:
+            return {}
+        scores = (values - values[present].mean()) / std
+        selected = present & (np.abs(np.where(present, scores, 0.0)) > threshold)
+        return dict(zip(self.ids[selected].tolist(), scores[selected].round(2).tolist()))
+
+    # Pearson correlation matrix over the dives that have all the metrics: {name: {name: r}}
+    def correlations(self, names: list) -> dict:
+        matrix = np.vstack([self.column(name) for name in names])
+        complete = np.isfinite(matrix).all(axis=0)
+        if complete.sum() < 2:
+            return {name: {other: None for other in names} for name in names}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coefficients = np.atleast_2d(np.corrcoef(matrix[:, complete]))
+        return {name: dict(zip(names, _json_values(coefficients[index]))) for index, name in enumerate(names)}
+
+
+# Element-wise division, NaN where the denominator is 0 or missing
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    result = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=result, where=np.isfinite(denominator) & (denominator != 0))
+    return result
+
+
+def _json_values(values) -> list:
+    # NaN isn't valid JSON
+    return [None if value != value else round(value, 4) for value in np.asarray(values, dtype=np.float64).tolist()]
+
+
+# One SELECT per dive table, TIME columns as seconds. Cached like the other reads and reloaded after a write.
+@cached_query(tables=lambda arguments: DIVE_TABLES)
+def query_dive_arrays(server_name: DBConnString) -> DiveArrays:
+    tables = {}
+    if server_name.backend != 'mysql':
+        # SQLite/in-memory: the columnar read of the backend, TIME already converted to seconds
+        for table in DIVE_TABLES:
+            if table in schema_registry.table_names(server_name):
+                values = query_get_columns(server_name, table)
+                tables[table] = (list(values), list(zip(*values.values())))
+        return DiveArrays.from_rows(tables)
+    try:
+        with pooled_connection(server_name) as connection, connection.cursor(pymysql.cursors.Cursor) as cursor:
+            for table in DIVE_TABLES:
+                if table not in schema_registry.table_names(server_name):
+                    continue
+                names = schema_registry.columns(server_name, table)
+                select_list = ', '.join(f"TIME_TO_SEC({name})"
+                                        if schema_registry.column_type(table, name).upper().startswith('TIME')
+                                        else name for name in names)
+                cursor.execute(f"SELECT {select_list} FROM {table} ORDER BY id")
+                tables[table] = (names, cursor.fetchall())
+    except pymysql.MySQLError as e:
+        log.error("Error loading dive history: %s", e)
+        return None
+    return DiveArrays.from_rows(tables)
+
+
+# What the /analytics endpoint returns: distribution, rolling mean and outliers of each metric plus correlations
+def dive_report(arrays: DiveArrays, metrics: list, window: int = 10, last: int = 50,
+                threshold: float = 3.0) -> dict:
+    return {
+        'dives': len(arrays),
+        'metrics': {name: {**arrays.describe(name),
+                           'percentiles': arrays.percentiles(name),
+                           'rolling_mean': dict(zip(arrays.ids[-last:].tolist(),
+                                                    _json_values(arrays.rolling_mean(name, window)[-last:]))),
+                           'outliers': arrays.outliers(name, threshold)}
+                    for name in metrics},
+        'correlations': arrays.correlations(metrics) if len(metrics) > 1 else {},
+    }
@@ -0,0 +1,447 @@
+import bisect
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from SQL.cache import all_tables_changed, table_changed
+from SQL.logs import get_logger, sampled
+from SQL.queries import DIVE_TABLES, NUMERIC_CONVERTERS, column_converters, convert_rows, schema_registry
+
+log = get_logger(__name__)
+
+# Storage backends next to MySQL, picked by DBConnString(backend=...): 'sqlite' (a local file) or 'memory'.
+# The query_* functions in SQL/queries.py marked @backend_dispatch call the method of the same name here,
+# so the views don't change. Backend implements them once on top of a few storage primitives
+# (live_columns, create_tables, drop_table, select, insert, update, delete, next_dive_id, transaction).
+# The MySQL-only extras - career totals, SQL aggregates, bulk import/export, migrations - stay on MySQL.
+
+
+class Backend:
+    def __init__(self, conn_string):
+        self.conn_string = conn_string
+
+    # Values are stored as the types PyMySQL hands back (int, Decimal, timedelta), whatever the form sent
+    def coerce(self, table: str, row: dict) -> dict:
+        from SQL.bulk import column_parser  # imports SQL.queries
+
+        declared = schema_registry.declared_columns(table)
+        coerced = {}
+        for column, value in row.items():
+            if column not in declared:
+                raise ValueError(f"Unknown column '{column}' in table '{table}'")
+            if value is None or value == '':
+                coerced[column] = None
+            else:
+                coerced[column] = column_parser(schema_registry.column_type(table, column))(value)
+        return coerced
+
+    def _tables(self) -> list:
+        return schema_registry.table_names(self.conn_string)
+
+    # READ
+    # ----------------------------
+    def query_read_row(self, table: str, row_id: int) -> None:
+        columns, rows = self.select(table, ids=[row_id])
+        if rows:
+            print(dict(zip(columns, rows[0])))
+        else:
+            print(f"No row with id {row_id} found in table '{table}'")
+
+    def query_read_table(self, table: str) -> None:
+        columns, rows = self.select(table)
+        for row in rows:
+            print(dict(zip(columns, row)))
+        if not rows:
+            print(f"No data found in table '{table}'")
+
+    def query_get_table_column_names(self, table: str) -> list:
+        columns, rows = self.select(table)
+        return [columns, *(list(row) for row in rows)]
+
+    def query_get_data_from_table(self, table: str, converters: dict = None) -> list:
+        return self.query_get_data_page(table, 0, None, converters)
+
+    def query_get_data_page(self, table: str, after_id: int = 0, limit: int = 100, converters: dict = None) -> list:
+        columns, rows = self.select(table, after_id, limit)
+        if converters:
+            rows = convert_rows(rows, column_converters(table, columns, converters))
+        return [columns, *rows]
+
+    def query_get_columns(self, table: str, columns: list = None, converters: dict = NUMERIC_CONVERTERS) -> dict:
+        names, rows = self.select(table)
+        converted = list(convert_rows(rows, column_converters(table, names, converters or {})))
+        values = dict(zip(names, map(list, zip(*converted)))) if converted else {name: [] for name in names}
+        return {name: values[name] for name in columns or names}
+
+    def query_stream_table(self, table: str, after_id: int = 0, converters: dict = None):
+        columns, rows = self.select(table, after_id)
+        if converters:
+            rows = convert_rows(rows, column_converters(table, columns, converters))
+        yield from rows
+
+    def query_get_last_id_value(self, table_name: str) -> int:
+        try:
+            _, rows = self.select(table_name, limit=1, descending=True)
+            return rows[0][0] if rows else -1
+        except Exception as e:
+            log.error("Error reading the last id of table '%s': %s", table_name, e)
+            return None
+
+    def query_get_data_by_id(self, table: str, id_value: int) -> dict:
+        columns, rows = self.select(table, ids=[id_value])
+        if not rows:
+            return {"columns": [], "rows": []}
+        return {"columns": columns[1:], "rows": [list(row[1:]) for row in rows]}
+
+    def query_get_latest_dive(self):
+        table_names = self._tables()
+        if not table_names:
+            return None, {}
+        last_ids = [self.query_get_last_id_value(table) for table in table_names]
+        max_id = max((id_ for id_ in last_ids if id_ is not None), default=-1)
+        return max_id, {table: self.query_get_data_by_id(table, max_id) for table in table_names}
+
+    # WRITE
+    # ----------------------------
+    def query_put_row(self, table_name: str, **kwargs):
+        try:
+            row = self.coerce(table_name, kwargs)
+            with self.transaction():
+                id_ = self.insert(table_name, row)
+                if table_name in DIVE_TABLES:
+                    self.claim_dive_id(id_)
+            table_changed(table_name)
+            log.info("Row %s inserted into table '%s'", id_, table_name, extra=sampled())
+            return id_
+        except Exception as e:
+            log.error("Error inserting row into table '%s': %s", table_name, e)
+            return None
+
+    def query_put_dive(self, dive: dict):
+        missing = [table for table in DIVE_TABLES if not dive.get(table)]
+        if missing:
+            log.error("Missing data for tables: %s", ', '.join(missing))
+            return None
+        try:
+            rows = {table: self.coerce(table, dive[table]) for table in DIVE_TABLES}
+            with self.transaction():
+                dive_id = self.next_dive_id()
+                for table in DIVE_TABLES:
+                    self.insert(table, {'id': dive_id, **rows[table]})
+            for table in DIVE_TABLES:
+                table_changed(table)
+            log.info("Dive %s inserted into tables %s", dive_id, ', '.join(DIVE_TABLES), extra=sampled())
+            return dive_id
+        except Exception as e:
+            log.error("Error inserting dive: %s", e)
+            return None
+
+    def query_update_cell(self, table_name: str, column_name: str, id_: int, value) -> None:
+        self.query_update_rows(table_name, {id_: {column_name: value}})
+
+    def query_update_row(self, table_name: str, id_: int, data: dict) -> None:
+        self.query_update_rows(table_name, {id_: data})
+
+    def query_update_rows(self, table_name: str, rows: dict) -> None:
+        try:
+            rows = {int(id_): self.coerce(table_name, data) for id_, data in rows.items() if data}
+            if not rows:
+                return
+            with self.transaction():
+                self.update(table_name, rows)
+            table_changed(table_name)
+            log.info("Table '%s' updated (%s rows)", table_name, len(rows), extra=sampled())
+        except Exception as e:
+            log.error("Error updating table '%s': %s", table_name, e)
+
+    def query_delete_row(self, table_name: str, id_value: int) -> None:
+        try:
+            with self.transaction():
+                self.delete(table_name, [id_value])
+            table_changed(table_name)
+            log.info("Row with ID %s deleted from table '%s'", id_value, table_name, extra=sampled())
+        except Exception as e:
+            log.error("Error deleting row from table '%s': %s", table_name, e)
+
+    def query_delete_dive(self):
+        try:
+            table_names = self._tables()
+            with self.transaction():
+                last_ids = [rows[0][0] for rows in (self.select(table, limit=1, descending=True)[1]
+                                                    for table in table_names) if rows]
+                max_id = max(last_ids, default=-1)
+                for table in table_names if max_id != -1 else ():
+                    self.delete(table, [max_id])
+            for table in table_names:
+                table_changed(table)
+            log.info("Dive %s deleted from tables %s", max_id, ', '.join(table_names), extra=sampled())
+            return max_id
+        except Exception as e:
+            log.error("Error deleting the latest dive: %s", e)
+            return None
+
+    def query_delete_table(self, table_name: str) -> None:
+        try:
+            with self.transaction():
+                self.drop_table(table_name)
+            log.info("Table '%s' deleted", table_name)
+        except Exception as e:
+            log.error("Error deleting table '%s': %s", table_name, e)
+        schema_registry.invalidate(self.conn_string)
+        table_changed(table_name)
+
+    def setup_db_and_tables(self) -> bool:
+        with self.transaction():
+            self.create_tables()
+        schema_registry.invalidate(self.conn_string)
+        all_tables_changed()
+        log.info("%s: tables ready", type(self).__name__)
+        return True
+
+
+# SQLITE
+# ----------------------------
+# One connection per thread on a WAL-mode database file: readers never block the writer or each other.
+# Writes take the write lock up front (BEGIN IMMEDIATE) so two writers queue instead of deadlocking.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # fsync at checkpoints, not on every commit - safe with WAL
+    'temp_store': 'MEMORY',
+    'cache_size': -65536,  # KiB -> 64 MB page cache
+    'mmap_size': 268435456,  # 256 MB memory-mapped reads
+    'busy_timeout': 5000,  # ms to wait for the write lock
+}
+
+
+def _time_to_text(value: timedelta) -> str:
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def _text_to_time(value: bytes) -> timedelta:
+    seconds = 0
+    for part in value.decode().split(':'):
+        seconds = seconds * 60 + int(float(part))
+    return timedelta(seconds=seconds)
+
+
+# Column values come back as PyMySQL returns them: DECIMAL -> Decimal, TIME -> timedelta
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(timedelta, _time_to_text)
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+sqlite3.register_converter('TIME', _text_to_time)
+
+
+class SQLiteBackend(Backend):
+    def __init__(self, conn_string):
+        super().__init__(conn_string)
+        self.path = conn_string.database
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None)
+            for pragma, value in SQLITE_PRAGMAS.items():
+                connection.execute(f"PRAGMA {pragma} = {value}")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self._connection()
+        if connection.in_transaction:  # nested, the outer one commits
+            yield
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def live_columns(self) -> dict:
+        connection = self._connection()
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {table: [row[1] for row in connection.execute(f"PRAGMA table_info({table})")] for table in tables}
+
+    def create_tables(self) -> None:
+        connection = self._connection()
+        for table in DIVE_TABLES:
+            definition = schema_registry.definition(table)
+            columns = ', '.join(f"{column} {column_type}" for column, column_type in definition.columns.items())
+            # INTEGER PRIMARY KEY is the rowid, AUTOINCREMENT never reuses a deleted id (like MySQL)
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                               f"(id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+            for index_name, column_names in definition.indexes.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(column_names)})")
+        connection.execute("CREATE TABLE IF NOT EXISTS dive_sequence (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+        for table in DIVE_TABLES:
+            connection.execute(f"INSERT OR IGNORE INTO dive_sequence (id) "
+                               f"SELECT id FROM {table} ORDER BY id DESC LIMIT 1")
+
+    def drop_table(self, table: str) -> None:
+        self._connection().execute(f"DROP TABLE IF EXISTS {table}")
+
+    def select(self, table: str, after_id: int = 0, limit: int = None, ids: list = None,
+               descending: bool = False) -> tuple:
+        where, params = "id > ?", [after_id]
+        if ids is not None:
+            where, params = f"id IN ({', '.join('?' * len(ids))})", list(ids)
+        sql_query = f"SELECT * FROM {table} WHERE {where} ORDER BY id {'DESC' if descending else ''}"
+        if limit is not None:
+            sql_query += " LIMIT ?"
+            params.append(limit)
+        cursor = self._connection().execute(sql_query, params)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+
+    def insert(self, table: str, row: dict) -> int:
+        placeholders = ', '.join('?' * len(row))
+        cursor = self._connection().execute(f"INSERT INTO {table} ({', '.join(row)}) VALUES ({placeholders})",
+                                            list(row.values()))
+        return row.get('id') or cursor.lastrowid
+
+    def update(self, table: str, rows: dict) -> None:
+        connection = self._connection()
+        for id_, data in rows.items():
+            connection.execute(f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in data)} WHERE id = ?",
+                               [*data.values(), id_])
+
+    def delete(self, table: str, ids: list) -> None:
+        self._connection().execute(f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", list(ids))
+
+    def next_dive_id(self) -> int:
+        return self._connection().execute("INSERT INTO dive_sequence DEFAULT VALUES").lastrowid
+
+    def claim_dive_id(self, id_: int) -> None:
+        self._connection().execute("INSERT OR IGNORE INTO dive_sequence (id) VALUES (?)", (id_,))
+
+
+# IN MEMORY
+# ----------------------------
+# Rows as tuples in a dict per table plus the sorted list of ids for range reads. Nothing survives a restart;
+# meant for tests, benchmarks and trying the app without a database. One lock for all writes.
+class MemoryBackend(Backend):
+    def __init__(self, conn_string):
+        super().__init__(conn_string)
+        self._lock = threading.RLock()
+        self._rows = {}  # table -> {id: row tuple}
+        self._ids = {}  # table -> sorted ids
+        self._auto_increment = {}  # table -> last id handed out
+        self._sequence = 0
+        self._undo = None  # (table, id, row before or None) of every change of the running transaction
+
+    @contextmanager
+    def transaction(self):
+        # Writes hold the lock; a failed write puts back the rows it changed (AUTO_INCREMENT gaps stay, like MySQL)
+        with self._lock:
+            if self._undo is not None:  # nested, the outer one decides
+                yield
+                return
+            self._undo = []
+            try:
+                yield
+            except BaseException:
+                for table, id_, row in reversed(self._undo):
+                    self._put(table, id_, row)
+                raise
+            finally:
+                self._undo = None
+
+    def _put(self, table: str, id_: int, row) -> None:
+        # Store (or with row=None remove) one row, remembering what was there for a rollback
+        rows, ids = self._table(table), self._ids[table]
+        if self._undo is not None:
+            self._undo.append((table, id_, rows.get(id_)))
+        if row is None:
+            if rows.pop(id_, None) is not None:
+                del ids[bisect.bisect_left(ids, id_)]
+        else:
+            if id_ not in rows:
+                bisect.insort(ids, id_)
+            rows[id_] = row
+
+    def live_columns(self) -> dict:
+        return {table: schema_registry.declared_columns(table) for table in self._rows}
+
+    def create_tables(self) -> None:
+        for table in DIVE_TABLES:
+            self._rows.setdefault(table, {})
+            self._ids.setdefault(table, [])
+            self._auto_increment.setdefault(table, 0)
+
+    def drop_table(self, table: str) -> None:
+        self._rows.pop(table, None)
+        self._ids.pop(table, None)
+        self._auto_increment.pop(table, None)
+        if not self._rows:
+            self._sequence = 0  # the last table is gone, like dropping dive_sequence in MySQL
+
+    def _table(self, table: str) -> dict:
+        if table not in self._rows:
+            raise KeyError(f"Table '{table}' doesn't exist")
+        return self._rows[table]
+
+    def select(self, table: str, after_id: int = 0, limit: int = None, ids: list = None,
+               descending: bool = False) -> tuple:
+        with self._lock:
+            rows = self._table(table)
+            if ids is not None:
+                selected = sorted(id_ for id_ in ids if id_ in rows)
+            else:
+                all_ids = self._ids[table]
+                selected = all_ids[bisect.bisect_right(all_ids, after_id):]
+            if descending:
+                selected = selected[::-1]
+            if limit is not None:
+                selected = selected[:limit]
+            return schema_registry.declared_columns(table), [rows[id_] for id_ in selected]
+
+    def insert(self, table: str, row: dict) -> int:
+        rows = self._table(table)
+        id_ = row.get('id') or self._auto_increment[table] + 1
+        if id_ in rows:
+            raise ValueError(f"Duplicate entry '{id_}' for key 'PRIMARY'")
+        self._auto_increment[table] = max(self._auto_increment[table], id_)
+        self._put(table, id_, tuple(id_ if column == 'id' else row.get(column)
+                                    for column in schema_registry.declared_columns(table)))
+        return id_
+
+    def update(self, table: str, rows: dict) -> None:
+        stored = self._table(table)
+        columns = schema_registry.declared_columns(table)
+        for id_, data in rows.items():
+            if id_ in stored:
+                self._put(table, id_, tuple(data.get(column, value) if column != 'id' else value
+                                            for column, value in zip(columns, stored[id_])))
+
+    def delete(self, table: str, ids: list) -> None:
+        for id_ in ids:
+            self._put(table, id_, None)
+
+    def next_dive_id(self) -> int:
+        self._sequence = max([self._sequence, *self._auto_increment.values()]) + 1
+        return self._sequence
+
+    def claim_dive_id(self, id_: int) -> None:
+        self._sequence = max(self._sequence, id_)
+
+
+BACKENDS = {'sqlite': SQLiteBackend, 'memory': MemoryBackend}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+# One backend object per DBConnString, like the connection pools
+def get_backend(conn_string) -> Backend:
+    with _backends_lock:
+        backend = _backends.get(conn_string)
+        if backend is None:
+            if conn_string.backend not in BACKENDS:
+                raise ValueError(f"Unknown backend '{conn_string.backend}', expected mysql or one of: "
+                                 f"{', '.join(BACKENDS)}")
+            backend = _backends[conn_string] = BACKENDS[conn_string.backend](conn_string)
+        return backend
@@ -0,0 +1,357 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+# Benchmarks of the query_* functions and of every route of app.py (Flask test client) on a local database
+# filled with synthetic dives. For each case: latency percentiles, statements and connections per call,
+# peak Python memory. Results can be saved as a baseline and later runs compared against it.
+#
+#   python -m SQL.bench --backend sqlite --dives 1000,100000 --save bench_baseline.json
+#   python -m SQL.bench --backend sqlite --dives 1000,100000 --compare bench_baseline.json
+#
+# --backend mysql uses the AWS_RDS_* variables - point them at a local server, the tables get refilled.
+
+DEFAULT_SIZES = '1000,100000'
+DEFAULT_ITERATIONS = 50
+DEFAULT_BUDGET = 2.0  # seconds per case, at least one iteration runs
+DEFAULT_TOLERANCE = 0.25  # p50 more than 25% over the baseline is a regression
+NOISE_MS = 0.5  # ... and more than this many milliseconds, sub-millisecond jitter isn't one
+LOAD_BATCH = 5000
+FULL_TABLE_MAX_DIVES = 100000  # cases reading whole tables are skipped above this
+
+
+# SYNTHETIC DATA
+# ----------------------------
+# Deterministic for a seed, values inside the column types of SQL/queries.py
+def generate_dive(rng: random.Random) -> dict:
+    shots = rng.randint(100, 3000)
+    kills = rng.randint(0, min(shots, 800))
+    extracted = rng.choice((0, 1, 2, 3, 4, 4, 4))
+    return {
+        'combat': {'kills': kills, 'accuracy': round(rng.uniform(20, 90), 2), 'shots_fired': shots,
+                   'deaths': rng.randint(0, 12), 'stims_used': rng.randint(0, 20), 'accidentals': rng.randint(0, 5),
+                   'samples_extracted': rng.randint(0, 40), 'stratagems_used': rng.randint(5, 60),
+                   'melee_kills': rng.randint(0, 30), 'times_reinforcing': rng.randint(0, 10),
+                   'friendly_fire_damage': rng.randint(0, 5000), 'distance_travelled': rng.randint(500, 9000)},
+        'currency_gained': {'requisition': rng.randint(0, 2000), 'medals': rng.randint(0, 50),
+                            'xp': rng.randint(500, 9000)},
+        'objectives_completed': {'main_objectives': rng.randint(0, 3), 'optional_objectives': rng.randint(0, 6),
+                                 'helldivers_extracted': extracted, 'outposts_destroyed_light': rng.randint(0, 6),
+                                 'outposts_destroyed_medium': rng.randint(0, 4),
+                                 'outposts_destroyed_heavy': rng.randint(0, 3),
+                                 'mission_time_remaining': timedelta(seconds=rng.randint(0, 2400))},
+        'samples_gained': {'green_samples': rng.randint(0, 30), 'orange_samples': rng.randint(0, 20),
+                           'violet_samples': rng.randint(0, 10)},
+    }
+
+
+def load_dives(server_name, count: int, seed: int = 1) -> None:
+    # Empty tables, then `count` dives with ids 1..count in batches of LOAD_BATCH
+    from SQL.bootstrap import bootstrap
+    from SQL.queries import DIVE_TABLES, query_delete_all_tables
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        query_delete_all_tables(server_name)
+        bootstrap.run(server_name)  # also marks the app ready, its first request doesn't set up again
+    rng = random.Random(seed)
+    for start in range(1, count + 1, LOAD_BATCH):
+        dives = [generate_dive(rng) for _ in range(min(LOAD_BATCH, count - start + 1))]
+        for table in DIVE_TABLES:
+            batch = [(start + n, {'id': start + n, **dive[table]}) for n, dive in enumerate(dives)]
+            _insert_rows(server_name, table, batch)
+
+    if server_name.backend != 'mysql':
+        from SQL.backends import get_backend
+
+        backend = get_backend(server_name)
+        with backend.transaction():
+            backend.claim_dive_id(count)
+    from SQL.cache import all_tables_changed
+
+    all_tables_changed()
+
+
+def _insert_rows(server_name, table: str, batch: list) -> None:
+    if server_name.backend == 'mysql':
+        from SQL.bulk import _insert_batch
+
+        _insert_batch(server_name, table, batch)
+        return
+    from SQL.backends import get_backend
+
+    backend = get_backend(server_name)
+    with backend.transaction():
+        for _, row in batch:
+            backend.insert(table, row)
+
+
+# COUNTERS
+# ----------------------------
+# Statements and new connections, counted by wrapping the driver entry points for the whole run
+class Counters:
+    def __init__(self):
+        self.statements = 0
+        self.connections = 0
+        self.borrows = 0
+
+    def install(self) -> None:
+        import pymysql
+
+        from SQL.backends import Backend
+        from SQL.pool import ConnectionPool
+
+        def counting(function, attribute):
+            def wrapper(*args, **kwargs):
+                setattr(self, attribute, getattr(self, attribute) + 1)
+                return function(*args, **kwargs)
+
+            return wrapper
+
+        for cursor_method in ('execute', 'executemany'):
+            setattr(pymysql.cursors.Cursor, cursor_method,
+                    counting(getattr(pymysql.cursors.Cursor, cursor_method), 'statements'))
+        for primitive in ('select', 'insert', 'update', 'delete', 'next_dive_id', 'claim_dive_id'):
+            for backend_class in Backend.__subclasses__():
+                setattr(backend_class, primitive, counting(getattr(backend_class, primitive), 'statements'))
+        pymysql.connections.Connection.connect = counting(pymysql.connections.Connection.connect, 'connections')
+        sqlite3.connect = counting(sqlite3.connect, 'connections')
+        ConnectionPool.acquire = counting(ConnectionPool.acquire, 'borrows')
+
+    def snapshot(self) -> tuple:
+        return self.statements, self.connections, self.borrows
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(call, counters: Counters, iterations: int, budget: float, cold: bool) -> dict:
+    from SQL.cache import result_cache
+
+    samples = []
+    before = counters.snapshot()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while len(samples) < iterations and (not samples or time.perf_counter() - started < budget):
+            if cold:
+                result_cache.clear()
+            start = time.perf_counter()
+            call()
+            samples.append(time.perf_counter() - start)
+        statements, connections, borrows = (after - first for after, first in zip(counters.snapshot(), before))
+
+        # Peak memory of one more call, traced separately so the timings above stay clean
+        if cold:
+            result_cache.clear()
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    calls = len(samples)
+    return {'calls': calls,
+            'p50_ms': percentile(samples, 50) * 1000, 'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000, 'max_ms': max(samples) * 1000,
+            'statements_per_call': statements / calls, 'connections_per_call': connections / calls,
+            'borrows_per_call': borrows / calls, 'peak_kib': peak / 1024}
+
+
+# CASES
+# ----------------------------
+# (name, callable) per query_* function; `dives` is the number of dives loaded. Writes run after the reads.
+def query_cases(server_name, dives: int) -> list:
+    from SQL import queries
+    from SQL.arrays import query_dive_arrays
+
+    middle = max(1, dives // 2)
+    counter = iter(range(dives + 1_000_000, dives + 10_000_000))
+    delete_ids = iter(range(dives, 0, -1))
+    dive = generate_dive(random.Random(2))
+    cases = [
+        ('query_get_table_names', lambda: queries.query_get_table_names(server_name)),
+        ('query_get_data_page', lambda: queries.query_get_data_page(server_name, 'combat', middle, 100, fresh=True)),
+        ('query_get_data_by_id', lambda: queries.query_get_data_by_id(server_name, 'combat', middle, fresh=True)),
+        ('query_get_last_id_value', lambda: queries.query_get_last_id_value(server_name, 'combat', fresh=True)),
+        ('query_get_latest_dive', lambda: queries.query_get_latest_dive(server_name, fresh=True)),
+        ('query_stream_table (last 1000)',
+         lambda: list(queries.query_stream_table(server_name, 'combat', max(0, dives - 1000)))),
+    ]
+    if dives <= FULL_TABLE_MAX_DIVES:
+        cases += [
+            ('query_get_data_from_table', lambda: queries.query_get_data_from_table(server_name, 'combat',
+                                                                                    fresh=True)),
+            ('query_get_columns', lambda: queries.query_get_columns(server_name, 'combat', ['kills', 'deaths'],
+                                                                    fresh=True)),
+            ('query_dive_arrays', lambda: query_dive_arrays(server_name, fresh=True)),
+        ]
+    if server_name.backend == 'mysql':
+        from SQL.analytics import query_dive_stats
+
+        cases.append(('query_dive_stats', lambda: query_dive_stats(server_name)))
+    cases += [
+        ('query_put_row', lambda: queries.query_put_row(server_name, 'currency_gained', id=next(counter),
+                                                        requisition=1, medals=1, xp=100)),
+        ('query_put_dive', lambda: queries.query_put_dive(server_name, dive)),
+        ('query_update_cell', lambda: queries.query_update_cell(server_name, 'combat', 'kills', middle, 10)),
+        ('query_update_row', lambda: queries.query_update_row(server_name, 'combat', middle, {'kills': 11,
+                                                                                              'deaths': 2})),
+        ('query_update_rows', lambda: queries.query_update_rows(server_name, 'combat',
+                                                                {id_: {'kills': 12} for id_ in range(1, 101)})),
+        ('query_delete_row', lambda: queries.query_delete_row(server_name, 'samples_gained', next(delete_ids))),
+    ]
+    return cases
+
+
+def route_cases(server_name, dives: int) -> list:
+    from app import FORM_FIELDS, app
+
+    client = app.test_client()
+    app.logger.disabled = True  # a failing route is reported by _check, without the traceback
+    form = {table: {column: '1' if convert in (int, float) else '10:00.00' for column, convert in fields.items()}
+            for table, fields in FORM_FIELDS.items()}
+
+    def get(path):
+        return lambda: _check(client.get(path), path)
+
+    def post(path, **kwargs):
+        return lambda: _check(client.post(path, **kwargs), path)
+
+    cases = [(f'GET {path}', get(path)) for path in (
+        '/', '/about', '/dive', '/all_dives?limit=100', '/combat?limit=100', '/currency_gained?limit=100',
+        '/objectives_completed?limit=100', '/samples_gained?limit=100', '/input_combat',
+        '/input_currency_gained', '/input_objectives_completed', '/input_samples_gained', '/cache_stats',
+        '/pool_stats', '/analytics' if dives <= FULL_TABLE_MAX_DIVES else None,
+    ) if path]
+    if dives <= FULL_TABLE_MAX_DIVES:
+        cases += [(f'GET {path}', get(path)) for path in ('/combat', '/all_dives')]
+    if server_name.backend == 'mysql':
+        csv_body = 'requisition,medals,xp\n' + '1,1,100\n' * 100
+        cases += [('GET /stats', get('/stats')), ('GET /stats?format=json', get('/stats?format=json')),
+                  ('GET /export/combat', get('/export/combat?format=csv')),
+                  ('POST /import/currency_gained (100 rows)',
+                   post('/import/currency_gained?format=csv', data=csv_body, content_type='text/csv'))]
+
+    cases += [(f'POST /submit_data_{table}', post(f'/submit_data_{table}', data=form[table])) for table in form]
+    cases += [(f'POST /update_data_{table}', post(f'/update_data_{table}', data=form[table])) for table in form]
+    cases += [
+        ('POST /submit_dive (JSON)', post('/submit_dive', json=form)),
+        ('POST /update_last_dive/combat', post('/update_last_dive/combat', data={'kills': '3'})),
+        ('POST /delete_last_row/currency_gained', post('/delete_last_row/currency_gained')),
+        ('POST /delete_last_dive', post('/delete_last_dive')),
+    ]
+    return cases
+
+
+def _check(response, path):
+    response.get_data()  # run streamed bodies to the end
+    if response.status_code >= 400:
+        raise RuntimeError(f"{path} answered {response.status_code}")
+    return response
+
+
+# REPORT
+# ----------------------------
+def run(server_name, sizes: list, iterations: int, budget: float, cold: bool) -> dict:
+    counters = Counters()
+    counters.install()
+    results = {}
+    for dives in sizes:
+        print(f"Loading {dives} dives ...", flush=True)
+        started = time.perf_counter()
+        load_dives(server_name, dives)
+        print(f"  loaded in {time.perf_counter() - started:.1f}s")
+        for group, cases in (('query', query_cases(server_name, dives)), ('route', route_cases(server_name, dives))):
+            for name, call in cases:
+                key = f"{dives}/{group}/{name}"
+                try:
+                    results[key] = measure(call, counters, iterations, budget, cold)
+                except Exception as e:
+                    print(f"  {key}: failed - {e}")
+                    continue
+                print_result(key, results[key])
+    return results
+
+
+def print_result(key: str, result: dict) -> None:
+    print(f"  {key:<60} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+          f"p99 {result['p99_ms']:9.3f} ms  stmts {result['statements_per_call']:5.1f}  "
+          f"conns {result['connections_per_call']:4.2f}  peak {result['peak_kib']:9.1f} KiB")
+
+
+# Cases slower than the baseline by more than `tolerance` (and NOISE_MS), or running more statements:
+# [(key, description)]
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get('results', {}).get(key)
+        if not before:
+            continue
+        if result['p50_ms'] > before['p50_ms'] * (1 + tolerance) and result['p50_ms'] - before['p50_ms'] > NOISE_MS:
+            regressions.append((key, f"p50 {before['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms"))
+        if result['statements_per_call'] > before['statements_per_call'] + 0.01:
+            regressions.append((key, f"statements per call {before['statements_per_call']:.2f} -> "
+                                     f"{result['statements_per_call']:.2f}"))
+    return regressions
+
+
+# Server1 reads the environment when it is first used, so this runs before anything uses it.
+# A SQLite file is recreated empty.
+def use_backend(backend: str, db_path: str):
+    os.environ['DB_BACKEND'] = backend
+    if backend == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(db_path + suffix)
+        os.environ['DB_PATH'] = db_path
+    from SQL.queries import Server1
+
+    return Server1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SQL.bench', description='Query layer and route benchmarks')
+    parser.add_argument('--backend', choices=('sqlite', 'memory', 'mysql'), default='sqlite')
+    parser.add_argument('--db-path', default='bench.db', help='SQLite file (recreated)')
+    parser.add_argument('--dives', default=DEFAULT_SIZES, help='comma separated dataset sizes, e.g. 1000,100000,1000000')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='max seconds per case')
+    parser.add_argument('--cold', action='store_true', help='clear the result cache before every call')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    Server1 = use_backend(args.backend, args.db_path)
+
+    sizes = [int(size) for size in args.dives.split(',')]
+    results = run(Server1, sizes, args.iterations, args.budget, args.cold)
+    document = {'backend': args.backend, 'cold': args.cold, 'python': sys.version.split()[0], 'results': results}
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(document, file, indent=1, sort_keys=True)
+        print(f"Saved {len(results)} results to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, description in regressions:
+            print(f"REGRESSION {key}: {description}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+from SQL.logs import get_logger
+
+# Startup without waiting for the database. start() runs setup_db_and_tables() (database and tables created or
+# migrated, see SQL/queries.py) and warms the connection pool in a background thread, so a worker answers its
+# first request milliseconds after it is started. Until the bootstrap is done /ready answers 503, and requests
+# that need the database wait for it up to BOOTSTRAP_WAIT seconds. A failed attempt is retried every
+# BOOTSTRAP_RETRY seconds, e.g. while the database server is still coming up.
+#
+# BOOTSTRAP_WAIT  seconds a request waits for the database before it gets a 503, default 5
+# BOOTSTRAP_RETRY seconds between attempts, default 5
+
+BOOTSTRAP_WAIT = float(os.environ.get('BOOTSTRAP_WAIT', 5))
+BOOTSTRAP_RETRY = float(os.environ.get('BOOTSTRAP_RETRY', 5))
+
+log = get_logger(__name__)
+
+
+class Bootstrap:
+    def __init__(self, retry: float = BOOTSTRAP_RETRY):
+        self.retry = retry
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.attempts = 0
+        self.error = None
+        self.elapsed = None  # seconds the successful attempt took
+
+    # One attempt in the calling thread, True when the database is ready
+    def run(self, server_name) -> bool:
+        from SQL.queries import get_pool, setup_db_and_tables  # the query layer is only loaded once this runs
+
+        start = time.perf_counter()
+        self.attempts += 1
+        try:
+            if not setup_db_and_tables(server_name):
+                self.error = 'database setup failed, see the log'
+                return False
+            if server_name.backend == 'mysql':
+                get_pool(server_name).warm()  # open the pool's min_size connections before the first request
+        except Exception as e:  # anything: a background thread that dies leaves the app not ready for good
+            self.error = f"{type(e).__name__}: {e}"
+            log.exception("Database setup failed")
+            return False
+        self.error = None
+        self.elapsed = time.perf_counter() - start
+        self._ready.set()
+        log.info("Database ready in %.1f ms", self.elapsed * 1000, extra={'attempts': self.attempts})
+        return True
+
+    # Run in a background thread until it succeeds; only the first call starts one
+    def start(self, server_name) -> None:
+        if self._thread is not None or self._ready.is_set():
+            return
+        with self._lock:
+            if self._thread is None and not self._ready.is_set():
+                self._thread = threading.Thread(target=self._run, args=(server_name,), name='bootstrap',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self, server_name) -> None:
+        while not self.run(server_name):
+            time.sleep(self.retry)
+
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def status(self) -> dict:
+        return {'ready': self.ready(), 'attempts': self.attempts, 'error': self.error,
+                'elapsed_ms': round(self.elapsed * 1000, 1) if self.elapsed is not None else None}
+
+
+bootstrap = Bootstrap()
@@ -0,0 +1,500 @@
+import argparse
+import array
+import csv
+import io
+import json
+import re
+import struct
+import sys
+import time
+import zlib
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import pymysql
+
+from SQL.logs import get_logger
+from SQL.queries import (DIVE_TABLES, NUMERIC_CONVERTERS, DBConnString, Server1, column_converters, convert_rows,
+                         pooled_connection, query_stream_select, schema_registry, sync_dive_sequence, table_changed)
+from SQL.totals import apply_totals
+
+log = get_logger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_REJECTS = 100  # rejected rows listed in a report, all of them are counted
+
+
+# VALIDATION
+# ----------------------------
+# Every row is checked against the SQLQuery definition of its table before it gets near the database
+class RowRejected(ValueError):
+    pass
+
+
+def _parse_int(value):
+    if isinstance(value, (bool, float)):
+        raise RowRejected(f"not an integer: {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowRejected(f"not an integer: {value!r}")
+
+
+# Bytes of each MySQL integer type, for the range check
+INTEGER_BYTES = {'TINYINT': 1, 'SMALLINT': 2, 'MEDIUMINT': 3, 'BIGINT': 8, 'INT': 4}
+
+
+def integer_range(column_type: str) -> tuple:
+    # (lowest, highest) value an integer column type holds
+    column_type = column_type.upper()
+    size = next((size for name, size in INTEGER_BYTES.items() if column_type.startswith(name)), 4)
+    if 'UNSIGNED' in column_type:
+        return 0, 2 ** (8 * size) - 1
+    return -2 ** (8 * size - 1), 2 ** (8 * size - 1) - 1
+
+
+def _int_parser(column_type):
+    low, high = integer_range(column_type)
+
+    def parse(value):
+        number = _parse_int(value)
+        if not low <= number <= high:
+            raise RowRejected(f"out of range for {column_type}: {value!r}")
+        return number
+
+    return parse
+
+
+def _decimal_parser(column_type):
+    match = re.match(r"DECIMAL\((\d+),\s*(\d+)\)", column_type)
+    precision, scale = (int(match.group(1)), int(match.group(2))) if match else (10, 0)
+
+    def parse(value):
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise RowRejected(f"not a decimal: {value!r}")
+        if not number.is_finite():
+            raise RowRejected(f"out of range for {column_type}: {value!r}")
+        number = number.quantize(Decimal(1).scaleb(-scale), ROUND_HALF_UP)  # the digits MySQL keeps
+        if abs(number) >= Decimal(10) ** (precision - scale):
+            raise RowRejected(f"out of range for {column_type}: {value!r}")
+        return number
+
+    return parse
+
+
+# TIME strings the way MySQL reads them: '[-][D ]HH:MM[:SS][.f]' - so '12:34' is 12:34:00 and '12:34.56' is
+# 12:34:00.56 - or digits as [[HH]MM]SS[.f], '1234' is 00:12:34. Numbers (JSON) are seconds.
+# Fractions round to whole seconds like a TIME column keeps them.
+_TIME_PATTERN = re.compile(r"(-)?(?:(\d+) +)?(\d+):(\d+)(?::(\d+))?(\.\d*)?")
+_TIME_DIGITS_PATTERN = re.compile(r"(-)?(\d+)(\.\d*)?")
+MAX_TIME_SECONDS = 838 * 3600 + 59 * 60 + 59  # '838:59:59'
+
+
+def _parse_time(value):
+    if isinstance(value, timedelta):
+        seconds = Decimal(str(value.total_seconds()))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = Decimal(str(value))
+    else:
+        text = str(value).strip()
+        if match := _TIME_PATTERN.fullmatch(text):
+            sign, days, hours, minutes, whole_seconds, fraction = match.groups()
+            hours, minutes, whole_seconds = int(days or 0) * 24 + int(hours), int(minutes), int(whole_seconds or 0)
+        elif match := _TIME_DIGITS_PATTERN.fullmatch(text):
+            sign, digits, fraction = match.groups()
+            hours, minutes, whole_seconds = int(digits) // 10000, int(digits) // 100 % 100, int(digits) % 100
+        else:
+            raise RowRejected(f"not a time: {value!r}")
+        if minutes > 59 or whole_seconds > 59:
+            raise RowRejected(f"not a time: {value!r}")
+        seconds = hours * 3600 + minutes * 60 + whole_seconds + Decimal('0' + (fraction or ''))
+        if sign:
+            seconds = -seconds
+    if not seconds.is_finite():
+        raise RowRejected(f"not a time: {value!r}")
+    seconds = seconds.quantize(Decimal(1), ROUND_HALF_UP)
+    if abs(seconds) > MAX_TIME_SECONDS:
+        raise RowRejected(f"out of range for TIME: {value!r}")
+    return timedelta(seconds=int(seconds))
+
+
+def column_parser(column_type: str):
+    column_type = column_type.upper()
+    if 'INT' in column_type:
+        return _int_parser(column_type)
+    if column_type.startswith('DECIMAL'):
+        return _decimal_parser(column_type)
+    if column_type.startswith('TIME'):
+        return _parse_time
+    return str
+
+
+def row_validator(table: str):
+    definition = schema_registry.definition(table)
+    parsers = {column: column_parser(column_type) for column, column_type in definition.columns.items()}
+    parsers_with_id = {'id': column_parser(definition.id_type), **parsers}
+
+    def validate(row: dict) -> dict:
+        unknown = [column for column in row if column not in parsers_with_id]
+        if unknown:
+            raise RowRejected(f"unknown columns: {', '.join(map(str, unknown))}")
+        missing = [column for column in parsers if column not in row]
+        if missing:
+            raise RowRejected(f"missing columns: {', '.join(missing)}")
+        result = {}
+        for column, value in row.items():
+            if value is None or value == '':
+                if column == 'id':
+                    continue  # let the database assign it
+                result[column] = None
+            else:
+                result[column] = parsers_with_id[column](value)
+        return result
+
+    return validate
+
+
+# READERS
+# ----------------------------
+# Both yield (line number, row dict) one row at a time, files are never loaded whole
+def read_csv(stream):
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    for values in reader:
+        if not values:
+            continue  # blank line
+        if len(values) != len(header):
+            # csv.DictReader would fill a short row up with NULLs and hide the extra values of a long one
+            yield reader.line_num, RowRejected(f"{len(values)} values for {len(header)} columns")
+            continue
+        yield reader.line_num, dict(zip(header, values))
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, RowRejected(f"invalid JSON: {e}")
+            continue
+        yield line_number, row if isinstance(row, dict) else RowRejected("line is not a JSON object")
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+# IMPORT
+# ----------------------------
+def _insert_batch(server_name: DBConnString, table: str, batch: list) -> list:
+    # One transaction per batch; executemany turns INSERT ... VALUES into one multi-row VALUES statement.
+    # Rows of a batch are grouped by their column set (rows with and without an explicit id).
+    # Returns [(line number, error)] for rows the database refused
+    groups = {}
+    for line_number, row in batch:
+        groups.setdefault(tuple(row), []).append((line_number, row))
+
+    with pooled_connection(server_name) as connection:
+        try:
+            connection.begin()
+            with connection.cursor() as cursor:
+                for columns, rows in groups.items():
+                    placeholders = ', '.join(['%s'] * len(columns))
+                    cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                                       [tuple(row.values()) for _, row in rows])
+                apply_totals(cursor, table, new_rows=[row for _, row in batch])
+                if table in DIVE_TABLES:
+                    sync_dive_sequence(cursor, [table])
+            connection.commit()
+            return []
+        except (pymysql.IntegrityError, pymysql.DataError):
+            connection.rollback()
+
+        # Some row broke the batch (e.g. a duplicate id) - insert one by one to find it.
+        # A refused row only undoes its own statement, the rest of the transaction stays.
+        failed = []
+        inserted = []
+        connection.begin()
+        with connection.cursor() as cursor:
+            for columns, rows in groups.items():
+                placeholders = ', '.join(['%s'] * len(columns))
+                for line_number, row in rows:
+                    try:
+                        cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                                       tuple(row.values()))
+                        inserted.append(row)
+                    except (pymysql.IntegrityError, pymysql.DataError) as e:
+                        failed.append((line_number, str(e)))
+            apply_totals(cursor, table, new_rows=inserted)
+            if inserted and table in DIVE_TABLES:
+                sync_dive_sequence(cursor, [table])
+        connection.commit()
+        return failed
+
+
+# Example call: query_bulk_import(Server1, 'combat', open('combat.csv', newline=''), 'csv', batch_size=5000)
+# Returns a report: rows inserted/rejected, the first rejected rows with reasons, elapsed time and rows per second
+def query_bulk_import(server_name: DBConnString, table: str, stream, file_format: str = 'csv',
+                      batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    if table not in schema_registry.table_names(server_name):
+        raise ValueError(f"Unknown table '{table}'")
+    if file_format not in READERS:
+        raise ValueError(f"Unknown format '{file_format}', expected one of: {', '.join(READERS)}")
+
+    validate = row_validator(table)
+    report = {'table': table, 'inserted': 0, 'rejected': 0, 'rejected_rows': [], 'batches': 0}
+
+    def reject(line_number, reason):
+        report['rejected'] += 1
+        if len(report['rejected_rows']) < MAX_REPORTED_REJECTS:
+            report['rejected_rows'].append({'line': line_number, 'reason': reason})
+
+    def flush(batch):
+        failed = _insert_batch(server_name, table, batch)
+        table_changed(table)
+        report['batches'] += 1
+        report['inserted'] += len(batch) - len(failed)
+        for line_number, reason in failed:
+            reject(line_number, reason)
+
+    start = time.perf_counter()
+    batch = []
+    try:
+        for line_number, row in READERS[file_format](stream):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append((line_number, validate(row)))
+            except RowRejected as e:
+                reject(line_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except pymysql.MySQLError as e:
+        log.error("Error importing into table '%s': %s", table, e)
+        report['error'] = str(e)
+
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    report['rows_per_second'] = round(report['inserted'] / report['seconds'], 1) if report['seconds'] else None
+    return report
+
+
+# EXPORT
+# ----------------------------
+# Rows come from an unbuffered cursor and leave as byte chunks, so an export runs in constant memory
+DIVES_VIEW = 'dives'  # one row per dive id with the columns of all dive tables
+EXPORT_CHUNK_ROWS = 5000
+COLUMNAR_MAGIC = b'HDCOL1\n'
+
+# Per-format conversions at fetch time; CSV writes the driver values as they are
+JSONL_CONVERTERS = {'DECIMAL': float, 'TIME': str}
+EXPORT_CONVERTERS = {'csv': {}, 'jsonl': JSONL_CONVERTERS, 'columnar': NUMERIC_CONVERTERS}
+
+
+def export_source(server_name: DBConnString, name: str, converters: dict):
+    # (column names, column types, row stream) of a table or of the per-dive view
+    if name != DIVES_VIEW:
+        if name not in schema_registry.table_names(server_name):
+            raise ValueError(f"Unknown table '{name}'")
+        columns = schema_registry.columns(server_name, name)
+        types = [schema_registry.column_type(name, column) for column in columns]
+        rows = query_stream_select(server_name, f"SELECT * FROM {name} ORDER BY id")
+        return columns, types, convert_rows(rows, column_converters(name, columns, converters))
+
+    # A dive may be missing from some tables, so the ids of all tables drive the LEFT JOINs
+    tables = [table for table in DIVE_TABLES if table in schema_registry.table_names(server_name)]
+    ids = ' UNION '.join(f"SELECT id FROM {table}" for table in tables)
+    columns, types, select_list, joins, row_converters = ['id'], ['INT'], ['d.id'], [], [None]
+    for n, table in enumerate(tables):
+        table_columns = [column for column in schema_registry.columns(server_name, table) if column != 'id']
+        columns.extend(table_columns)
+        types.extend(schema_registry.column_type(table, column) for column in table_columns)
+        select_list.extend(f"t{n}.{column}" for column in table_columns)
+        joins.append(f"LEFT JOIN {table} t{n} ON t{n}.id = d.id")
+        row_converters.extend(column_converters(table, table_columns, converters))
+    rows = query_stream_select(server_name,
+                               f"SELECT {', '.join(select_list)} FROM ({ids}) d {' '.join(joins)} ORDER BY d.id")
+    return columns, types, convert_rows(rows, row_converters)
+
+
+def write_csv(columns, types, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def write_jsonl(columns, types, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+# Columnar file: magic, uint32 header length + JSON header {columns: [{name, type}], byteorder}, then row groups of
+# up to EXPORT_CHUNK_ROWS rows, each a uint32 row count followed by every column in turn:
+#   n validity bytes (0 = NULL), then int64/float64 values (NULL stored as 0), or for str uint32 lengths + UTF-8 data.
+# A row count of 0 ends the file.
+def columnar_type(column_type: str) -> str:
+    column_type = column_type.upper()
+    if 'INT' in column_type:
+        return 'int64'
+    if column_type.startswith(('DECIMAL', 'TIME', 'FLOAT', 'DOUBLE')):
+        return 'float64'
+    return 'str'
+
+
+def _pack_column(kind, values):
+    validity = bytes(value is not None for value in values)
+    if kind == 'int64':
+        return validity + array.array('q', [0 if value is None else value for value in values]).tobytes()
+    if kind == 'float64':
+        return validity + array.array('d', [0.0 if value is None else value for value in values]).tobytes()
+    encoded = [b'' if value is None else str(value).encode() for value in values]
+    return validity + array.array('I', [len(value) for value in encoded]).tobytes() + b''.join(encoded)
+
+
+def write_columnar(columns, types, rows):
+    kinds = [columnar_type(column_type) for column_type in types]
+    header = json.dumps({'columns': [{'name': name, 'type': kind} for name, kind in zip(columns, kinds)],
+                         'byteorder': sys.byteorder}).encode()
+    yield COLUMNAR_MAGIC + struct.pack('<I', len(header)) + header
+
+    def row_group(group):
+        return struct.pack('<I', len(group)) + b''.join(
+            _pack_column(kind, values) for kind, values in zip(kinds, zip(*group)))
+
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) == EXPORT_CHUNK_ROWS:
+            yield row_group(group)
+            group = []
+    if group:
+        yield row_group(group)
+    yield struct.pack('<I', 0)
+
+
+def read_columnar(stream):
+    # Reader for write_columnar files, yields one {column: [values]} dict per row group
+    if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('Not a columnar export file')
+    header = json.loads(stream.read(struct.unpack('<I', stream.read(4))[0]))
+    swap = header['byteorder'] != sys.byteorder
+    while True:
+        n = struct.unpack('<I', stream.read(4))[0]
+        if n == 0:
+            return
+        group = {}
+        for column in header['columns']:
+            validity = stream.read(n)
+            if column['type'] == 'str':
+                lengths = array.array('I', stream.read(4 * n))
+                if swap:
+                    lengths.byteswap()
+                values = [stream.read(length).decode() for length in lengths]
+            else:
+                values = array.array('q' if column['type'] == 'int64' else 'd', stream.read(8 * n))
+                if swap:
+                    values.byteswap()
+            group[column['name']] = [value if valid else None for value, valid in zip(values, validity)]
+        yield group
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'columnar': write_columnar}
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'columnar': 'application/octet-stream'}
+EXPORT_EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'columnar': 'hdcol'}
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# Example call: for chunk in query_bulk_export(Server1, 'combat', 'csv'): out.write(chunk)
+# name is a table or DIVES_VIEW; yields bytes
+def query_bulk_export(server_name: DBConnString, name: str, file_format: str = 'csv', compress: bool = False):
+    if file_format not in WRITERS:
+        raise ValueError(f"Unknown format '{file_format}', expected one of: {', '.join(WRITERS)}")
+    columns, types, rows = export_source(server_name, name, EXPORT_CONVERTERS[file_format])
+    chunks = WRITERS[file_format](columns, types, rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# CLI
+# ----------------------------
+# python -m SQL.bulk import combat combat.csv --batch-size 5000
+# python -m SQL.bulk import currency_gained currency.jsonl --format jsonl
+# python -m SQL.bulk export dives dives.jsonl.gz --format jsonl --gzip
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SQL.bulk', description='Bulk import and export of dive data')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='import a CSV or JSON Lines file into a table')
+    import_parser.add_argument('table')
+    import_parser.add_argument('path', help="file to import, '-' for stdin")
+    import_parser.add_argument('--format', choices=sorted(READERS), default=None,
+                               help='default: taken from the file extension, csv otherwise')
+    import_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    export_parser = commands.add_parser('export', help='export a table, or every dive with all its tables')
+    export_parser.add_argument('name', help=f"table name or '{DIVES_VIEW}'")
+    export_parser.add_argument('path', help="output file, '-' for stdout")
+    export_parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    export_parser.add_argument('--gzip', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        file_format = args.format or ('jsonl' if args.path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if args.path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            stream = open(args.path, encoding='utf-8', newline='')
+        with stream:
+            report = query_bulk_import(Server1, args.table, stream, file_format, args.batch_size)
+        print(json.dumps(report, indent=2))
+        return 1 if 'error' in report else 0
+
+    if args.command == 'export':
+        start = time.perf_counter()
+        size = 0
+        out = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+        try:
+            for chunk in query_bulk_export(Server1, args.name, args.format, args.gzip):
+                out.write(chunk)
+                size += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        print(f"Exported '{args.name}' ({size} bytes) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+_MISSING = object()
+
+
+# In-process LRU cache with a TTL for query results, keyed per table.
+# Every write path calls invalidate(table): that drops the table's entries and bumps its generation, and a load
+# that started before the bump is not stored, so a result read while a write committed is never cached.
+class ResultCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (tables, expires_at, value), least recently used first
+        self._by_table = {}  # table -> set of keys
+        self._generations = {}  # table -> number of invalidations
+        self._epoch = 0  # bumped by clear()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _current_generations(self, tables) -> tuple:
+        return self._epoch, *(self._generations.get(table, 0) for table in tables)
+
+    def generations(self, tables) -> tuple:
+        with self._lock:
+            return self._current_generations(tables)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return _MISSING
+
+    def put(self, key, tables, value, generations: tuple) -> None:
+        with self._lock:
+            if self._current_generations(tables) != generations:
+                return  # a write happened while the value was loaded
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (tuple(tables), time.monotonic() + self.ttl, value)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_load(self, key, tables, loader):
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        generations = self.generations(tables)
+        value = loader()
+        if value is not None:  # query_* functions return None on errors, don't keep those
+            self.put(key, tables, value, generations)
+        return value
+
+    def _remove(self, key) -> None:
+        tables, _, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def invalidate(self, table: str) -> None:
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            self.invalidations += 1
+            for key in list(self._by_table.pop(table, ())):
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+result_cache = ResultCache()
+
+
+# Version and last-modified time of every table, bumped by each insert/update/delete in SQL/queries.py.
+# Drives the ETag/Last-Modified headers of the data pages. The versions live in this process, so the ETag also
+# carries a token unique to the process - a tag handed out by another worker or before a restart never matches.
+# They only see the writes of this process: with several workers a write handled by another one leaves them
+# unchanged, which is why app.py only answers conditional requests when ETAGS=on says one process serves them.
+class TableVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = f"{os.getpid()}-{time.time_ns()}"
+        self._started = datetime.now(timezone.utc).replace(microsecond=0)
+        self._versions = {}  # table -> (version, last_modified)
+        self._epoch = (0, self._started)  # bumped by bump_all()
+
+    def bump(self, table: str) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            version, _ = self._versions.get(table, (0, None))
+            self._versions[table] = (version + 1, now)
+
+    def bump_all(self) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._epoch = (self._epoch[0] + 1, now)
+
+    def state(self, tables) -> tuple:
+        # (versions, time of the last change) of the given tables
+        with self._lock:
+            epoch, last_modified = self._epoch
+            versions = [epoch]
+            for table in tables:
+                version, modified = self._versions.get(table, (0, None))
+                versions.append(version)
+                if modified is not None and modified > last_modified:
+                    last_modified = modified
+        return tuple(versions), last_modified
+
+    def etag(self, tables, *extra) -> tuple:
+        # Strong ETag for a response built from these tables (extra tells apart responses of the same tables),
+        # and its Last-Modified. HTTP dates have whole seconds, so Last-Modified is None until the second of the
+        # last change is over: a later write in that same second can't hide behind an If-Modified-Since of it.
+        versions, modified = self.state(tables)
+        key = repr((self._token, tuple(tables), versions, extra)).encode()
+        last_modified = modified.replace(microsecond=0)
+        if datetime.now(timezone.utc) - last_modified < timedelta(seconds=1):
+            last_modified = None
+        return hashlib.sha1(key).hexdigest(), last_modified
+
+
+table_versions = TableVersions()
+
+
+# Every write path calls these after committing
+def table_changed(table: str) -> None:
+    result_cache.invalidate(table)
+    table_versions.bump(table)
+
+
+def all_tables_changed() -> None:
+    result_cache.clear()
+    table_versions.bump_all()
+
+
+def _freeze(value):
+    # Make argument values usable in a cache key
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+# Read-through caching for a query_* function. tables(arguments) names the tables the result depends on,
+# by default the function's `table` argument. Callers pass fresh=True to skip the cache (e.g. before a write).
+def cached_query(tables=None):
+    def decorator(func):
+        signature = inspect.signature(func)
+        get_tables = tables or (lambda arguments: [arguments['table']])
+
+        @functools.wraps(func)
+        def wrapper(*args, fresh: bool = False, **kwargs):
+            if fresh:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__name__, *(_freeze(value) for value in bound.arguments.values()))
+            return result_cache.get_or_load(key, get_tables(bound.arguments), lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
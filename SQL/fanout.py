@@ -0,0 +1,53 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from SQL.logs import get_logger
+
+# Independent queries run at the same time on a shared, bounded thread pool, each on its own pooled
+# connection, so a page that needs four tables waits for its slowest query instead of the sum of all four.
+# Keep MAX_WORKERS at or below the connection pool's max_size, extra workers would only queue for connections.
+# A fanned-out call must not fan out again: it would wait on the pool it is running in.
+MAX_WORKERS = 8
+QUERY_TIMEOUT = 10.0  # seconds
+
+log = get_logger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='query')
+        return _executor
+
+
+# Example call: fan_out({'combat': (query_get_last_id_value, Server1, 'combat'), ...}) -> {'combat': 12, ...}
+# Every call gets `timeout` seconds from the start of the fan-out. A call that raises or runs out of time
+# gives None, like a query_* function that failed; a query still running is left to finish in the background.
+def fan_out(calls: dict, timeout: float = QUERY_TIMEOUT) -> dict:
+    if len(calls) == 1:
+        (key, (function, *args)), = calls.items()
+        return {key: function(*args)}  # nothing to overlap, skip the thread hop
+
+    executor = _get_executor()
+    # each call runs in a copy of the caller's context, so it still knows the route it serves (slow query log)
+    futures = {key: executor.submit(contextvars.copy_context().run, function, *args)
+               for key, (function, *args) in calls.items()}
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for key, future in futures.items():
+        if future not in done:
+            future.cancel()
+            log.error("Query '%s' did not finish within %s seconds", key, timeout)
+            results[key] = None
+        elif future.exception() is not None:
+            log.error("Query '%s' failed: %s", key, future.exception())
+            results[key] = None
+        else:
+            results[key] = future.result()
+    return results
@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import timedelta
+
+# Many simulated users at once: every user is a thread picking requests from a weighted mix (dashboard reads,
+# form submits, updates, deletes) until the duration is over. Runs in-process through the Flask test client
+# on a local database, or against a running server with --url.
+#
+#   python -m SQL.loadtest --users 16 --duration 30 --dives 10000
+#   python -m SQL.loadtest --url http://127.0.0.1:5000 --users 32 --mix dive=50,submit_data=50
+#
+# Writes go to the real tables of the target - don't point --url at a database you care about.
+
+DEFAULT_MIX = 'dive=30,all_dives=15,table_page=15,submit_data=15,update_data=10,submit_dive=10,delete_last_dive=5'
+HISTOGRAM_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # bucket upper bounds, plus one for slower
+POOL_SAMPLE_INTERVAL = 0.1  # seconds
+DIVE_TABLES = ('combat', 'currency_gained', 'objectives_completed', 'samples_gained')
+
+
+# REQUEST MIX
+# ----------------------------
+# Each action returns (method, path, form data, JSON body) for one request
+def _form_time(value: timedelta) -> str:
+    # MM:SS.dd as the objectives form asks for it
+    minutes, seconds = divmod(value.total_seconds(), 60)
+    return f"{int(minutes)}:{seconds:05.2f}"
+
+
+def form_values(rng: random.Random, table: str) -> dict:
+    from SQL.bench import generate_dive
+
+    values = generate_dive(rng)[table]
+    return {column: _form_time(value) if isinstance(value, timedelta) else str(value)
+            for column, value in values.items()}
+
+
+def _dive_form(rng):
+    return {table: form_values(rng, table) for table in DIVE_TABLES}
+
+
+ACTIONS = {
+    'dive': lambda rng: ('GET', '/dive', None, None),
+    'all_dives': lambda rng: ('GET', '/all_dives?limit=50', None, None),
+    'table_page': lambda rng: ('GET', f'/{rng.choice(DIVE_TABLES)}?limit=50', None, None),
+    'analytics': lambda rng: ('GET', '/analytics?last=20', None, None),
+    'submit_data': lambda rng: (lambda table: ('POST', f'/submit_data_{table}', form_values(rng, table), None))(
+        rng.choice(DIVE_TABLES)),
+    'update_data': lambda rng: (lambda table: ('POST', f'/update_data_{table}', form_values(rng, table), None))(
+        rng.choice(DIVE_TABLES)),
+    'submit_dive': lambda rng: ('POST', '/submit_dive', None, _dive_form(rng)),
+    'delete_last_dive': lambda rng: ('POST', '/delete_last_dive', None, None),
+}
+
+
+# 'dive=30,submit_data=10' -> {'dive': 30, 'submit_data': 10}
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action '{name}', choose from {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The request mix needs at least one action with a weight above 0")
+    return mix
+
+
+# TRANSPORTS
+# ----------------------------
+# send(method, path, form, json_body) -> HTTP status, 0 when the request didn't get an answer
+class TestClientTransport:
+    def __init__(self):
+        from app import app
+
+        app.logger.disabled = True  # 500s are counted, their tracebacks would drown the report
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, form=None, json_body=None) -> int:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=form, json=json_body)
+        response.get_data()
+        return response.status_code
+
+    def pool_stats(self) -> dict:
+        from SQL.queries import Server1, get_pool
+
+        return get_pool(Server1).stats() if Server1.backend == 'mysql' else {}
+
+
+class HTTPTransport:
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def send(self, method, path, form=None, json_body=None) -> int:
+        headers = {}
+        body = None
+        if json_body is not None:
+            body, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError):
+            return 0
+
+    def pool_stats(self) -> dict:
+        try:
+            with urllib.request.urlopen(self.base_url + '/pool_stats', timeout=self.timeout) as response:
+                return json.load(response)
+        except (urllib.error.URLError, OSError, ValueError):
+            return {}
+
+
+# RUN
+# ----------------------------
+class Results:
+    def __init__(self):
+        self.latencies = {}  # action -> [seconds]
+        self.statuses = {}  # action -> Counter of status codes
+        self.lock = threading.Lock()
+
+    def merge(self, latencies: dict, statuses: dict) -> None:
+        with self.lock:
+            for action, samples in latencies.items():
+                self.latencies.setdefault(action, []).extend(samples)
+            for action, counts in statuses.items():
+                self.statuses.setdefault(action, Counter()).update(counts)
+
+
+def user(transport, mix: dict, deadline: float, think: float, seed: int, results: Results) -> None:
+    rng = random.Random(seed)
+    actions, weights = list(mix), list(mix.values())
+    latencies, statuses = {}, {}
+    while time.perf_counter() < deadline:
+        action = rng.choices(actions, weights)[0]
+        method, path, form, json_body = ACTIONS[action](rng)
+        start = time.perf_counter()
+        try:
+            status = transport.send(method, path, form, json_body)
+        except Exception:
+            status = 0
+        latencies.setdefault(action, []).append(time.perf_counter() - start)
+        statuses.setdefault(action, Counter())[status] += 1
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+    results.merge(latencies, statuses)  # once per user, the workers don't contend on a lock per request
+
+
+# Peak of the connection pool while the users run, sampled from pool_stats()
+def sample_pool(transport, stop: threading.Event, peaks: dict) -> None:
+    while not stop.is_set():
+        for key, value in transport.pool_stats().items():
+            peaks[key] = max(peaks.get(key, 0), value)
+        stop.wait(POOL_SAMPLE_INTERVAL)
+
+
+def run(transport, users: int, duration: float, mix: dict, think: float = 0.0, seed: int = 1,
+        counters=None) -> dict:
+    results = Results()
+    peaks = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_pool, args=(transport, stop, peaks), daemon=True)
+    before = counters.snapshot() if counters else None
+
+    started = time.perf_counter()
+    deadline = started + duration
+    threads = [threading.Thread(target=user, args=(transport, mix, deadline, think, seed + n, results),
+                                name=f'user-{n}') for n in range(users)]
+    sampler.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    report = summarize(results, elapsed)
+    report.update({'users': users, 'duration_s': round(elapsed, 2), 'mix': mix, 'pool_peak': peaks})
+    if counters:
+        statements, connections, borrows = (after - first for after, first in zip(counters.snapshot(), before))
+        report['database'] = {'statements': statements, 'connections_opened': connections,
+                              'pool_borrows': borrows}
+    return report
+
+
+def histogram(samples: list) -> list:
+    counts = [0] * (len(HISTOGRAM_MS) + 1)
+    for sample in samples:
+        milliseconds = sample * 1000
+        counts[next((index for index, bound in enumerate(HISTOGRAM_MS) if milliseconds <= bound),
+                    len(HISTOGRAM_MS))] += 1
+    return counts
+
+
+def summarize(results: Results, elapsed: float) -> dict:
+    from SQL.bench import percentile
+
+    actions = {}
+    for action, samples in sorted(results.latencies.items()):
+        statuses = results.statuses[action]
+        errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400)
+        actions[action] = {
+            'requests': len(samples), 'errors': errors, 'error_rate': errors / len(samples),
+            'throughput_rps': len(samples) / elapsed,
+            'p50_ms': percentile(samples, 50) * 1000, 'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000, 'max_ms': max(samples) * 1000,
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'histogram': histogram(samples),
+        }
+    total = sum(action['requests'] for action in actions.values())
+    errors = sum(action['errors'] for action in actions.values())
+    everything = [sample for samples in results.latencies.values() for sample in samples]
+    return {'requests': total, 'errors': errors, 'error_rate': errors / total if total else 0.0,
+            'throughput_rps': total / elapsed,
+            'p50_ms': percentile(everything, 50) * 1000 if everything else None,
+            'p99_ms': percentile(everything, 99) * 1000 if everything else None,
+            'histogram': histogram(everything), 'actions': actions}
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['users']} users for {report['duration_s']}s: {report['requests']} requests, "
+          f"{report['throughput_rps']:.1f} req/s, {report['errors']} errors ({report['error_rate']:.2%})")
+    for name, action in report['actions'].items():
+        print(f"  {name:<18} {action['requests']:7} req {action['throughput_rps']:8.1f}/s  "
+              f"p50 {action['p50_ms']:8.2f} ms  p95 {action['p95_ms']:8.2f} ms  p99 {action['p99_ms']:8.2f} ms  "
+              f"max {action['max_ms']:8.2f} ms  errors {action['error_rate']:6.2%}  {action['statuses']}")
+    print("  latency histogram (ms):")
+    bounds = [f"<={bound}" for bound in HISTOGRAM_MS] + [f">{HISTOGRAM_MS[-1]}"]
+    widest = max(report['histogram']) or 1
+    for bound, count in zip(bounds, report['histogram']):
+        print(f"    {bound:>7} {count:8} {'#' * round(40 * count / widest)}")
+    if report['pool_peak']:
+        print(f"  connection pool peak: {report['pool_peak']}")
+    if 'database' in report:
+        database = report['database']
+        print(f"  database: {database['statements']} statements, {database['connections_opened']} connections "
+              f"opened, {database['pool_borrows']} pool borrows")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SQL.loadtest', description='Concurrent load test of the app')
+    parser.add_argument('--url', help='base URL of a running server, default is the in-process test client')
+    parser.add_argument('--backend', choices=('sqlite', 'memory', 'mysql'), default='sqlite',
+                        help='database of the in-process app')
+    parser.add_argument('--db-path', default='bench.db', help='SQLite file (recreated)')
+    parser.add_argument('--dives', type=int, default=1000, help='dives loaded before an in-process run')
+    parser.add_argument('--users', type=int, default=8, help='concurrent users')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"action=weight list, actions: {', '.join(ACTIONS)}")
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between requests of a user, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    counters = None
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        from SQL.bench import Counters, load_dives, use_backend
+
+        Server1 = use_backend(args.backend, args.db_path)
+        print(f"Loading {args.dives} dives ...", flush=True)
+        load_dives(Server1, args.dives)
+        counters = Counters()
+        counters.install()
+        transport = TestClientTransport()
+
+    # The in-process app prints from its query functions, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()) if counters else contextlib.nullcontext():
+        report = run(transport, args.users, args.duration, mix, args.think, args.seed, counters)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=1)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
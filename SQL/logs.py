@@ -0,0 +1,118 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+# Logging of the query layer and the app. Messages take %-style arguments, so a record below the level costs one
+# level check and nothing is formatted. Records that pass go on a queue, a background thread formats and writes
+# them: a request never waits on stderr.
+#
+#   log = get_logger(__name__)
+#   log.info("Row %s inserted into table '%s'", id_, table, extra=sampled(table=table))
+#
+# Fields passed in `extra` come out as key=value (text) or as keys of the JSON object (json).
+# Events marked with sampled() are high-frequency ones (a line per row written or read): only the first and then
+# 1 in LOG_SAMPLE of them per message are written, with sample_rate on the record.
+#
+# LOG_LEVEL  DEBUG | INFO | WARNING | ERROR, default WARNING
+# LOG_FORMAT text | json, default text
+# LOG_SAMPLE keep 1 in N of the sampled events, default 100 (1 keeps all)
+
+ROOT_LOGGER = 'dives'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_SAMPLE = int(os.environ.get('LOG_SAMPLE', 100))
+
+# Attributes every LogRecord has, anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName', 'sampled'}
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+# 'SQL.queries' -> logger 'dives.SQL.queries', all of them write through the handler of 'dives'
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def sampled(**fields) -> dict:
+    return {'sampled': True, **fields}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(funcName)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'function': record.funcName,
+                 'message': record.getMessage(), **_fields(record)}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Keeps the first and then every `rate`-th record of each sampled message, the others are dropped before they
+# reach the queue. Records without sampled() always pass.
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counters = {}  # (logger, message template) -> itertools.count
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or not getattr(record, 'sampled', False):
+            return True
+        key = (record.name, record.msg)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        if next(counter) % self.rate:  # next() of itertools.count is atomic
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message in the calling thread, leave that to the listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Called once by the app and the CLIs; the library modules only log. Without it WARNING and above still reach
+# stderr through Python's last-resort handler.
+def configure_logging(level: str = None, log_format: str = None, sample: int = None) -> None:
+    global _listener
+    with _configure_lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel((level or LOG_LEVEL).upper())
+        if _listener is not None:
+            return
+        output = logging.StreamHandler()
+        output.setFormatter(JsonFormatter() if (log_format or LOG_FORMAT) == 'json' else TextFormatter())
+        records = queue.SimpleQueue()
+        handler = _RecordQueueHandler(records)
+        handler.addFilter(SampleFilter(LOG_SAMPLE if sample is None else sample))
+        root.addHandler(handler)
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)  # writes what is still queued
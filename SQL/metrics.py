@@ -0,0 +1,233 @@
+import functools
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+import pymysql
+
+from SQL.slowlog import slow_query_log
+
+# Counters and histograms of what the app does to the database, served in the Prometheus text format at /metrics.
+# Statements are measured where every one of them passes: InstrumentedConnection.query(), the connection class of
+# the pool. Each is labelled with the query_* function that ran it and the table it touches. Recording is a dict
+# lookup and a few additions under a lock, small next to a round trip to the database.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+CALLER_DEPTH = 20  # frames searched for the calling query_* function
+
+
+def _label_text(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}  # label values -> number
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_label_text(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *label_values, value: float) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((label_values, (list(counts), total)) for label_values, (counts, total)
+                            in self._values.items())
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                labels = _label_text((*self.labels, 'le'), (*label_values, bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# DATABASE
+# ----------------------------
+query_duration = registry.register(Histogram(
+    'dives_query_duration_seconds', 'Time spent in a query_* function, cache hits excluded', ('function',)))
+query_rows = registry.register(Counter(
+    'dives_query_rows_total', 'Rows yielded by streaming query_* functions', ('function',)))
+statement_duration = registry.register(Histogram(
+    'dives_db_statement_duration_seconds', 'Time of one SQL statement including reading its result',
+    ('function', 'table')))
+rows_returned = registry.register(Counter(
+    'dives_db_rows_total', 'Rows returned or affected by SQL statements', ('function', 'table')))
+statement_errors = registry.register(Counter(
+    'dives_db_errors_total', 'SQL statements that raised', ('function', 'table', 'error')))
+commits = registry.register(Counter(
+    'dives_db_commits_total', 'Transactions committed', ('function',)))
+connections_opened = registry.register(Counter(
+    'dives_db_connections_opened_total', 'New connections to the database'))
+connections_reused = registry.register(Counter(
+    'dives_db_connections_reused_total', 'Connections borrowed from the pool without opening one'))
+pool_connections = registry.register(Gauge(
+    'dives_db_pool_connections', 'Connections of the pool at scrape time', ('state',)))
+
+# FLASK
+# ----------------------------
+request_duration = registry.register(Histogram(
+    'dives_http_request_duration_seconds', 'Time to handle a request, up to the first byte of a streamed body',
+    ('method', 'route', 'status')))
+cache_lookups = registry.register(Gauge(
+    'dives_cache_lookups', 'Result cache lookups since start, at scrape time', ('result',)))
+
+
+# First word after FROM/INTO/UPDATE/TABLE, a statement's main table ('' for SHOW, SELECT 1, ...)
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+`?(\w+)', re.IGNORECASE)
+
+
+def statement_table(sql) -> str:
+    if isinstance(sql, bytes):
+        sql = sql[:300].decode('utf-8', 'replace')
+    match = _TABLE_PATTERN.search(sql[:300])
+    return match.group(1) if match else ''
+
+
+def calling_function() -> str:
+    # Nearest query_* function on the stack of the current thread
+    frame = sys._getframe(2)
+    for _ in range(CALLER_DEPTH):
+        if frame is None:
+            break
+        name = frame.f_code.co_name
+        if name.startswith('query_'):
+            return name
+        frame = frame.f_back
+    return 'other'
+
+
+# Cursors of an InstrumentedConnection leave the statement and its parameters on the connection while they
+# run, the connection only gets the final SQL with the values filled in
+class _StatementCursor:
+    def execute(self, query, args=None):
+        self.connection.statement = (query, args)
+        try:
+            return super().execute(query, args)
+        finally:
+            self.connection.statement = None
+
+
+@functools.lru_cache(maxsize=None)
+def _statement_cursor_class(cursor_class):
+    return type(f"Statement{cursor_class.__name__}", (_StatementCursor, cursor_class), {})
+
+
+# Connection class of the pool: times every statement and counts its rows, errors and commits.
+# Statements slower than slow_query_log.threshold go to the slow query log (SQL/slowlog.py).
+class InstrumentedConnection(pymysql.connections.Connection):
+    statement = None  # (statement, parameters) of the cursor.execute() running on this connection
+
+    def connect(self, sock=None):
+        super().connect(sock)
+        connections_opened.inc()
+
+    def cursor(self, cursor=None):
+        return _statement_cursor_class(cursor or self.cursorclass)(self)
+
+    def query(self, sql, unbuffered=False):
+        function, table = calling_function(), statement_table(sql)
+        start = time.perf_counter()
+        try:
+            affected = super().query(sql, unbuffered)
+        except pymysql.MySQLError as e:
+            statement_errors.inc(function, table, type(e).__name__)
+            raise
+        elapsed = time.perf_counter() - start
+        statement_duration.observe(elapsed, function, table)
+        if not unbuffered:  # an unbuffered result reports no row count until it is read
+            rows_returned.inc(function, table, amount=affected)
+        if elapsed >= slow_query_log.threshold:
+            template, params = self.statement or (None, None)
+            slow_query_log.record(self, sql, template, params, function, table, elapsed,
+                                  None if unbuffered else affected)
+        return affected
+
+    def commit(self):
+        super().commit()
+        commits.inc(calling_function())
+
+
+def metrics_text(server_name=None) -> str:
+    # Gauges that are read from their owners when scraped
+    from SQL.cache import result_cache
+    from SQL.pool import get_pool
+
+    cache = result_cache.stats()
+    cache_lookups.set('hit', value=cache['hits'])
+    cache_lookups.set('miss', value=cache['misses'])
+    if server_name is not None and server_name.backend == 'mysql':
+        pool = get_pool(server_name).stats()
+        pool_connections.set('idle', value=pool['idle'])
+        pool_connections.set('in_use', value=pool['in_use'])
+    return registry.render()
@@ -0,0 +1,330 @@
+import re
+import sys
+
+import pymysql
+
+from SQL.bulk import integer_range
+from SQL.logs import get_logger
+from SQL.queries import DIVE_SEQUENCE, DIVE_TABLES, sync_dive_sequence, tquery_dive_sequence
+from SQL.schema import schema_registry
+from SQL.totals import SUMMARY_TABLE, rebuild_totals
+
+log = get_logger(__name__)
+
+# Schema migrations. Numbered steps in MIGRATIONS run once each and are recorded in schema_migrations;
+# after them every SQLQuery table is diffed against the live database (columns, types, indexes) and the
+# differences are applied with online ALTERs, so editing a definition in SQL/queries.py is the whole migration.
+# New columns and indexes are added at startup too; a changed column type only by an operator running
+# `python -m SQL.migrations migrate`, after checking the stored values fit the new type.
+# Columns that are in the database but not in the definition are reported, never dropped.
+MIGRATIONS_TABLE = 'schema_migrations'
+
+tquery_migrations = (f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+                     f"version INT UNSIGNED NOT NULL PRIMARY KEY, "
+                     f"description VARCHAR(255) NOT NULL, "
+                     f"applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP);")
+
+# ALGORITHM/LOCK clauses tried in order, the first one the server accepts wins.
+# INSTANT/INPLACE with LOCK=NONE keep the table writable. A type change mostly needs a table copy, which blocks
+# writes for as long as it runs: that is only done by an operator (migrate --allow-copy), never at startup.
+ADD_COLUMN_OPTIONS = ['ALGORITHM=INSTANT', 'ALGORITHM=INPLACE, LOCK=NONE']
+MODIFY_COLUMN_OPTIONS = ['ALGORITHM=INPLACE, LOCK=NONE']
+MODIFY_COLUMN_COPY_OPTIONS = [*MODIFY_COLUMN_OPTIONS, 'ALGORITHM=COPY, LOCK=SHARED']
+INDEX_OPTIONS = ['ALGORITHM=INPLACE, LOCK=NONE']
+
+
+class MigrationRefused(Exception):
+    pass
+
+
+def _normalize_type(column_type: str) -> str:
+    # 'INT(11) unsigned' -> 'int unsigned' (display widths are gone since MySQL 8.0.19)
+    column_type = re.sub(r"\s+", ' ', column_type.strip().lower())
+    return re.sub(r"\b(tinyint|smallint|mediumint|int|bigint)\(\d+\)", r"\1", column_type)
+
+
+def live_table(cursor, table: str) -> tuple:
+    # ({column: type}, {index name: [columns]}) of a table in the current database, ({}, {}) if it doesn't exist
+    cursor.execute("SELECT COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION", (table,))
+    columns = {row[0]: row[1] for row in map(_values, cursor.fetchall())}
+    cursor.execute("SELECT INDEX_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.STATISTICS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY' "
+                   "ORDER BY INDEX_NAME, SEQ_IN_INDEX", (table,))
+    indexes = {}
+    for index_name, column_name in map(_values, cursor.fetchall()):
+        indexes.setdefault(index_name, []).append(column_name)
+    return columns, indexes
+
+
+def _values(row) -> tuple:
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+
+# [(clauses, options)] turning the live table into its definition: one ALTER per kind of change.
+# Type changes are only planned with modify=True, otherwise they are reported and left as they are.
+def plan_table(definition, live_columns: dict, live_indexes: dict, modify: bool = False,
+               allow_copy: bool = False) -> list:
+    if not live_columns:
+        return [([definition.generate_query()], None)]
+
+    declared = ['id', *definition.columns]
+    added, modified = [], []
+    for position, column in enumerate(declared):
+        declared_type = definition.id_type if column == 'id' else definition.columns[column]
+        if column not in live_columns:
+            after = f"AFTER {declared[position - 1]}" if position else 'FIRST'
+            added.append(f"ADD COLUMN {definition.column_definition(column)} {after}")
+        elif _normalize_type(live_columns[column]) != _normalize_type(declared_type):
+            if modify:
+                modified.append(f"MODIFY COLUMN {definition.column_definition(column)}")
+            else:
+                log.warning("Column '%s.%s' is %s, the definition says %s: run python -m SQL.migrations migrate",
+                            definition.table_name, column, live_columns[column], declared_type)
+
+    indexes = []
+    for index_name, column_names in definition.indexes.items():
+        if live_indexes.get(index_name) == column_names:
+            continue
+        if index_name in live_indexes:
+            indexes.append(f"DROP INDEX {index_name}")
+        indexes.append(f"ADD {definition.index_definition(index_name)}")
+
+    for column in live_columns:
+        if column not in declared:
+            log.warning("Column '%s.%s' is not in the definition, left as it is", definition.table_name, column)
+    for index_name in live_indexes:
+        if index_name not in definition.indexes:
+            log.warning("Index '%s.%s' is not in the definition, left as it is", definition.table_name, index_name)
+
+    return [(clauses, options) for clauses, options in ((added, ADD_COLUMN_OPTIONS),
+                                                         (modified, MODIFY_COLUMN_COPY_OPTIONS if allow_copy
+                                                          else MODIFY_COLUMN_OPTIONS),
+                                                         (indexes, INDEX_OPTIONS)) if clauses]
+
+
+def _alter(cursor, table: str, clauses: list, options: list) -> str:
+    if options is None:  # CREATE TABLE
+        cursor.execute(clauses[0])
+        return clauses[0]
+    error = None
+    for option in options:
+        statement = f"ALTER TABLE {table} {', '.join(clauses)}, {option}"
+        try:
+            cursor.execute(statement)
+            return statement
+        except (pymysql.OperationalError, pymysql.InternalError, pymysql.ProgrammingError) as e:
+            error = e  # the server can't do it this way, try the next
+    hint = (" It needs a table copy, which blocks writes to the table while it runs: run "
+            "python -m SQL.migrations migrate --allow-copy when that is acceptable."
+            if options is MODIFY_COLUMN_OPTIONS else '')
+    raise MigrationRefused(f"ALTER TABLE {table} {', '.join(clauses)} can't be done online: {error}.{hint}")
+
+
+# Integer columns whose stored values don't fit their declared type, which a MODIFY would clamp, truncate or
+# fail on depending on sql_mode: ['table.column holds low..high, TYPE holds low..high']
+def out_of_range(cursor, definition, live_columns: dict) -> list:
+    problems = []
+    for column, declared_type in definition.columns.items():
+        if column not in live_columns or _normalize_type(live_columns[column]) == _normalize_type(declared_type):
+            continue
+        if not re.match(r"(tiny|small|medium|big)?int\b", declared_type, re.IGNORECASE):
+            continue
+        low, high = integer_range(declared_type)
+        cursor.execute(f"SELECT MIN({column}), MAX({column}) FROM {definition.table_name}")
+        smallest, largest = _values(cursor.fetchone())
+        if smallest is not None and (smallest < low or largest > high):
+            problems.append(f"{definition.table_name}.{column} holds {smallest}..{largest}, "
+                            f"{declared_type} holds {low}..{high}")
+    return problems
+
+
+# Diff every registered table (or the given ones) and apply the changes. dry_run only returns the statements.
+# Type changes only with modify=True, and never when a stored value wouldn't fit (MigrationRefused).
+def sync_tables(connection, tables: list = None, dry_run: bool = False, modify: bool = False,
+                allow_copy: bool = False) -> list:
+    statements = []
+    with connection.cursor() as cursor:
+        for table in tables or DIVE_TABLES:
+            definition = schema_registry.definition(table)
+            live_columns, live_indexes = live_table(cursor, table)
+            problems = out_of_range(cursor, definition, live_columns) if modify and live_columns else []
+            if problems and not dry_run:
+                raise MigrationRefused(f"Stored values don't fit the new column types, fix those rows first: "
+                                       f"{'; '.join(problems)}")
+            statements.extend(f"-- refused, stored values don't fit: {problem}" for problem in problems)
+            for clauses, options in plan_table(definition, live_columns, live_indexes, modify, allow_copy):
+                if dry_run:
+                    statements.append(clauses[0] if options is None
+                                      else f"ALTER TABLE {table} {', '.join(clauses)}, {options[0]}")
+                    continue
+                statement = _alter(cursor, table, clauses, options)
+                log.info("Applied: %s", statement)
+                statements.append(statement)
+    return statements
+
+
+# NUMBERED MIGRATIONS
+# ----------------------------
+# Changes a diff can't express (renames, new bookkeeping tables and their backfill). Append, never reorder.
+def _rename_times_reinforcing(connection) -> None:
+    with connection.cursor() as cursor:
+        live_columns, _ = live_table(cursor, 'combat')
+        if 'times_reinforcing_' in live_columns and 'times_reinforcing' not in live_columns:
+            cursor.execute("ALTER TABLE combat RENAME COLUMN times_reinforcing_ TO times_reinforcing")
+
+
+def _create_totals(connection) -> None:
+    rebuild_totals(connection, DIVE_TABLES)  # creates the table and fills it from the stored dives
+
+
+def _create_dive_sequence(connection) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(tquery_dive_sequence)
+        sync_dive_sequence(cursor)
+    connection.commit()
+
+
+MIGRATIONS = [
+    (1, 'rename combat.times_reinforcing_ to times_reinforcing', _rename_times_reinforcing),
+    (2, 'create the dive tables', sync_tables),
+    (3, 'dive_totals summary table', _create_totals),
+    (4, 'dive_sequence id sequence', _create_dive_sequence),
+]
+
+
+def applied_versions(connection) -> set:
+    with connection.cursor() as cursor:
+        cursor.execute(tquery_migrations)
+        cursor.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+        return {_values(row)[0] for row in cursor.fetchall()}
+
+
+# Run the pending numbered migrations in order, then bring every table in line with its definition.
+# DDL can't be rolled back in MySQL, so a version is recorded right after it succeeded and a failed run
+# resumes at the failed step. Returns what was (or with dry_run, would be) done.
+# Column type changes only with modify=True: the operator's `migrate`, not the startup bootstrap.
+def migrate(connection, dry_run: bool = False, modify: bool = False, allow_copy: bool = False) -> list:
+    done = []
+    applied = applied_versions(connection)
+    for version, description, apply in MIGRATIONS:
+        if version in applied:
+            continue
+        done.append(f"{version}: {description}")
+        if dry_run:
+            continue
+        log.info("Migration %s: %s", version, description)
+        apply(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (%s, %s)",
+                           (version, description))
+        connection.commit()
+    done.extend(sync_tables(connection, dry_run=dry_run, modify=modify, allow_copy=allow_copy))
+    return done
+
+
+# BOOTSTRAP
+# ----------------------------
+# What the app needs at startup, checked with a single INFORMATION_SCHEMA query: whether the database exists,
+# and every column (with the secondary indexes it is part of) of every table in it.
+# No rows -> no database, one row with a NULL table -> an empty database.
+tquery_live_database = ("SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.ORDINAL_POSITION, "
+                        "s.INDEX_NAME, s.SEQ_IN_INDEX "
+                        "FROM INFORMATION_SCHEMA.SCHEMATA d "
+                        "LEFT JOIN INFORMATION_SCHEMA.COLUMNS c ON c.TABLE_SCHEMA = d.SCHEMA_NAME "
+                        "LEFT JOIN INFORMATION_SCHEMA.STATISTICS s ON s.TABLE_SCHEMA = c.TABLE_SCHEMA "
+                        "AND s.TABLE_NAME = c.TABLE_NAME AND s.COLUMN_NAME = c.COLUMN_NAME "
+                        "AND s.INDEX_NAME <> 'PRIMARY' "
+                        "WHERE d.SCHEMA_NAME = %s")
+BOOKKEEPING_TABLES = (MIGRATIONS_TABLE, SUMMARY_TABLE, DIVE_SEQUENCE)
+BOOTSTRAP_LOCK_TIMEOUT = 60  # seconds a worker waits for another one that is creating or migrating the tables
+
+
+# (database exists, {table: ({column: type}, {index name: [columns]})}) - the same shape as live_table()
+def live_database(cursor, database: str) -> tuple:
+    cursor.execute(tquery_live_database, (database,))
+    exists, columns, indexes = False, {}, {}
+    for table, column, column_type, position, index_name, seq in map(_values, cursor.fetchall()):
+        exists = True
+        if table is None:
+            continue
+        columns.setdefault(table, {})[column] = (position, column_type)
+        if index_name is not None:
+            indexes.setdefault(table, {}).setdefault(index_name, {})[seq] = column
+    live = {}
+    for table, table_columns in columns.items():
+        live[table] = ({column: column_type for column, (_, column_type)
+                        in sorted(table_columns.items(), key=lambda item: item[1][0])},
+                       {index_name: [index_columns[seq] for seq in sorted(index_columns)]
+                        for index_name, index_columns in indexes.get(table, {}).items()})
+    return exists, live
+
+
+def up_to_date(cursor, live: dict) -> bool:
+    if any(table not in live for table in BOOKKEEPING_TABLES):
+        return False
+    if any(plan_table(schema_registry.definition(table), *live.get(table, ({}, {}))) for table in DIVE_TABLES):
+        return False
+    cursor.execute(f"SELECT version FROM {MIGRATIONS_TABLE}")
+    return {_values(row)[0] for row in cursor.fetchall()} >= {version for version, _, _ in MIGRATIONS}
+
+
+# Create the database and bring its tables up to date, on a connection made without a database.
+# When nothing needs doing that is the metadata query and a read of schema_migrations. Otherwise the work runs
+# under a named lock, so workers starting together don't migrate twice; migrate() is idempotent, the worker
+# that got the lock second finds nothing left to do.
+# Returns (what was done, live tables) - the live tables only when nothing was done (None otherwise, they changed).
+def bootstrap_database(connection, database: str) -> tuple:
+    lock_name = f"{database}.bootstrap"
+    with connection.cursor() as cursor:
+        exists, live = live_database(cursor, database)
+        if exists:
+            connection.select_db(database)
+            if up_to_date(cursor, live):
+                return [], live
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, BOOTSTRAP_LOCK_TIMEOUT))
+        if not _values(cursor.fetchone())[0]:
+            raise pymysql.OperationalError(f"Timed out waiting for lock '{lock_name}'")
+    try:
+        done = []
+        if not exists:
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+            connection.select_db(database)
+            done.append(f"created database {database}")
+        done.extend(migrate(connection))
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+    return done, None
+
+
+# python -m SQL.migrations [plan|migrate] [--allow-copy]
+# --allow-copy lets a column type change fall back to a table copy, which blocks writes while it runs
+def main(argv=None):
+    from SQL.queries import Server1, all_tables_changed, pooled_connection
+
+    argv = sys.argv[1:] if argv is None else argv
+    allow_copy = '--allow-copy' in argv
+    command = [arg for arg in argv if arg != '--allow-copy']
+    if command not in (['plan'], ['migrate']):
+        print("usage: python -m SQL.migrations [plan|migrate] [--allow-copy]")
+        return 2
+    try:
+        with pooled_connection(Server1) as connection:
+            done = migrate(connection, dry_run=command == ['plan'], modify=True, allow_copy=allow_copy)
+    except (pymysql.MySQLError, MigrationRefused) as e:
+        print(f"Error migrating: {e}")
+        return 1
+    if command == ['migrate']:
+        schema_registry.invalidate(Server1)
+        all_tables_changed()
+    for step in done:
+        print(step)
+    if not done:
+        print("Schema is up to date")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+from SQL.metrics import InstrumentedConnection, connections_reused
+
+
+class PoolTimeout(pymysql.err.OperationalError):
+    # Subclass of a MySQLError so the existing `except pymysql.MySQLError` handlers catch it
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, conn_string, min_size: int = 1, max_size: int = 10, idle_timeout: float = 300.0,
+                 check_after: float = 5.0, acquire_timeout: float = 10.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.conn_string = conn_string
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout  # idle connections above min_size are closed after this many seconds
+        self.check_after = check_after  # connections idle longer than this are pinged on borrow
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # [(connection, last_used)], most recently used at the end
+        self._size = 0  # idle + borrowed
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _open(self):
+        cs = self.conn_string
+        # autocommit so a reused connection never carries a stale REPEATABLE READ snapshot;
+        # multi-statement writes open an explicit transaction with connection.begin()
+        connection = InstrumentedConnection(
+            host=cs.server,
+            database=cs.database,
+            user=cs.username,
+            password=cs.password,
+            port=cs.port,
+            cursorclass=cs.cursorclass,
+            autocommit=True
+        )
+        connection.conn_string = cs  # the slow query log EXPLAINs on a connection of the same pool
+        return connection
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        # Caller holds self._cond. Oldest idle connections sit at the front of the list.
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.pop(0)
+            self._size -= 1
+            self._close_quietly(connection)
+
+    def warm(self) -> None:
+        # Pre-open min_size connections, e.g. at app start
+        opened = []
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        try:
+            for _ in range(missing):
+                opened.append(self._open())
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                now = time.monotonic()
+                self._idle.extend((connection, now) for connection in opened)
+                self._cond.notify_all()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout(f"Connection pool for '{self.conn_string.server}' is closed")
+                self._evict_idle()
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free connection in pool for '{self.conn_string.server}' "
+                                      f"after {self.acquire_timeout} seconds")
+                self._cond.wait(remaining)
+
+        if connection is not None:
+            if time.monotonic() - last_used <= self.check_after:
+                connections_reused.inc()
+                return connection
+            try:
+                connection.ping(reconnect=False)
+                connections_reused.inc()
+                return connection
+            except pymysql.MySQLError:
+                # Dead connection (server restart, wait_timeout) - replace it, keeping the slot
+                self._close_quietly(connection)
+
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection, broken: bool = False) -> None:
+        if not broken:
+            try:
+                if connection.open and connection.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    connection.rollback()  # never hand out a connection with a half-done transaction
+            except pymysql.MySQLError:
+                broken = True
+            broken = broken or not connection.open
+
+        with self._cond:
+            if broken or self._closed:
+                self._size -= 1
+                self._close_quietly(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.release(connection, broken=True)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def clear(self) -> None:
+        # Close every idle connection; borrowed ones are closed when released
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+        self.clear()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                    'max_size': self.max_size}
+
+
+# One pool per DBConnString object
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(conn_string) -> ConnectionPool:
+    pool = _pools.get(conn_string)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(conn_string)
+            if pool is None:
+                pool = ConnectionPool(conn_string,
+                                      min_size=conn_string.pool_min_size,
+                                      max_size=conn_string.pool_max_size,
+                                      idle_timeout=conn_string.pool_idle_timeout)
+                _pools[conn_string] = pool
+    return pool
+
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,193 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import parse_qs, parse_qsl, urlencode
+
+# Profile one request on demand, in production, without redeploying. Only active when PROFILE_TOKEN is set;
+# a request carrying the token (X-Profile-Token header or profile_token query parameter) is profiled, every
+# other request passes straight through.
+#
+#   curl -H "X-Profile-Token: $PROFILE_TOKEN" "http://host/all_dives"             -> stack sampling
+#   curl -H "X-Profile-Token: $PROFILE_TOKEN" -H "X-Profile-Mode: cprofile" ...   -> deterministic (cProfile)
+#
+# The whole response is produced inside the profile, streamed bodies included, so template rendering counts.
+# The response comes back as usual with an X-Profile-Id header; the artifacts are in PROFILE_DIR and served at
+# /debug/profiles/<id>.<ext> (same token):
+#   <id>.txt        top-N summary
+#   <id>.collapsed  collapsed stacks (sample mode), input of flamegraph.pl or speedscope.app
+#   <id>.prof       pstats dump (cprofile mode), for snakeviz or python -m pstats
+# Only the thread handling the request is profiled, queries fanned out to other threads show as waiting.
+#
+# PROFILE_TOKEN  required, profiling is off without it
+# PROFILE_DIR    where artifacts go, default 'profiles'
+# PROFILE_KEEP   profiles kept, older ones are deleted, default 50
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+SAMPLE_INTERVAL = 0.005  # seconds - the GIL switch interval, a busy request thread can't be sampled faster
+TOP_N = 30
+MODES = ('sample', 'cprofile')
+ARTIFACT_NAME = re.compile(r'^[\w.-]+\.(txt|collapsed|prof)$')
+
+
+def token_matches(token) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(str(token), PROFILE_TOKEN)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# Samples the stack of one thread from a background thread: {stack (root first): samples}
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = TOP_N) -> str:
+        total = sum(self.stacks.values()) or 1
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+        lines = [f"{sum(self.stacks.values())} samples every {self.interval * 1000:g} ms", '',
+                 'own time (where the thread was)']
+        lines += [f"{count / total:7.1%} {count:6} {name}" for name, count in own.most_common(top)]
+        lines += ['', 'total time (function and everything it called)']
+        lines += [f"{count / total:7.1%} {count:6} {name}" for name, count in inclusive.most_common(top)]
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    # WSGI middleware around app.wsgi_app
+    def __init__(self, wsgi_app, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.keep = keep
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/debug/profiles'):
+            return self.wsgi_app(environ, start_response)  # reading a profile isn't profiled
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        token = environ.get('HTTP_X_PROFILE_TOKEN') or next(iter(query.get('profile_token', [])), None)
+        if token is None or not token_matches(token):
+            return self.wsgi_app(environ, start_response)
+        mode = environ.get('HTTP_X_PROFILE_MODE') or next(iter(query.get('profile_mode', [])), 'sample')
+        if mode not in MODES:
+            mode = 'sample'
+
+        response = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, headers
+            return lambda data: response.setdefault('written', []).append(data)
+
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            profile = StackSampler(threading.get_ident())
+            profile.start()
+        try:
+            body = self._run(environ, capture_start_response)
+        finally:
+            if mode == 'cprofile':
+                profile.disable()
+            else:
+                profile.stop()
+        elapsed = time.perf_counter() - started
+
+        profile_id = self._save(profile, mode, environ, elapsed)
+        headers = [(name, value) for name, value in response['headers'] if name.lower() != 'content-length']
+        body = b''.join(response.get('written', [])) + body
+        headers += [('Content-Length', str(len(body))), ('X-Profile-Id', profile_id)]
+        start_response(response['status'], headers)
+        return [body]
+
+    def _run(self, environ, start_response) -> bytes:
+        # Runs the app and reads the whole body, so a streamed template renders inside the profile
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            return b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def _save(self, profile, mode: str, environ, elapsed: float) -> str:
+        path = re.sub(r'[^\w]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'index'
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{path}-{secrets.token_hex(3)}"
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        query = urlencode([(key, value) for key, value in parse_qsl(environ.get('QUERY_STRING', ''))
+                           if key != 'profile_token'])  # the token doesn't go to disk
+        header = (f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}{'?' + query if query else ''}"
+                  f" - {elapsed * 1000:.1f} ms, {mode}\n\n")
+
+        if mode == 'cprofile':
+            profile.dump_stats(base + '.prof')
+            text = io.StringIO()
+            stats = pstats.Stats(profile, stream=text)
+            stats.sort_stats('cumulative').print_stats(TOP_N)
+            stats.sort_stats('tottime').print_stats(TOP_N)
+            summary = text.getvalue()
+        else:
+            with open(base + '.collapsed', 'w') as file:
+                file.write(profile.collapsed())
+            summary = profile.summary()
+        with open(base + '.txt', 'w') as file:
+            file.write(header + summary)
+        self._prune()
+        return profile_id
+
+    def _prune(self) -> None:
+        # Keep the newest `keep` profiles, ids start with their time so names sort by age
+        ids = sorted({name.rsplit('.', 1)[0] for name in os.listdir(self.directory) if ARTIFACT_NAME.match(name)})
+        for old_id in ids[:-self.keep] if self.keep else ():
+            for extension in ('txt', 'collapsed', 'prof'):
+                try:
+                    os.remove(os.path.join(self.directory, f"{old_id}.{extension}"))
+                except FileNotFoundError:
+                    pass
+
+
+# Artifact file names, newest first
+def profile_artifacts(directory: str = PROFILE_DIR) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if ARTIFACT_NAME.match(name)), reverse=True)
@@ -1,31 +1,65 @@
+import functools
+import inspect
 import os
 import pymysql
+import threading
 import time
 
+from SQL.cache import all_tables_changed, cached_query, result_cache, table_changed, table_versions
+from SQL.logs import get_logger, sampled
+from SQL.metrics import InstrumentedConnection, query_duration, query_rows
+from SQL.pool import get_pool
+from SQL.schema import schema_registry
+from SQL.totals import SUMMARY_TABLE, apply_totals, clear_totals, lock_rows, totals_deltas, write_totals
+
+log = get_logger(__name__)
+
 
 class DBConnString:
-    def __init__(self, server, database, username, password, port=3306):
+    def __init__(self, server, database, username, password, port=3306,
+                 pool_min_size=1, pool_max_size=10, pool_idle_timeout=300, backend='mysql'):
+        self.backend = backend  # 'mysql', or 'sqlite' (database is the file path) / 'memory', see SQL/backends.py
         self.server = server
         self.database = database
         self.username = username
         self.password = password
         self.port = port
         self.cursorclass = pymysql.cursors.DictCursor
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pool_idle_timeout = pool_idle_timeout  # seconds
 
 
 class SQLQuery:
+    id_type = 'INT UNSIGNED'
+
     def __init__(self, table_name, **kwargs):
         self.table_name = table_name
         self.columns = kwargs
+        self.indexes = {}  # index name -> column names, secondary indexes only (id is the primary key)
 
     def add_column(self, column_name, column_type):
         self.columns[column_name] = column_type
 
+    # InnoDB secondary indexes carry the primary key, so an index also covers `id`
+    def add_index(self, index_name, *column_names):
+        self.indexes[index_name] = list(column_names)
+
+    def column_definition(self, column_name):
+        if column_name == 'id':
+            return f"id {self.id_type} NOT NULL AUTO_INCREMENT"
+        return f"{column_name} {self.columns[column_name]}"
+
+    def index_definition(self, index_name):
+        return f"INDEX {index_name} ({', '.join(self.indexes[index_name])})"
+
     def generate_query(self):
         query = f"CREATE TABLE IF NOT EXISTS {self.table_name} ("
-        column_definitions = [f"id INT AUTO_INCREMENT PRIMARY KEY"]  # first column
-        for column_name, column_type in self.columns.items():
-            column_definitions.append(f"{column_name} {column_type}")
+        column_definitions = [f"{self.column_definition('id')} PRIMARY KEY"]  # first column
+        for column_name in self.columns:
+            column_definitions.append(self.column_definition(column_name))
+        for index_name in self.indexes:
+            column_definitions.append(self.index_definition(index_name))
         query += ", ".join(column_definitions)
         query += ");"
         return query
@@ -34,7 +68,7 @@ class SQLQuery:
 # WORKS
 def connect(conn_string: DBConnString):
     try:
-        conn = pymysql.connect(
+        conn = InstrumentedConnection(
             host=conn_string.server,
             database=conn_string.database,
             user=conn_string.username,
@@ -45,56 +79,143 @@ def connect(conn_string: DBConnString):
         return conn
 
     except pymysql.connect.Error as e:
-        print(f'Error in connect()')
-        print(f"Error connecting to the database: {e}")
+        log.error("Error connecting to the database: %s", e)
         return None
 
 
+# Borrow a connection from the pool of conn_string, it goes back to the pool when the block exits
+# with pooled_connection(Server1) as connection: ...
+def pooled_connection(conn_string: DBConnString):
+    require_mysql(conn_string)
+    return get_pool(conn_string).connection()
+
+
+# raw SQL helpers (aggregates, totals, bulk, migrations, streams) only exist for MySQL
+def require_mysql(conn_string: DBConnString) -> None:
+    if conn_string.backend != 'mysql':
+        raise pymysql.err.NotSupportedError(f"Needs the MySQL backend, not '{conn_string.backend}'")
+
+
+# query_* functions marked with this run on the backend of their DBConnString: the MySQL code below,
+# or the method of the same name of the SQLite/in-memory backend. The time of each call goes to /metrics.
+# A generator (query_stream_table) does its work while it is iterated: its time is taken when it is
+# exhausted or closed, from the call on, so it includes the caller's time between rows, and its rows are
+# counted in dives_query_rows_total.
+def backend_dispatch(func):
+    @functools.wraps(func)
+    def wrapper(server_name, *args, **kwargs):
+        start = time.perf_counter()
+        streamed = False
+        try:
+            if server_name.backend == 'mysql':
+                result = func(server_name, *args, **kwargs)
+            else:
+                from SQL.backends import get_backend  # imports this module
+
+                result = getattr(get_backend(server_name), func.__name__)(*args, **kwargs)
+            if inspect.isgenerator(result):
+                streamed = True
+                return _observed_stream(result, func.__name__, start)
+            return result
+        finally:
+            if not streamed:
+                query_duration.observe(time.perf_counter() - start, func.__name__)
+
+    return wrapper
+
+
+def _observed_stream(rows, function: str, start: float):
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        rows.close()  # the caller stopped early: lets the stream hand its connection back now
+        query_duration.observe(time.perf_counter() - start, function)
+        query_rows.inc(function, amount=count)
+
+
 # CONN STRING FOR SERVERS
-Server1 = DBConnString(
-    os.environ['AWS_RDS_ENDPOINT'],
-    os.environ['AWS_RDS_DATABASE'],
-    os.environ['AWS_RDS_USERNAME'],
-    os.environ['AWS_RDS_PASSWORD'],
-)
+# DB_BACKEND=sqlite DB_PATH=dives.db (or DB_BACKEND=memory) runs without the RDS instance
+def server_from_environment() -> dict:
+    backend = os.environ.get('DB_BACKEND', 'mysql')
+    if backend != 'mysql':
+        return {'server': '', 'database': os.environ.get('DB_PATH', 'dives.db'), 'username': '', 'password': '',
+                'backend': backend}
+    return {'server': os.environ['AWS_RDS_ENDPOINT'], 'database': os.environ['AWS_RDS_DATABASE'],
+            'username': os.environ['AWS_RDS_USERNAME'], 'password': os.environ['AWS_RDS_PASSWORD']}
+
+
+# A DBConnString whose settings are read by `loader` when one of them is first used, not at import:
+# importing this module touches neither the environment nor the database
+class LazyConnString(DBConnString):
+    def __init__(self, loader):
+        self._loader = loader
+        self._load_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, i.e. before the first load
+        if name.startswith('_'):
+            raise AttributeError(name)
+        with self._load_lock:
+            if 'backend' not in vars(self):
+                DBConnString.__init__(self, **self._loader())
+        return object.__getattribute__(self, name)
+
+
+Server1 = LazyConnString(server_from_environment)
+
+# TABLE DEFINITIONS
+# Smallest integer type that holds a dive's values: TINYINT 0-255, SMALLINT 0-65535, MEDIUMINT 0-16777215 (UNSIGNED)
+table_objectives = SQLQuery(table_name='objectives_completed',
+                            main_objectives='TINYINT UNSIGNED',
+                            optional_objectives='TINYINT UNSIGNED',
+                            helldivers_extracted='TINYINT UNSIGNED',
+                            outposts_destroyed_light='TINYINT UNSIGNED',
+                            outposts_destroyed_medium='TINYINT UNSIGNED',
+                            outposts_destroyed_heavy='TINYINT UNSIGNED',
+                            mission_time_remaining='TIME'
+                            )
+table_objectives.add_index('ix_objectives_main', 'main_objectives')  # samples per mission GROUP BY
+
+table_samples = SQLQuery(table_name='samples_gained',
+                         green_samples='SMALLINT UNSIGNED',
+                         orange_samples='SMALLINT UNSIGNED',
+                         violet_samples='SMALLINT UNSIGNED'
+                         )
+
+table_currency = SQLQuery(table_name='currency_gained',
+                          requisition='MEDIUMINT UNSIGNED',
+                          medals='SMALLINT UNSIGNED',
+                          xp='MEDIUMINT UNSIGNED'
+                          )
+
+table_combat = SQLQuery(table_name='combat',
+                        kills='SMALLINT UNSIGNED',
+                        accuracy="DECIMAL(5,2)",
+                        shots_fired='SMALLINT UNSIGNED',
+                        deaths='SMALLINT UNSIGNED',
+                        stims_used='SMALLINT UNSIGNED',
+                        accidentals='SMALLINT UNSIGNED',
+                        samples_extracted='SMALLINT UNSIGNED',
+                        stratagems_used='SMALLINT UNSIGNED',
+                        melee_kills='SMALLINT UNSIGNED',
+                        times_reinforcing='SMALLINT UNSIGNED',  # deleted _ at the end everywhere
+                        friendly_fire_damage='MEDIUMINT UNSIGNED',
+                        distance_travelled='MEDIUMINT UNSIGNED',
+                        )
+table_combat.add_index('ix_combat_deaths_stims', 'deaths', 'stims_used')  # deaths vs stims GROUP BY, covering
+
+# Registered in the order the pages show them
+for table_definition in (table_combat, table_currency, table_objectives, table_samples):
+    schema_registry.register(table_definition)
 
 # QUERIES FOR CREATING EMPTY TABLES
-tquery_objectives = SQLQuery(table_name='objectives_completed',
-                             main_objectives='INT',
-                             optional_objectives='INT',
-                             helldivers_extracted='INT',
-                             outposts_destroyed_light='INT',
-                             outposts_destroyed_medium='INT',
-                             outposts_destroyed_heavy='INT',
-                             mission_time_remaining='TIME'
-                             ).generate_query()
-
-tquery_samples = SQLQuery(table_name='samples_gained',
-                          green_samples='INT',
-                          orange_samples='INT',
-                          violet_samples='INT'
-                          ).generate_query()
-
-tquery_currency = SQLQuery(table_name='currency_gained',
-                           requisition='INT',
-                           medals='INT',
-                           xp='INT'
-                           ).generate_query()
-
-tquery_combat = SQLQuery(table_name='combat',
-                         kills='INT',
-                         accuracy="DECIMAL(5,2)",
-                         shots_fired='INT',
-                         deaths='INT',
-                         stims_used='INT',
-                         accidentals='INT',
-                         samples_extracted='INT',
-                         stratagems_used='INT',
-                         melee_kills='INT',
-                         times_reinforcing='INT',  # deleted _ at the end everywhere
-                         friendly_fire_damage='INT',
-                         distance_travelled='INT',
-                         ).generate_query()
+tquery_objectives = table_objectives.generate_query()
+tquery_samples = table_samples.generate_query()
+tquery_currency = table_currency.generate_query()
+tquery_combat = table_combat.generate_query()
 
 
 # CREATE TABLES
@@ -120,30 +241,31 @@ tquery_combat = SQLQuery(table_name='combat',
 
 # NEW
 def query_create_tables(server_name: DBConnString, db_name: str, table_queries: list) -> None:
-    connection = connect(server_name)
-    if connection:
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute(f"USE {db_name}")  # Switch to the target database
-                for table_query in table_queries:
-                    cursor.execute(table_query)
-                    print(f'Table "{table_query.split(" ")[2]}" created')
-                connection.commit()
-        except pymysql.MySQLError as e:
-            print(f'Error in query_create_tables()')
-            print(f"Error creating tables in database '{db_name}': {e}")
-        finally:
-            connection.close()
+    try:
+        with pooled_connection(server_name) as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"USE {db_name}")  # Switch to the target database
+                    for table_query in table_queries:
+                        cursor.execute(table_query)
+                        log.info("Table '%s' created", table_query.split(" ")[5])
+                    connection.commit()
+            finally:
+                connection.select_db(server_name.database)  # pooled connection goes back on its own database
+                schema_registry.invalidate(server_name)
+                all_tables_changed()
+    except pymysql.MySQLError as e:
+        log.error("Error creating tables in database '%s': %s", db_name, e)
 
 
 # READ TABLES
 # ----------------------------
 # WORKS
+@backend_dispatch
 def query_read_row(server_name: DBConnString, table: str, row_id: int) -> None:
     sql_query = f"SELECT * FROM {table} WHERE id = %s"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query, (row_id,))
                 row = cursor.fetchone()
@@ -151,11 +273,8 @@ def query_read_row(server_name: DBConnString, table: str, row_id: int) -> None:
                     print(row)
                 else:
                     print(f"No row with id {row_id} found in table '{table}'")
-        else:
-            print("Connection to database failed.")
     except pymysql.MySQLError as e:
-        print(f'Error in query_read_row()')
-        print(f"Error reading row from table '{table}': {e}")
+        log.error("Error reading row from table '%s': %s", table, e)
 
 
 # OUTPUT OF IT
@@ -164,11 +283,11 @@ def query_read_row(server_name: DBConnString, table: str, row_id: int) -> None:
 # {'id': 4, 'requisition': 1, 'medals': 1, 'xp': 2137}
 
 # WORKS
+@backend_dispatch
 def query_read_table(server_name: DBConnString, table: str) -> None:
     sql_query = f"SELECT * FROM {table}"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query)
                 rows = cursor.fetchall()
@@ -177,43 +296,70 @@ def query_read_table(server_name: DBConnString, table: str) -> None:
                         print(row)
                 else:
                     print(f"No data found in table '{table}'")
-        else:
-            print("Connection to database failed.")
     except pymysql.MySQLError as e:
-        print(f'Error in query_read_table()')
-        print(f"Error reading table '{table}': {e}")
+        log.error("Error reading table '%s': %s", table, e)
 
 
 # GET TABLES
 # ----------------------------
 # WORKS
+# Served from the schema registry - the database is only asked again after DDL invalidated it
 def query_get_table_names(server_name: DBConnString):
-    # FUCKING FIXED THE BITCH
-    # WAS 156 - 10000000000 - FUCKERS CHANGED THE DATA LOCATION
-    sql_query = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE' LIMIT 0, 4"
-
     try:
-        with connect(server_name).cursor() as cursor:
-            cursor.execute(sql_query)
-            table_names = [row['TABLE_NAME'] for row in cursor.fetchall()]
+        table_names = schema_registry.table_names(server_name)
 
         if table_names:
             return table_names
 
         else:
-            print("No data found.")
+            log.info("No tables found")
             return []
 
     except pymysql.MySQLError as e:
-        print(f'Error in query_get_table_names()')
-        print(f"Error executing SQL query: {e}")
+        log.error("Error executing SQL query: %s", e)
         return []
 
 
+# RESULT CONVERSION
+# ----------------------------
+# Converters run once per cell at fetch time, picked per column from the declared SQL type (prefix match)
+def time_to_seconds(value):
+    return value.total_seconds()  # PyMySQL returns TIME columns as timedelta
+
+
+DISPLAY_CONVERTERS = {'DECIMAL': float}
+NUMERIC_CONVERTERS = {'DECIMAL': float, 'TIME': time_to_seconds}
+
+
+def column_converters(table: str, columns: list, converters: dict) -> list:
+    # One converter (or None) per column
+    result = []
+    for column in columns:
+        column_type = schema_registry.column_type(table, column).upper()
+        result.append(next((convert for type_prefix, convert in converters.items()
+                            if column_type.startswith(type_prefix)), None))
+    return result
+
+
+def convert_rows(rows, converters: list):
+    # Rows stay the cursor's tuples unless a column needs converting
+    conversions = [(n, convert) for n, convert in enumerate(converters) if convert is not None]
+    if not conversions:
+        yield from rows
+        return
+    for row in rows:
+        row = list(row)
+        for n, convert in conversions:
+            if row[n] is not None:
+                row[n] = convert(row[n])
+        yield row
+
+
 # WORKS
+@backend_dispatch
 def query_get_table_column_names(server_name: DBConnString, table: str) -> list:
     data = []
-    with connect(server_name).cursor() as cursor:
+    with pooled_connection(server_name) as connection, connection.cursor(pymysql.cursors.Cursor) as cursor:
         cursor.execute(f'SELECT * FROM {table}')
         columns = [column[0] for column in cursor.description]
         rows = cursor.fetchall()
@@ -224,13 +370,109 @@ def query_get_table_column_names(server_name: DBConnString, table: str) -> list:
 
 
 # WORKS
-def query_get_data_from_table(server_name: DBConnString, table: str) -> list:
-    with connect(server_name).cursor() as cursor:
+# Tuple cursor - rows come back as tuples, no per-row dict to build and copy
+@cached_query()
+@backend_dispatch
+def query_get_data_from_table(server_name: DBConnString, table: str, converters: dict = None) -> list:
+    with pooled_connection(server_name) as connection, connection.cursor(pymysql.cursors.Cursor) as cursor:
         cursor.execute(f"SELECT * FROM {table}")
         columns = [column[0] for column in cursor.description]
         rows = cursor.fetchall()
-        data = [columns] + [list(row.values()) for row in rows]  # Convert dictionary values to list
-        return data
+        if converters:
+            rows = convert_rows(rows, column_converters(table, columns, converters))
+        return [columns, *rows]
+
+
+# Keyset pagination - rows with id > after_id in id order, same [columns, row, row, ...] layout as above.
+# The next page starts after the id of the last row (the first cell of every row)
+@cached_query()
+@backend_dispatch
+def query_get_data_page(server_name: DBConnString, table: str, after_id: int = 0, limit: int = 100,
+                        converters: dict = None) -> list:
+    with pooled_connection(server_name) as connection, connection.cursor(pymysql.cursors.Cursor) as cursor:
+        cursor.execute(f"SELECT * FROM {table} WHERE id > %s ORDER BY id LIMIT %s", (after_id, limit))
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        if converters:
+            rows = convert_rows(rows, column_converters(table, columns, converters))
+        return [columns, *rows]
+
+
+# Column-oriented result: {column: [values]} - one list per column instead of one object per row.
+# Numeric converters by default (DECIMAL -> float, TIME -> seconds) for number crunching
+@cached_query()
+@backend_dispatch
+def query_get_columns(server_name: DBConnString, table: str, columns: list = None,
+                      converters: dict = NUMERIC_CONVERTERS) -> dict:
+    select_list = ', '.join(columns) if columns else '*'
+    with pooled_connection(server_name) as connection, connection.cursor(pymysql.cursors.Cursor) as cursor:
+        cursor.execute(f"SELECT {select_list} FROM {table} ORDER BY id")
+        names = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+
+    values = list(zip(*rows)) if rows else [()] * len(names)
+    result = {}
+    for name, column_values, convert in zip(names, values, column_converters(table, names, converters or {})):
+        if convert is None:
+            result[name] = list(column_values)
+        else:
+            result[name] = [None if value is None else convert(value) for value in column_values]
+    return result
+
+
+# Unbuffered server-side cursor - rows are read off the socket while the caller iterates, so memory stays flat
+# no matter how many rows the statement returns. Returns an iterator of the rows as tuples; the backend is checked
+# by the call itself, not on the first row, so a caller can still answer with an error before streaming.
+def query_stream_select(server_name: DBConnString, sql_query: str, params: tuple = ()):
+    require_mysql(server_name)
+    return _stream_select(get_pool(server_name), sql_query, params)
+
+
+def _stream_select(pool, sql_query: str, params: tuple):
+    connection = pool.acquire()
+    finished = False
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute(sql_query, params)
+        yield from cursor.fetchall_unbuffered()
+        cursor.close()
+        finished = True
+    finally:
+        # A half-read unbuffered result would have to be drained before the connection can be reused,
+        # so a stream that stops early (client went away, error) closes its connection instead
+        pool.release(connection, broken=not finished)
+
+
+# Whole table as a stream, every row a tuple (a list when converted), column names are in the schema registry.
+# Streams of up to STREAM_CACHE_MAX_ROWS rows are kept in the result cache and replayed from memory.
+STREAM_CACHE_MAX_ROWS = 5000
+
+
+@backend_dispatch
+def query_stream_table(server_name: DBConnString, table: str, after_id: int = 0, converters: dict = None):
+    cache_key = ('query_stream_table', server_name, table, after_id, tuple((converters or {}).items()))
+    cached_rows = result_cache.get(cache_key)
+    if isinstance(cached_rows, list):
+        yield from cached_rows
+        return
+    generations = result_cache.generations([table])
+
+    rows = query_stream_select(server_name, f"SELECT * FROM {table} WHERE id > %s ORDER BY id", (after_id,))
+    if converters:
+        columns = schema_registry.columns(server_name, table)
+        rows = convert_rows(rows, column_converters(table, columns, converters))
+    kept_rows = []
+    try:
+        for row in rows:
+            if kept_rows is not None:
+                kept_rows.append(row)
+                if len(kept_rows) > STREAM_CACHE_MAX_ROWS:
+                    kept_rows = None  # too big to keep, just stream it
+            yield row
+    finally:
+        rows.close()  # hands the connection back right away when the caller stops early
+    if kept_rows is not None:
+        result_cache.put(cache_key, [table], kept_rows, generations)
 
 
 # UPDATE
@@ -238,31 +480,94 @@ def query_get_data_from_table(server_name: DBConnString, table: str) -> list:
 # Works
 # Updates by column "id" not global id
 
+@backend_dispatch
 def query_update_cell(server_name: DBConnString, table_name: str, column_name: str, id_: int, value: any) -> None:
     sql_query = f"UPDATE {table_name} SET {column_name} = %s WHERE id = %s"
 
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
+            connection.begin()
             with connection.cursor() as cursor:
+                old_rows = lock_rows(cursor, table_name, [id_])
                 cursor.execute(sql_query, (value, id_))
+                apply_totals(cursor, table_name, new_rows=[{**row, column_name: value} for row in old_rows],
+                             old_rows=old_rows)
             connection.commit()  # Commit outside the cursor context
-            print(f'Table "{table_name}" updated')
-        else:
-            print("Connection to database failed.")
+            table_changed(table_name)
+            log.info("Table '%s' updated", table_name, extra=sampled(id=id_, column=column_name))
 
     except pymysql.MySQLError as e:
-        print(f'Error in query_update_cell()')
-        print(f"Error updating table '{table_name}': {e}")
-    except Exception as e:
-        print(f'Error in query_update_cell()')
-        print(f"An unexpected error occurred: {e}")
+        log.error("Error updating table '%s': %s", table_name, e)
+    except Exception:
+        log.exception("Unexpected error updating table '%s'", table_name)
 
 
 # Works
+# All columns in one UPDATE statement - one round trip, and the row is never left half-updated
+@backend_dispatch
 def query_update_row(server_name: DBConnString, table_name: str, id_: int, data: dict) -> None:
-    for column_name, value in data.items():
-        query_update_cell(server_name, table_name, column_name, id_, value)
+    if not data:
+        return
+
+    set_clause = ', '.join(f"{column_name} = %s" for column_name in data)
+    sql_query = f"UPDATE {table_name} SET {set_clause} WHERE id = %s"
+
+    try:
+        with pooled_connection(server_name) as connection:
+            connection.begin()
+            with connection.cursor() as cursor:
+                old_rows = lock_rows(cursor, table_name, [id_])
+                cursor.execute(sql_query, (*data.values(), id_))
+                apply_totals(cursor, table_name, new_rows=[{**row, **data} for row in old_rows], old_rows=old_rows)
+            connection.commit()
+            table_changed(table_name)
+            log.info("Table '%s' updated", table_name, extra=sampled(id=id_))
+
+    except pymysql.MySQLError as e:
+        log.error("Error updating table '%s': %s", table_name, e)
+    except Exception:
+        log.exception("Unexpected error updating table '%s'", table_name)
+
+
+# Many rows in one statement, rows = {id: {column: value}}. Rows may set different columns:
+# UPDATE t SET a = CASE id WHEN %s THEN %s ... ELSE a END, ... WHERE id IN (...)
+@backend_dispatch
+def query_update_rows(server_name: DBConnString, table_name: str, rows: dict) -> None:
+    rows = {int(id_): data for id_, data in rows.items() if data}
+    if not rows:
+        return
+
+    column_names = list(dict.fromkeys(column_name for data in rows.values() for column_name in data))
+    set_clauses = []
+    values = []
+    for column_name in column_names:
+        cases = []
+        for id_, data in rows.items():
+            if column_name in data:
+                cases.append("WHEN %s THEN %s")
+                values.extend((id_, data[column_name]))
+        set_clauses.append(f"{column_name} = CASE id {' '.join(cases)} ELSE {column_name} END")
+    values.extend(rows.keys())
+
+    id_placeholders = ', '.join(['%s'] * len(rows))
+    sql_query = f"UPDATE {table_name} SET {', '.join(set_clauses)} WHERE id IN ({id_placeholders})"
+
+    try:
+        with pooled_connection(server_name) as connection:
+            connection.begin()
+            with connection.cursor() as cursor:
+                old_rows = lock_rows(cursor, table_name, list(rows))
+                cursor.execute(sql_query, values)
+                apply_totals(cursor, table_name, new_rows=[{**row, **rows[row['id']]} for row in old_rows],
+                             old_rows=old_rows)
+            connection.commit()
+            table_changed(table_name)
+            log.info("Table '%s' updated (%s rows)", table_name, len(rows), extra=sampled())
+
+    except pymysql.MySQLError as e:
+        log.error("Error updating table '%s': %s", table_name, e)
+    except Exception:
+        log.exception("Unexpected error updating table '%s'", table_name)
 
 
 # DELETE
@@ -275,96 +580,219 @@ def query_delete_all_tables(server_name: DBConnString):
             for table_name in table_names:
                 query_delete_table(server_name, table_name)
         else:
-            print("No data found to delete.")
+            log.info("No tables to delete")
 
-    except Exception as e:
-        print(f'Error in query_delete_all_tables()')
-        print(f"An unexpected error occurred: {e}")
+    except Exception:
+        log.exception("Unexpected error deleting the tables")
 
 
 # WORKS
+@backend_dispatch
 def query_delete_table(server_name: DBConnString, table_name: str) -> None:
     sql_query = f"DROP TABLE IF EXISTS {table_name}"
     try:
-        with connect(server_name).cursor() as cursor:
-            cursor.execute(sql_query)
-            print(f'Table "{table_name}" deleted')
-        connect(server_name).commit()
+        with pooled_connection(server_name) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(sql_query)
+                log.info("Table '%s' deleted", table_name)
+                if table_name != SUMMARY_TABLE:
+                    clear_totals(cursor, table_name)
+            connection.commit()
+        schema_registry.invalidate(server_name)
+        table_changed(table_name)
     except pymysql.MySQLError as e:
-        print(f'Error in query_delete_table()')
-        print(f"Error deleting table '{table_name}': {e}")
-    finally:
-        connect(server_name).close()
+        log.error("Error deleting table '%s': %s", table_name, e)
 
 
 # W O R K S !!!
+@backend_dispatch
 def query_delete_row(server_name: DBConnString, table_name: str, id_value: int) -> None:
     sql_query = f"DELETE FROM {table_name} WHERE id = %s"
 
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
+            connection.begin()
             with connection.cursor() as cursor:
+                old_rows = lock_rows(cursor, table_name, [id_value])
                 cursor.execute(sql_query, (id_value,))
+                apply_totals(cursor, table_name, old_rows=old_rows)
             connection.commit()
-            print(f"Row with ID {id_value} deleted from table '{table_name}'")
-        else:
-            print("Connection to database failed.")
+            table_changed(table_name)
+            log.info("Row with ID %s deleted from table '%s'", id_value, table_name, extra=sampled())
     except pymysql.MySQLError as e:
-        print(f'Error in query_delete_row()')
-        print(f"Error deleting row from table '{table_name}': {e}")
-    except Exception as e:
-        print(f'Error in query_delete_row()')
-        print(f"An unexpected error occurred: {e}")
-    finally:
-        if connection:
-            connection.close()
+        log.error("Error deleting row from table '%s': %s", table_name, e)
+    except Exception:
+        log.exception("Unexpected error deleting row from table '%s'", table_name)
+
+
+# Deletes the latest dive, the rows with the highest id of every table, on one connection and in one
+# transaction -> all or nothing, like query_put_dive. Returns the id deleted, -1 when there are no rows,
+# None on failure
+@backend_dispatch
+def query_delete_dive(server_name: DBConnString):
+    try:
+        table_names = schema_registry.table_names(server_name)
+        if not table_names:
+            return -1
+        max_ids = ', '.join(f"COALESCE((SELECT MAX(id) FROM {table}), -1)" for table in table_names)
+        max_id_clause = f"GREATEST({max_ids})" if len(table_names) > 1 else max_ids
+
+        with pooled_connection(server_name) as connection:
+            connection.begin()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT {max_id_clause} AS max_id")
+                    max_id = cursor.fetchone()['max_id']
+                    deltas = {}
+                    for table in table_names if max_id != -1 else ():
+                        old_rows = lock_rows(cursor, table, [max_id])
+                        if old_rows:
+                            cursor.execute(f"DELETE FROM {table} WHERE id = %s", (max_id,))
+                            deltas[table] = totals_deltas(table, old_rows=old_rows)
+                    write_totals(cursor, deltas)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+        for table in table_names:
+            table_changed(table)
+        log.info("Dive %s deleted from tables %s", max_id, ', '.join(table_names), extra=sampled())
+        return max_id
+
+    except pymysql.MySQLError as e:
+        log.error("Error deleting the latest dive: %s", e)
+    except Exception:
+        log.exception("Unexpected error deleting the latest dive")
+    return None
 
 
 # PUT
 # ----------------------------------------------
 # WORKS
 # Example call: query_put_row(Server1, 'currency_gained', requisition=2, medals=1, xp=2140) -> id is auto assigned
-def query_put_row(server_name: DBConnString, table_name: str, **kwargs) -> None:
-    columns = ', '.join(kwargs.keys())
-    values_placeholders = ', '.join(['%s'] * len(kwargs))
-    values = tuple(kwargs.values())
-
-    sql_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values_placeholders})"
-
+# The id comes from the table's own AUTO_INCREMENT, so the rows of the four per-table forms posted one after the
+# other land under the same id, one dive. It is then claimed in the dive sequence, so query_put_dive never
+# hands it out again. Returns the id of the new row (the AUTO_INCREMENT value, or the id passed in), None on error
+@backend_dispatch
+def query_put_row(server_name: DBConnString, table_name: str, **kwargs):
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
+            connection.begin()
             with connection.cursor() as cursor:
-                cursor.execute(sql_query, values)
+                columns = ', '.join(kwargs.keys())
+                values_placeholders = ', '.join(['%s'] * len(kwargs))
+                cursor.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({values_placeholders})",
+                               tuple(kwargs.values()))
+                id_ = kwargs.get('id') or cursor.lastrowid
+                if table_name in DIVE_TABLES:
+                    claim_dive_id(cursor, id_)
+                apply_totals(cursor, table_name, new_rows=[kwargs])
             connection.commit()
-            print(f"Row inserted into table '{table_name}'")
-        else:
-            print("Connection to database failed.")
+            table_changed(table_name)
+            log.info("Row %s inserted into table '%s'", id_, table_name, extra=sampled())
+            return id_
 
     except pymysql.MySQLError as e:
-        print(f'Error in query_put_row()')
-        print(f"Error inserting row into table '{table_name}': {e}")
-    except Exception as e:
-        print(f'Error in query_put_row()')
-        print(f"An unexpected error occurred: {e}")
+        log.error("Error inserting row into table '%s': %s", table_name, e)
+    except Exception:
+        log.exception("Unexpected error inserting row into table '%s'", table_name)
+    return None
+
+
+# Tables that make up one dive, a dive is the set of rows sharing the same id
+DIVE_TABLES = ['combat', 'currency_gained', 'objectives_completed', 'samples_gained']
+
+# Dive id sequence: an AUTO_INCREMENT table whose only job is handing out ids. The counter is taken without
+# locking any data row, so concurrent submits don't wait on each other, and it is never handed out twice.
+# query_put_dive takes its ids here. Rows inserted into a single table get their id from that table's
+# AUTO_INCREMENT and are claimed here, and bulk imports claim the highest id they wrote, which pushes the
+# counter past them.
+DIVE_SEQUENCE = 'dive_sequence'
+DIVE_ID_ATTEMPTS = 3  # an id taken by a single-row insert or a bulk import meanwhile is skipped
+DUPLICATE_KEY = 1062
+tquery_dive_sequence = f"CREATE TABLE IF NOT EXISTS {DIVE_SEQUENCE} (id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY);"
+
+
+def next_dive_id(cursor) -> int:
+    cursor.execute(f"INSERT INTO {DIVE_SEQUENCE} () VALUES ()")
+    return cursor.lastrowid
+
+
+def claim_dive_id(cursor, id_: int) -> None:
+    cursor.execute(f"INSERT IGNORE INTO {DIVE_SEQUENCE} (id) VALUES (%s)", (id_,))
+
+
+# Claim the highest id of each table, after rows were written without going through the sequence
+# (when the sequence table is created, bulk imports)
+def sync_dive_sequence(cursor, tables: list = None) -> None:
+    max_ids = ' UNION '.join(f"SELECT MAX(id) AS id FROM {table} HAVING MAX(id) IS NOT NULL"
+                             for table in tables or DIVE_TABLES)
+    cursor.execute(f"INSERT IGNORE INTO {DIVE_SEQUENCE} (id) {max_ids}")
+
+
+# Example call: query_put_dive(Server1, {'combat': {...}, 'currency_gained': {...},
+#                                        'objectives_completed': {...}, 'samples_gained': {...}})
+# Inserts all four rows under one new dive id, on one connection and in one transaction -> all or nothing
+# Returns the dive id, None on failure
+@backend_dispatch
+def query_put_dive(server_name: DBConnString, dive: dict):
+    missing = [table for table in DIVE_TABLES if not dive.get(table)]
+    if missing:
+        log.error("Missing data for tables: %s", ', '.join(missing))
+        return None
+
+    try:
+        deltas = {table: totals_deltas(table, new_rows=[dive[table]]) for table in DIVE_TABLES}
+        with pooled_connection(server_name) as connection:
+            for attempt in range(1, DIVE_ID_ATTEMPTS + 1):
+                connection.begin()
+                try:
+                    with connection.cursor() as cursor:
+                        dive_id = next_dive_id(cursor)
+                        for table in DIVE_TABLES:
+                            columns = ['id', *dive[table].keys()]
+                            values_placeholders = ', '.join(['%s'] * len(columns))
+                            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                           f"VALUES ({values_placeholders})", (dive_id, *dive[table].values()))
+                        write_totals(cursor, deltas)  # the four tables in one statement
+                    connection.commit()
+                    break
+                except pymysql.IntegrityError as e:
+                    connection.rollback()
+                    if e.args[0] != DUPLICATE_KEY or attempt == DIVE_ID_ATTEMPTS:
+                        raise
+                    log.warning("Dive id %s is already taken in a table, trying the next one", dive_id)
+                except Exception:
+                    connection.rollback()
+                    raise
+            for table in DIVE_TABLES:
+                table_changed(table)
+            log.info("Dive %s inserted into tables %s", dive_id, ', '.join(DIVE_TABLES), extra=sampled())
+            return dive_id
+
+    except pymysql.MySQLError as e:
+        log.error("Error inserting dive: %s", e)
+    except Exception:
+        log.exception("Unexpected error inserting dive")
+    return None
 
 
 # Aux functions
 # ------------------------
 # WORKS - returns the non-system ID
+@cached_query(tables=lambda arguments: [arguments['table_name']])
+@backend_dispatch
 def query_get_last_id_value(server_name: DBConnString, table_name: str) -> int:
     sql_query = f"SELECT id FROM {table_name} ORDER BY id DESC LIMIT 1"
     try:
-        with connect(server_name).cursor() as cursor:
+        with pooled_connection(server_name) as connection, connection.cursor() as cursor:
             cursor.execute(sql_query)
             result = cursor.fetchone()
             return result[
                 'id'] if result else -1  # Access the result using the column name ----THIS WAS NONE BEFORE - NOT -1
 
     except pymysql.MySQLError as e:
-        print('query_get_last_id_value()')
-        print(f"Error occurred: {e}")
+        log.error("Error reading the last id of table '%s': %s", table_name, e)
         return None
 
 
@@ -372,18 +800,19 @@ def query_get_last_id_value(server_name: DBConnString, table_name: str) -> int:
 
 # dict {columns: [], rows: [{},{}]}
 # I GUESS??? RETURNS WHAT'S ABOVE ANYWAY
+@cached_query()
+@backend_dispatch
 def query_get_data_by_id(server_name: DBConnString, table: str, id_value: int) -> dict:
     data = {
         "columns": [],
         "rows": []
     }
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 # Log the SQL query being executed
                 sql_query = f'SELECT * FROM {table} WHERE id = %s'
-                print(f"Executing query: {sql_query} with id_value: {id_value}")
+                log.debug("Executing query: %s with id_value: %s", sql_query, id_value, extra=sampled())
 
                 # Execute the query
                 cursor.execute(sql_query, (id_value,))
@@ -392,7 +821,7 @@ def query_get_data_by_id(server_name: DBConnString, table: str, id_value: int) -
                 # Check if rows were returned
                 if rows:
                     # Log the rows returned by the query
-                    print(f"Rows fetched: {rows}")
+                    log.debug("Rows fetched: %s", rows, extra=sampled())
 
                     # Extract column names, excluding 'id'
                     columns = [key for key in rows[0].keys() if
@@ -405,212 +834,150 @@ def query_get_data_by_id(server_name: DBConnString, table: str, id_value: int) -
                         for row in rows
                     ]
                 else:
-                    print(f"No rows found in table '{table}' with id = {id_value}")
+                    log.debug("No rows found in table '%s' with id = %s", table, id_value, extra=sampled())
 
     except pymysql.MySQLError as e:
-        print(f"Database error: {e}")
-    except Exception as e:
-        print(f"Error: {e}")
-    finally:
-        if connection:
-            connection.close()
+        log.error("Database error: %s", e)
+    except Exception:
+        log.exception("Unexpected error reading table '%s'", table)
 
     return data
 
 
+# Latest dive of every table in one statement: the max id across the tables, then one LEFT JOIN per table.
+# id is the primary key so each table joins at most one row.
+# Returns (max_id, {table: {columns: [], rows: [[]]}}) - same shape as query_get_data_by_id, max_id is -1 when empty
+@cached_query(tables=lambda arguments: DIVE_TABLES)
+@backend_dispatch
+def query_get_latest_dive(server_name: DBConnString):
+    data = {}
+    max_id = None
+    try:
+        table_names = schema_registry.table_names(server_name)
+        if not table_names:
+            return max_id, data
+
+        columns = {table: [column for column in schema_registry.columns(server_name, table) if column != 'id']
+                   for table in table_names}
+        max_ids = ', '.join(f"COALESCE((SELECT MAX(id) FROM {table}), -1)" for table in table_names)
+        select_list = ['m.max_id']
+        joins = []
+        for n, table in enumerate(table_names):
+            select_list.append(f"t{n}.id AS t{n}__id")
+            select_list.extend(f"t{n}.{column} AS t{n}__{column}" for column in columns[table])
+            joins.append(f"LEFT JOIN {table} t{n} ON t{n}.id = m.max_id")
+        select_clause = ', '.join(select_list)
+        max_id_clause = f"GREATEST({max_ids})" if len(table_names) > 1 else max_ids
+        sql_query = f"SELECT {select_clause} FROM (SELECT {max_id_clause} AS max_id) m {' '.join(joins)}"
+
+        with pooled_connection(server_name) as connection, connection.cursor() as cursor:
+            cursor.execute(sql_query)
+            row = cursor.fetchone()
+
+        max_id = row['max_id']
+        for n, table in enumerate(table_names):
+            if row[f"t{n}__id"] is None:
+                data[table] = {"columns": [], "rows": []}
+            else:
+                data[table] = {"columns": columns[table],
+                               "rows": [[row[f"t{n}__{column}"] for column in columns[table]]]}
+
+    except pymysql.MySQLError as e:
+        log.error("Database error: %s", e)
+
+    return max_id, data
+
+
 # Additions --------------------------------------
 def query_check_db_exists(server_name: DBConnString, db_name: str) -> bool:
     sql_query = f"SHOW DATABASES LIKE '{db_name}'"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query)
                 result = cursor.fetchone()
-                print(bool(result))
+                log.debug("Database '%s' exists: %s", db_name, bool(result))
                 return bool(result)
-        else:
-            print("Connection to database failed.")
-            return False
     except pymysql.MySQLError as e:
-        print(f'Error in query_check_db_exists()')
-        print(f"Error checking if database exists: {e}")
+        log.error("Error checking if database exists: %s", e)
         return False
-    finally:
-        if connection:
-            connection.close()
 
 
 def query_check_table_exists(server_name: DBConnString, db_name: str, table_name: str) -> bool:
     sql_query = f"SHOW TABLES FROM {db_name} LIKE '{table_name}'"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query)
                 result = cursor.fetchone()
                 return bool(result)
-        else:
-            print("Connection to database failed.")
-            return False
     except pymysql.MySQLError as e:
-        print(f'Error in query_check_table_exists()')
-        print(f"Error checking if table '{table_name}' exists in database '{db_name}': {e}")
+        log.error("Error checking if table '%s' exists in database '%s': %s", table_name, db_name, e)
         return False
-    finally:
-        if connection:
-            connection.close()
 
 
 def query_create_db(server_name: DBConnString, db_name: str) -> None:
     sql_query = f"CREATE DATABASE IF NOT EXISTS {db_name}"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query)
             connection.commit()
-            print(f"Database '{db_name}' created")
-        else:
-            print("Connection to database failed.")
+            log.info("Database '%s' created", db_name)
+        schema_registry.invalidate(server_name)
     except pymysql.MySQLError as e:
-        print(f'Error in query_create_db()')
-        print(f"Error creating database '{db_name}': {e}")
-    finally:
-        if connection:
-            connection.close()
+        log.error("Error creating database '%s': %s", db_name, e)
 
 
 def query_delete_db(server_name: DBConnString, db_name: str) -> None:
     sql_query = f"DROP DATABASE IF EXISTS {db_name}"
     try:
-        connection = connect(server_name)
-        if connection:
+        with pooled_connection(server_name) as connection:
             with connection.cursor() as cursor:
                 cursor.execute(sql_query)
-                print(f"Database '{db_name}' deleted")
+                log.info("Database '%s' deleted", db_name)
             connection.commit()  # Commit the change
-        else:
-            print("Connection to database failed.")
-    except pymysql.MySQLError as e:
-        print(f'Error in query_delete_db()')
-        print(f"Error deleting database '{db_name}': {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred while deleting database '{db_name}': {e}")
-    finally:
-        if connection:
-            connection.close()
-
-
-def create_table_if_not_exists(connection, table_name, table_creation_query):
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-            table_exists = cursor.fetchone()
-
-            if not table_exists:
-                print(f"Table '{table_name}' does not exist. Creating...")
-                cursor.execute(table_creation_query)
-                connection.commit()  # Commit table creation
-                print(f"Table '{table_name}' created.")
-            else:
-                print(f"Table '{table_name}' already exists.")
+        if db_name == server_name.database:
+            get_pool(server_name).clear()  # pooled connections still point at the dropped database
+        schema_registry.invalidate(server_name)
+        all_tables_changed()
     except pymysql.MySQLError as e:
-        print(f"Error creating table '{table_name}': {e}")
+        log.error("Error deleting database '%s': %s", db_name, e)
+    except Exception:
+        log.exception("Unexpected error deleting database '%s'", db_name)
 
 
+# Make sure the database of server_name exists with all its tables matching their definitions, creating or
+# migrating what doesn't - on one connection, and with one metadata query when nothing needs doing
+# (bootstrap_database() in SQL/migrations.py). Returns True once the tables are ready.
+# The app runs this in the background at startup, see SQL/bootstrap.py.
+@backend_dispatch
 def setup_db_and_tables(server_name: DBConnString):
-    db_name = 'DBTest1'
-    db_created = False
-    db_exists = False  # Initialize db_exists variable
-    max_wait_time = 30  # Wait up to 30 seconds for the database creation
-    wait_time_interval = 5  # Wait 5 seconds between checks
-
-    # Step 1: Try connecting to the MySQL server without a database (i.e., database=None)
-    connection = connect(DBConnString(
-        server_name.server,  # Same server
-        '',  # No database specified initially
-        server_name.username,
-        server_name.password,
-        server_name.port
-    ))  # Use the connection without a database
-
-    if connection:
-        try:
-            # Step 2: If connection successful, move to database existence check and creation
-            with connection.cursor() as cursor:
-                cursor.execute(f"SHOW DATABASES LIKE '{db_name}'")
-                db_exists = cursor.fetchone()
-
-                # If the database doesn't exist, create it
-                if not db_exists:
-                    print(f"Database '{db_name}' does not exist. Creating...")
-                    cursor.execute(f"CREATE DATABASE {db_name}")
-                    connection.commit()  # Commit the database creation
-                    print(f"Database '{db_name}' creation initiated.")
-                    connection.close()  # Close the initial connection
-
-                    # Wait for the database to be created and check periodically
-                    start_time = time.time()
-                    while time.time() - start_time < max_wait_time:
-                        # Reconnect to the MySQL server without selecting a database
-                        connection = connect(server_name)
-                        if connection:
-                            with connection.cursor() as cursor:
-                                cursor.execute(f"SHOW DATABASES LIKE '{db_name}'")
-                                db_exists = cursor.fetchone()
-                                if db_exists:
-                                    db_created = True
-                                    print(f"Database '{db_name}' successfully created.")
-                                    break  # Exit the loop once the database is created
-                        if not db_created:
-                            print(f"Waiting for database '{db_name}' to be created...")
-                            time.sleep(wait_time_interval)  # Wait before checking again
-
-                    # If the database is not created within the time limit, raise an error
-                    if not db_created:
-                        raise Exception(f"Database '{db_name}' could not be created within {max_wait_time} seconds.")
-
-                else:
-                    print(f"Database '{db_name}' already exists.")
+    from SQL.migrations import bootstrap_database  # imports this module
 
-        except pymysql.MySQLError as e:
-            print(f"Error in setup_db_and_tables(): {e}")
-        finally:
-            # Close the connection after performing the database check/creation
-            connection.close()
-
-        # Step 3: If the database was created or already exists, proceed to create tables
-        if db_created or db_exists:
-            # Reconnect to the specific database DBTest1
-            connection = connect(DBConnString(
-                server_name.server,  # Same server
-                db_name,  # The created or already existing database
-                server_name.username,
-                server_name.password,
-                server_name.port
-            ))  # Now connect with the DB
-
-            if connection:
-                try:
-                    connection.select_db(db_name)  # Select DBTest1 after connection
-
-                    # Step 4: Create tables if they don't exist
-                    create_table_if_not_exists(connection, 'objectives_completed', tquery_objectives)
-                    create_table_if_not_exists(connection, 'samples_gained', tquery_samples)
-                    create_table_if_not_exists(connection, 'currency_gained', tquery_currency)
-                    create_table_if_not_exists(connection, 'combat', tquery_combat)
-
-                except pymysql.MySQLError as e:
-                    print(f"Error while creating tables: {e}")
-                finally:
-                    # Close the connection after performing the table creation
-                    connection.close()
-            else:
-                print(f"Failed to reconnect to the database '{db_name}' after creation.")
+    # Connect without selecting the database, it may not exist yet
+    connection = connect(DBConnString(server_name.server, '', server_name.username, server_name.password,
+                                      server_name.port))
+    if connection is None:
+        log.error("Connection to the MySQL server failed.")
+        return False
+    try:
+        done, live = bootstrap_database(connection, server_name.database)
+    except pymysql.MySQLError as e:
+        log.error("Error setting up database '%s': %s", server_name.database, e)
+        return False
+    finally:
+        connection.close()
 
+    for step in done:
+        log.info("Setup: %s", step)
+    if live is None:
+        schema_registry.invalidate(server_name)
+        all_tables_changed()
     else:
-        print("Connection to the MySQL server failed.")
+        # Nothing changed, the metadata just read doubles as the schema registry's check
+        schema_registry.load(server_name, {table: list(columns) for table, (columns, _) in live.items()})
+    return True
 
 
 if __name__ == "__main__":
@@ -621,7 +988,7 @@ if __name__ == "__main__":
 
 
     # BOTH WORK
-    # query_delete_db(Server1, "DBTest1")
+    # query_delete_db(Server1, Server1.database)
     # setup_db_and_tables(Server1)
 
     # This also works
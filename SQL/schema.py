@@ -0,0 +1,92 @@
+import threading
+
+from SQL.logs import get_logger
+from SQL.pool import get_pool
+
+log = get_logger(__name__)
+
+
+# Table/column metadata built from the SQLQuery definitions in SQL/queries.py.
+# The live database is checked once (one INFORMATION_SCHEMA.COLUMNS query) and the result is kept in memory
+# until invalidate() is called after DDL, so request handlers never run metadata queries.
+class SchemaRegistry:
+    def __init__(self):
+        self._tables = {}  # table name -> SQLQuery, in registration order
+        self._live = {}  # DBConnString -> {table name: [column names]} as found in the database
+        self._lock = threading.Lock()
+
+    def register(self, sql_query) -> None:
+        with self._lock:
+            self._tables[sql_query.table_name] = sql_query
+            self._live.clear()
+
+    def has_table(self, table: str) -> bool:
+        return table in self._tables
+
+    def definition(self, table: str):
+        return self._tables[table]
+
+    def declared_columns(self, table: str) -> list:
+        return ['id', *self._tables[table].columns.keys()]
+
+    def column_type(self, table: str, column: str) -> str:
+        if column == 'id':
+            return 'INT'
+        return self._tables[table].columns.get(column, '') if table in self._tables else ''
+
+    # live: {table: [column names]} already read by the caller (setup_db_and_tables), saves the query
+    def load(self, server_name, live: dict = None) -> dict:
+        if live is not None:
+            live = {table: columns for table, columns in live.items() if table in self._tables}
+        elif server_name.backend != 'mysql':
+            from SQL.backends import get_backend
+
+            live = {table: columns for table, columns in get_backend(server_name).live_columns().items()
+                    if table in self._tables}
+        else:
+            live = self._load_mysql(server_name)
+
+        for table, columns in live.items():
+            declared = self.declared_columns(table)
+            if columns != declared:
+                log.warning("Schema mismatch in table '%s': database has %s, definition has %s",
+                            table, columns, declared)
+
+        with self._lock:
+            self._live[server_name] = live
+        return live
+
+    def _load_mysql(self, server_name) -> dict:
+        sql_query = ("SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                     "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION")
+        live = {}
+        with get_pool(server_name).connection() as connection, connection.cursor() as cursor:
+            cursor.execute(sql_query, (server_name.database,))
+            for row in cursor.fetchall():
+                if row['TABLE_NAME'] in self._tables:
+                    live.setdefault(row['TABLE_NAME'], []).append(row['COLUMN_NAME'])
+        return live
+
+    def _get_live(self, server_name) -> dict:
+        live = self._live.get(server_name)
+        if live is None:
+            live = self.load(server_name)
+        return live
+
+    # Registered tables that exist in the database, in registration order
+    def table_names(self, server_name) -> list:
+        live = self._get_live(server_name)
+        return [table for table in self._tables if table in live]
+
+    def columns(self, server_name, table: str) -> list:
+        return list(self._get_live(server_name).get(table, []))
+
+    def invalidate(self, server_name=None) -> None:
+        with self._lock:
+            if server_name is None:
+                self._live.clear()
+            else:
+                self._live.pop(server_name, None)
+
+
+schema_registry = SchemaRegistry()
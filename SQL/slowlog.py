@@ -0,0 +1,137 @@
+import contextvars
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import pymysql
+
+from SQL.logs import get_logger
+
+# Slow query log. InstrumentedConnection (SQL/metrics.py) hands every statement slower than the threshold to
+# record(): the statement with its parameters, the query_* function and route that ran it, rows, time.
+# The newest entries are kept in a ring buffer shown at /debug/slow_queries (with the PROFILE_TOKEN, see
+# SQL/profiler.py). A background thread then runs EXPLAIN on the statement and attaches the plan, flagging full
+# scans and filesorts - the request that ran the slow statement never waits for it.
+#
+# SLOW_QUERY_MS     threshold in milliseconds, default 200
+# SLOW_QUERY_BUFFER entries kept, default 100
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_BUFFER = int(os.environ.get('SLOW_QUERY_BUFFER', 100))
+EXPLAIN_QUEUE_SIZE = 20  # statements waiting for EXPLAIN, more are left without a plan
+EXPLAIN_MAX_LENGTH = 64 * 1024  # bulk INSERTs aren't worth explaining
+STATEMENT_MAX_LENGTH = 2000  # characters of the statement and its parameters kept per entry
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+log = get_logger(__name__)
+
+# Route template of the request being handled, set by app.py; fan_out() copies it into its worker threads
+request_route = contextvars.ContextVar('request_route', default=None)
+
+
+def _shorten(text: str) -> str:
+    return text if len(text) <= STATEMENT_MAX_LENGTH else text[:STATEMENT_MAX_LENGTH] + '...'
+
+
+def _plan_flags(plan: list) -> list:
+    flags = set()
+    for step in plan:
+        extra = step.get('Extra') or ''
+        if step.get('type') == 'ALL':
+            flags.add(f"full scan of {step.get('table')}")
+        if 'filesort' in extra:
+            flags.add('filesort')
+        if 'temporary' in extra:
+            flags.add('temporary table')
+    return sorted(flags)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, size: int = SLOW_QUERY_BUFFER):
+        self.threshold = threshold_ms / 1000  # seconds, compared on every statement
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self._worker = None
+        self.recorded = 0
+
+    def record(self, connection, sql, template, params, function: str, table: str, elapsed: float,
+               rows: int) -> None:
+        if isinstance(sql, bytes):
+            sql = sql.decode(getattr(connection, 'encoding', 'utf8'), 'replace')
+        if sql.lstrip().upper().startswith('EXPLAIN'):
+            return  # our own EXPLAINs
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'function': function,
+            'route': request_route.get(),
+            'table': table,
+            'rows': rows,
+            'statement': _shorten(template if template is not None else sql),
+            'params': _shorten(repr(params)) if params is not None else None,
+            'explain': None,
+            'flags': [],
+        }
+
+        conn_string = getattr(connection, 'conn_string', None)  # set by the pool
+        if conn_string is None:
+            entry['explain'] = 'not explained, connection is not from the pool'
+        elif len(sql) > EXPLAIN_MAX_LENGTH or not sql.lstrip().upper().startswith(EXPLAINABLE):
+            entry['explain'] = 'not explained, statement too long or not a SELECT/INSERT/UPDATE/DELETE'
+        else:
+            self._start_worker()
+            try:
+                self._explain_queue.put_nowait((entry, conn_string, sql))
+            except queue.Full:
+                entry['explain'] = 'not explained, EXPLAIN queue full'
+
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+        log.warning("Slow query (%s ms) in %s: %s", entry['elapsed_ms'], function, entry['statement'][:200],
+                    extra={'route': entry['route'], 'rows': rows})
+
+    def _start_worker(self) -> None:
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._explain_loop, name='slow-query-explain',
+                                                    daemon=True)
+                    self._worker.start()
+
+    def _explain_loop(self) -> None:
+        from SQL.pool import get_pool  # the pool imports SQL.metrics, which imports this module
+
+        while True:
+            entry, conn_string, sql = self._explain_queue.get()
+            try:
+                with get_pool(conn_string).connection() as connection, \
+                        connection.cursor(pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute(f"EXPLAIN {sql}")
+                    plan = [{key: value if isinstance(value, (int, float, type(None))) else str(value)
+                             for key, value in step.items()} for step in cursor.fetchall()]
+                with self._lock:
+                    entry['explain'] = plan
+                    entry['flags'] = _plan_flags(plan)
+            except pymysql.MySQLError as e:
+                with self._lock:
+                    entry['explain'] = f"EXPLAIN failed: {e}"
+            except Exception as e:  # anything else: the thread must live on, or no later entry gets a plan
+                log.exception("EXPLAIN of a slow statement failed")
+                with self._lock:
+                    entry['explain'] = f"EXPLAIN failed: {type(e).__name__}: {e}"
+
+    def entries(self) -> list:
+        # Newest first, copies so a view never sees an EXPLAIN landing half way
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._entries)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog()
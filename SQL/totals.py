@@ -0,0 +1,174 @@
+import sys
+from datetime import timedelta
+from decimal import Decimal
+
+import pymysql
+
+from SQL.schema import schema_registry
+
+# Career totals kept up to date by every write path, inside the write's own transaction:
+# one row per (table, column) holding the column's sum, '__rows' holds the row count.
+# Lifetime stats are then a read of a few dozen rows, no matter how many dives exist.
+SUMMARY_TABLE = 'dive_totals'
+ROW_COUNT = '__rows'
+
+tquery_totals = (f"CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} ("
+                 f"table_name VARCHAR(64) NOT NULL, "
+                 f"column_name VARCHAR(64) NOT NULL, "
+                 f"total DECIMAL(20,2) NOT NULL DEFAULT 0, "
+                 f"PRIMARY KEY (table_name, column_name));")
+
+# Per-row metrics counted next to the column sums: metric -> (SQL condition, the same check on a row dict)
+DERIVED_TOTALS = {
+    'objectives_completed': {
+        'extracted_dives': ('helldivers_extracted > 0', lambda row: int(row.get('helldivers_extracted') or 0) > 0),
+    },
+}
+
+
+# Row values the way MySQL stores them: the column parsers of SQL/bulk.py (the ones the form routes, the bulk
+# import and the SQLite/in-memory backends check values with). TIME counts in seconds, as TIME_TO_SEC() gives them.
+def _stored_value(table: str, column: str, value) -> Decimal:
+    from SQL.bulk import column_parser  # imports SQL.queries
+
+    column_type = schema_registry.column_type(table, column)
+    value = column_parser(column_type)(value)
+    if isinstance(value, timedelta):
+        return Decimal(int(value.total_seconds()))
+    return Decimal(str(value))
+
+
+def total_columns(table: str) -> list:
+    # Numeric columns of a table definition (INT, DECIMAL, TIME as seconds)
+    definition = schema_registry.definition(table)
+    return [column for column, column_type in definition.columns.items()
+            if 'INT' in column_type.upper() or column_type.upper().startswith(('DECIMAL', 'TIME'))]
+
+
+def row_totals(table: str, row: dict) -> dict:
+    totals = {ROW_COUNT: Decimal(1)}
+    for column in total_columns(table):
+        value = row.get(column)
+        totals[column] = Decimal(0) if value is None or value == '' else _stored_value(table, column, value)
+    for metric, (_, counts) in DERIVED_TOTALS.get(table, {}).items():
+        totals[metric] = Decimal(1 if counts(row) else 0)
+    return totals
+
+
+def totals_deltas(table: str, new_rows=(), old_rows=()) -> dict:
+    # What new_rows add and old_rows (dicts of column values) take away, {metric: delta} without the zeros
+    if not schema_registry.has_table(table):
+        return {}
+    deltas = {}
+    for rows, sign in ((new_rows, 1), (old_rows, -1)):
+        for row in rows:
+            for metric, value in row_totals(table, row).items():
+                deltas[metric] = deltas.get(metric, Decimal(0)) + sign * value
+    return {metric: delta for metric, delta in deltas.items() if delta}
+
+
+def write_totals(cursor, deltas: dict) -> None:
+    # {table: {metric: delta}} in one statement on the caller's cursor, so the totals commit or roll back
+    # together with the write. An error here is the caller's: its transaction fails, the totals never drift.
+    values = [value for table, metrics in deltas.items() for metric, delta in metrics.items()
+              for value in (table, metric, delta)]
+    if values:
+        placeholders = ', '.join(['(%s, %s, %s)'] * (len(values) // 3))
+        cursor.execute(f"INSERT INTO {SUMMARY_TABLE} (table_name, column_name, total) VALUES {placeholders} "
+                       f"ON DUPLICATE KEY UPDATE total = total + VALUES(total)", values)
+
+
+def apply_totals(cursor, table: str, new_rows=(), old_rows=()) -> None:
+    # The rows come from the caller, which has them already: inserts the values it wrote, updates and deletes
+    # the rows it locked before the write (an update's new row is the old one with the changed columns)
+    write_totals(cursor, {table: totals_deltas(table, new_rows, old_rows)})
+
+
+def lock_rows(cursor, table: str, ids: list) -> list:
+    # Current values of rows about to be updated or deleted, locked until the transaction ends
+    if not ids:
+        return []
+    id_placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"SELECT * FROM {table} WHERE id IN ({id_placeholders}) FOR UPDATE", list(ids))
+    columns = [column[0] for column in cursor.description]
+    return [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def clear_totals(cursor, table: str) -> None:
+    cursor.execute(f"DELETE FROM {SUMMARY_TABLE} WHERE table_name = %s", (table,))
+
+
+# Recompute every total from the data tables, for repair after manual edits or a failed migration.
+# One transaction; the dive tables are read with locking reads so no write slips in between.
+def rebuild_totals(connection, tables: list) -> dict:
+    rebuilt = {}
+    with connection.cursor() as cursor:
+        cursor.execute(tquery_totals)  # DDL commits implicitly, so before the transaction
+    connection.begin()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SUMMARY_TABLE}")
+            for table in tables:
+                columns = total_columns(table)
+                derived = DERIVED_TOTALS.get(table, {})
+                sums = ['COUNT(*)']
+                sums.extend(f"COALESCE(SUM(TIME_TO_SEC({column})), 0)"
+                            if schema_registry.column_type(table, column).upper().startswith('TIME')
+                            else f"COALESCE(SUM({column}), 0)" for column in columns)
+                sums.extend(f"COALESCE(SUM(CASE WHEN {condition} THEN 1 ELSE 0 END), 0)"
+                            for condition, _ in derived.values())
+                cursor.execute(f"SELECT {', '.join(sums)} FROM {table} FOR UPDATE")
+                result = cursor.fetchone()
+                values = list(result.values()) if isinstance(result, dict) else list(result)
+                totals = dict(zip([ROW_COUNT, *columns, *derived], values))
+
+                placeholders = ', '.join(['(%s, %s, %s)'] * len(totals))
+                cursor.execute(f"INSERT INTO {SUMMARY_TABLE} (table_name, column_name, total) VALUES {placeholders}",
+                               [value for metric, total in totals.items() for value in (table, metric, total)])
+                rebuilt[table] = totals
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return rebuilt
+
+
+def read_totals(connection) -> dict:
+    # {table: {column: total}} with the career ratios derived from them
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT table_name, column_name, total FROM {SUMMARY_TABLE}")
+        rows = cursor.fetchall()
+    totals = {}
+    for row in rows:
+        table, column, total = row.values() if isinstance(row, dict) else row
+        totals.setdefault(table, {})[column] = float(total)
+
+    objectives = totals.get('objectives_completed', {})
+    if objectives.get(ROW_COUNT):
+        objectives['extraction_rate'] = objectives.get('extracted_dives', 0) / objectives[ROW_COUNT]
+    return totals
+
+
+# python -m SQL.totals rebuild
+def main(argv=None):
+    from SQL.queries import DIVE_TABLES, Server1, all_tables_changed, pooled_connection
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ['rebuild']:
+        print("usage: python -m SQL.totals rebuild")
+        return 2
+    try:
+        with pooled_connection(Server1) as connection:
+            rebuilt = rebuild_totals(connection, [table for table in DIVE_TABLES
+                                                  if table in schema_registry.table_names(Server1)])
+    except pymysql.MySQLError as e:
+        print(f"Error rebuilding totals: {e}")
+        return 1
+    all_tables_changed()
+    for table, totals in rebuilt.items():
+        print(f"{table}: {int(totals[ROW_COUNT])} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,213 @@
-from flask import Flask, render_template, request
+import functools
+import io
+import os
+import re
+import time
+from datetime import timedelta
+
+import pymysql
+from flask import (Flask, render_template, request, jsonify, stream_template, make_response, Response, g, abort,
+                   send_from_directory, redirect, url_for)
+from markupsafe import escape
+from SQL.bootstrap import BOOTSTRAP_WAIT, bootstrap
+from SQL.bulk import RowRejected, column_parser
+from SQL.fanout import fan_out
+from SQL.logs import configure_logging, get_logger, sampled
+from SQL.metrics import metrics_text, request_duration
+from SQL.profiler import ARTIFACT_NAME, PROFILE_DIR, PROFILE_TOKEN, RequestProfiler, profile_artifacts, token_matches
+from SQL.slowlog import request_route, slow_query_log
 from SQL.queries import *
-from decimal import Decimal
 
 app = Flask(__name__)
+configure_logging()  # LOG_LEVEL / LOG_FORMAT / LOG_SAMPLE, see SQL/logs.py
+log = get_logger('app')
+
+# Profile single requests on demand, only with PROFILE_TOKEN set - see SQL/profiler.py
+if PROFILE_TOKEN:
+    app.wsgi_app = RequestProfiler(app.wsgi_app)
+
+# 'MM:SS.dd' as the objectives form asks for it (or 'HH:MM:SS', or seconds in JSON). It goes to the database as
+# a timedelta: sent as the string '12:34', MySQL would store 12 hours 34 minutes.
+def form_time(value) -> timedelta:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return timedelta(seconds=value)
+    match = re.fullmatch(r'\s*(?:(\d+):)?(\d+):(\d+(?:\.\d*)?)\s*', str(value))
+    if match is None:
+        raise ValueError(f"mission time is not MM:SS.dd: {value!r}")
+    hours, minutes, seconds = match.groups()
+    if float(seconds) >= 60 or (hours is not None and int(minutes) >= 60):
+        raise ValueError(f"mission time is not MM:SS.dd: {value!r}")
+    return timedelta(hours=int(hours or 0), minutes=int(minutes), seconds=float(seconds))
+
+
+# Form fields of every table and how to convert them, shared by the submit/update routes
+FORM_FIELDS = {
+    'combat': {
+        'kills': int,
+        'accuracy': float,
+        'shots_fired': int,
+        'deaths': int,
+        'stims_used': int,
+        'accidentals': int,
+        'samples_extracted': int,
+        'stratagems_used': int,
+        'melee_kills': int,
+        'times_reinforcing': int,
+        'friendly_fire_damage': int,
+        'distance_travelled': int,
+    },
+    'currency_gained': {
+        'requisition': int,
+        'medals': int,
+        'xp': int,
+    },
+    'objectives_completed': {
+        'main_objectives': int,
+        'optional_objectives': int,
+        'helldivers_extracted': int,
+        'outposts_destroyed_light': int,
+        'outposts_destroyed_medium': int,
+        'outposts_destroyed_heavy': int,
+        'mission_time_remaining': form_time,
+    },
+    'samples_gained': {
+        'green_samples': int,
+        'orange_samples': int,
+        'violet_samples': int,
+    },
+}
+
+
+# Views that answer without the database, they don't wait for the bootstrap
+NO_DATABASE_ENDPOINTS = {'static', 'index', 'about', 'ready', 'data_option5', 'data_option6', 'data_option7',
+                         'data_option8', 'cache_stats', 'pool_stats', 'metrics', 'slow_queries', 'profiles'}
+
+
+# Time of every request by route template (not the URL, so /export/<name> stays one series), for /metrics and the log
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    request_route.set(request.url_rule.rule if request.url_rule else None)  # for the slow query log
+
+
+# The database is set up in the background (SQL/bootstrap.py). Under a WSGI server the first request starts that,
+# a request that needs the database waits for it, up to BOOTSTRAP_WAIT seconds.
+@app.before_request
+def wait_for_database():
+    bootstrap.start(Server1)
+    if request.endpoint in NO_DATABASE_ENDPOINTS or bootstrap.wait(BOOTSTRAP_WAIT):
+        return None
+    return Response('The database is not ready yet, try again shortly', status=503, mimetype='text/plain',
+                    headers={'Retry-After': str(max(1, round(BOOTSTRAP_WAIT)))})
+
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.observe(elapsed, request.method, route, response.status_code)
+        if response.status_code >= 500:
+            log.warning("%s %s answered %s", request.method, request.path, response.status_code,
+                        extra={'ms': round(elapsed * 1000, 2)})
+        else:
+            log.debug("%s %s answered %s", request.method, request.path, response.status_code,
+                      extra=sampled(ms=round(elapsed * 1000, 2)))
+    return response
+
+
+# Form (or JSON) fields converted and checked against their column types, the same check the bulk import and the
+# SQLite/in-memory backends apply. A value that doesn't fit raises RowRejected, answered with a 400.
+# partial: only the fields present (an update of some columns), a field the table's form doesn't have is rejected
+def parse_form(table, form, partial=False):
+    fields = FORM_FIELDS[table]
+    if partial:
+        unknown = [column for column in form if column not in fields]
+        if unknown:
+            raise RowRejected(f"unknown columns: {', '.join(unknown)}")
+        fields = {column: convert for column, convert in fields.items() if column in form}
+    data = {}
+    for column, convert in fields.items():
+        try:
+            data[column] = column_parser(schema_registry.column_type(table, column))(convert(form[column]))
+        except (TypeError, ValueError) as e:
+            raise RowRejected(f"{column}: {e}")
+    return data
+
+
+@app.errorhandler(RowRejected)
+def invalid_data(e):
+    return f'Invalid data: {escape(str(e))}', 400
+
+
+# ETag/Last-Modified from the versions of the tables a page is built from. A request whose If-None-Match
+# (or If-Modified-Since) still matches gets a 304 before any query runs or any template is rendered.
+# The versions are counted per process (SQL/cache.py), so this is only right while one process serves every
+# write. Off unless the operator turns it on with ETAGS=on for such a setup (python app.py, gunicorn -w 1).
+ETAGS = os.environ.get('ETAGS', 'off') == 'on'
+
+
+def conditional(tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ETAGS:
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.no_cache = True
+                return response
+            etag, last_modified = table_versions.etag(tables, request.full_path)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True  # browsers revalidate on every refresh
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+MAX_PAGE_SIZE = 1000
+
+
+# ?after_id=&limit= - without a limit the whole table is streamed
+def page_args():
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return after_id, limit
+
+
+# {columns, rows, next_after_id} for one table: a keyset page when limit is set, otherwise a row stream
+def read_table(table, after_id, limit, converters=None):
+    if limit is None:
+        return {'columns': schema_registry.columns(Server1, table),
+                'rows': query_stream_table(Server1, table, after_id, converters),
+                'next_after_id': None}
+
+    page = query_get_data_page(Server1, table, after_id, limit, converters)
+    rows = page[1:]
+    return {'columns': page[0],
+            'rows': rows,
+            'next_after_id': rows[-1][0] if len(rows) == limit else None}
+
+
+def render_table_data(table, template):
+    after_id, limit = page_args()
+    # Decimal values are converted to floats while the rows are fetched
+    table_data = read_table(table, after_id, limit, DISPLAY_CONVERTERS)
+
+    return stream_template(template, columns=table_data['columns'], rows=table_data['rows'],
+                           next_after_id=table_data['next_after_id'], limit=limit)
 
 
 @app.route('/')
@@ -11,86 +216,76 @@ def index():
 
 
 @app.route('/dive')
+@conditional(DIVE_TABLES)
 def dive():
-    table_names = query_get_table_names(Server1)
-    max_id = max(query_get_last_id_value(Server1, table) for table in table_names)
-
-    data = {}
-    for table in table_names:
-        data[table] = query_get_data_by_id(Server1, table, max_id)
-
+    max_id, data = query_get_latest_dive(Server1)
     return render_template('dive.html', data=data, max_id=max_id)
 
 
 @app.route('/all_dives')
+@conditional(DIVE_TABLES)
 def all_dives():
+    after_id, limit = page_args()
     table_names = query_get_table_names(Server1)
-    data = {table: query_get_data_from_table(Server1, table) for table in table_names}
-    return render_template('all_dives.html', data=data)
+    if limit is None:
+        # Streams are generators, each table's query only runs when the template reaches it
+        data = {table: read_table(table, after_id, limit) for table in table_names}
+    else:
+        # Pages are read from all tables at once
+        data = fan_out({table: (read_table, table, after_id, limit) for table in table_names})
+        if None in data.values():
+            return 'Could not read the dive tables', 500
+
+    # A page covers the dives up to the smallest last id of the full table pages, so no table skips rows
+    next_after_id = min((table_data['next_after_id'] for table_data in data.values()
+                         if table_data['next_after_id'] is not None), default=None)
+    if next_after_id is not None:
+        for table_data in data.values():
+            table_data['rows'] = [row for row in table_data['rows'] if row[0] <= next_after_id]
 
+    return stream_template('all_dives.html', data=data, next_after_id=next_after_id, limit=limit)
 
+
+# Some columns of the last row of a dive table, converted like the form of that table
 @app.route('/update_last_dive/<table>', methods=['POST'])
 def update_last_dive(table):
-    id_ = query_get_last_id_value(Server1, table)
+    if table not in DIVE_TABLES:
+        return 'Unknown table', 400
+    data = parse_form(table, request.form, partial=True)
+    if not data:
+        return 'No columns to update', 400
+
+    id_ = query_get_last_id_value(Server1, table, fresh=True)
     if id_ is None:
         return 'No data to update'
 
-    # Extract form data
-    data = {}
-    for column in request.form:
-        data[column] = request.form[column]
-
-    query_update_row(Server1, table, id_, **data)
+    query_update_row(Server1, table, id_, data)
 
-    return render_template('all_dives.html')
+    return redirect(url_for('all_dives'))
 
 
 @app.route('/combat')
+@conditional(['combat'])
 def data_option1():
-    data = query_get_data_from_table(Server1, 'combat')
-    columns = data[0]
-    rows = data[1:]
-
-    # Convert Decimal values to floats
-    rows = [[float(cell) if isinstance(cell, Decimal) else cell for cell in row] for row in rows]
-
-    # print(f"Columns: {columns}")  # Debugging: print columns
-    # print(f"Rows: {rows}")  # Debugging: print rows
-
-    return render_template('data/combat.html', columns=columns, rows=rows)
+    return render_table_data('combat', 'data/combat.html')
 
 
 @app.route('/currency_gained')
+@conditional(['currency_gained'])
 def data_option2():
-    data = query_get_data_from_table(Server1, 'currency_gained')
-    columns = data[0]
-    rows = data[1:]
-    # Convert Decimal values to floats if necessary
-    rows = [[float(cell) if isinstance(cell, Decimal) else cell for cell in row] for row in rows]
-    # print(f"Columns: {columns}\nRows: {rows}")
-    return render_template('data/currency_gained.html', columns=columns, rows=rows)
+    return render_table_data('currency_gained', 'data/currency_gained.html')
 
 
 @app.route('/objectives_completed')
+@conditional(['objectives_completed'])
 def data_option3():
-    data = query_get_data_from_table(Server1, 'objectives_completed')
-    columns = data[0]
-    rows = data[1:]
-    # Convert Decimal values to floats if necessary
-    rows = [[float(cell) if isinstance(cell, Decimal) else cell for cell in row] for row in rows]
-    # print(f"Columns: {columns}\nRows: {rows}")
-    return render_template('data/objectives_completed.html', columns=columns, rows=rows)
+    return render_table_data('objectives_completed', 'data/objectives_completed.html')
 
 
 @app.route('/samples_gained')
+@conditional(['samples_gained'])
 def data_option4():
-    data = query_get_data_from_table(Server1, 'samples_gained')
-    columns = data[0]
-    rows = data[1:]
-    # Convert Decimal values to floats if necessary
-    rows = [[float(cell) if isinstance(cell, Decimal) else cell for cell in row] for row in rows]
-    # print(f"Columns: {columns}\nRows: {rows}")
-    return render_template('data/samples_gained.html', columns=columns, rows=rows)
+    return render_table_data('samples_gained', 'data/samples_gained.html')
 
 
 @app.route('/input_combat')
@@ -113,90 +308,185 @@ def data_option8():
     return render_template('inputs/input_samples_gained.html')
 
 
+# One row from the form of its table: a field that doesn't parse or fit its column is a 400 (invalid_data), a row
+# the database refused a 500
+def submit_row(table):
+    data = parse_form(table, request.form)
+    if query_put_row(Server1, table, **data) is None:
+        return f'The {table} row could not be saved', 500
+    return render_template('submit_success.html')
+
+
 @app.route('/submit_data_combat', methods=['POST'])
 def submit_data_combat():
-    id_ = query_get_last_id_value(Server1, 'combat')
-    if id_ is None:
-        id_ = 1
-    else:
-        id_ = int(id_) + 1
-
-    # Extract form data
-    data = {
-        'kills': int(request.form['kills']),
-        'accuracy': float(request.form['accuracy']),
-        'shots_fired': int(request.form['shots_fired']),
-        'deaths': int(request.form['deaths']),
-        'stims_used': int(request.form['stims_used']),
-        'accidentals': int(request.form['accidentals']),
-        'samples_extracted': int(request.form['samples_extracted']),
-        'stratagems_used': int(request.form['stratagems_used']),
-        'melee_kills': int(request.form['melee_kills']),
-        'times_reinforcing': int(request.form['times_reinforcing']),
-        'friendly_fire_damage': int(request.form['friendly_fire_damage']),
-        'distance_travelled': int(request.form['distance_travelled']),
-    }
-
-    query_put_row(Server1, 'combat', id=id_, **data)
-    return render_template('submit_success.html')
+    return submit_row('combat')
 
 
 @app.route('/submit_data_currency_gained', methods=['POST'])
 def submit_data_currency_gained():
-    id_ = query_get_last_id_value(Server1, 'currency_gained')
-    if id_ is None:
-        id_ = 1
-    else:
-        id_ = int(id_) + 1
-
-    data = {
-        'requisition': int(request.form['requisition']),
-        'medals': int(request.form['medals']),
-        'xp': int(request.form['xp'])
-    }
-
-    query_put_row(Server1, 'currency_gained', id=id_, **data)
-    return render_template('submit_success.html')
+    return submit_row('currency_gained')
 
 
 @app.route('/submit_data_objectives_completed', methods=['POST'])
 def submit_data_objectives_completed():
-    id_ = query_get_last_id_value(Server1, 'objectives_completed')
-    if id_ is None:
-        id_ = 1
-    else:
-        id_ = int(id_) + 1
-
-    data = {
-        'main_objectives': int(request.form['main_objectives']),
-        'optional_objectives': int(request.form['optional_objectives']),
-        'helldivers_extracted': int(request.form['helldivers_extracted']),
-        'outposts_destroyed_light': int(request.form['outposts_destroyed_light']),
-        'outposts_destroyed_medium': int(request.form['outposts_destroyed_medium']),
-        'outposts_destroyed_heavy': int(request.form['outposts_destroyed_heavy']),
-        'mission_time_remaining': request.form['mission_time_remaining']
-    }
-
-    query_put_row(Server1, 'objectives_completed', id=id_, **data)
-    return render_template('submit_success.html')
+    return submit_row('objectives_completed')
 
 
 @app.route('/submit_data_samples_gained', methods=['POST'])
 def submit_data_samples_gained():
-    id_ = query_get_last_id_value(Server1, 'samples_gained')
-    if id_ is None:
-        id_ = 1
-    else:
-        id_ = int(id_) + 1
+    return submit_row('samples_gained')
+
+
+# Whole dive in one request: JSON {"combat": {...}, "currency_gained": {...}, "objectives_completed": {...},
+# "samples_gained": {...}} or one form holding the fields of all four tables
+@app.route('/submit_dive', methods=['POST'])
+def submit_dive():
+    payload = request.get_json(silent=True)
+    try:
+        if payload is not None:
+            dive_data = {table: parse_form(table, payload.get(table) or {}) for table in FORM_FIELDS}
+        else:
+            dive_data = {table: parse_form(table, request.form) for table in FORM_FIELDS}
+    except (KeyError, TypeError, ValueError) as e:
+        message = f'Invalid dive data: {e}'
+        return (jsonify(error=message), 400) if payload is not None else (message, 400)
+
+    dive_id = query_put_dive(Server1, dive_data)
+    if dive_id is None:
+        return (jsonify(error='Dive could not be saved'), 500) if payload is not None else ('Dive could not be saved', 500)
+
+    if payload is not None:
+        return jsonify(id=dive_id), 201
+    return render_template('submit_success.html')
 
-    data = {
-        'green_samples': int(request.form['green_samples']),
-        'orange_samples': int(request.form['orange_samples']),
-        'violet_samples': int(request.form['violet_samples']),
-    }
 
-    query_put_row(Server1, 'samples_gained', id=id_, **data)
-    return render_template('submit_success.html')
+# Bulk import of historical data: POST a CSV or JSON Lines file (form field 'file' or the raw body)
+# /import/combat?format=csv&batch_size=1000 -> JSON report with inserted/rejected rows and rows per second
+@app.route('/import/<table>', methods=['POST'])
+def import_table(table):
+    from SQL.bulk import DEFAULT_BATCH_SIZE, READERS, query_bulk_import
+
+    upload = request.files.get('file')
+    file_format = request.args.get('format') or (
+        'jsonl' if upload and upload.filename.endswith(('.jsonl', '.ndjson')) else 'csv')
+    batch_size = request.args.get('batch_size', DEFAULT_BATCH_SIZE, type=int)
+    if file_format not in READERS or table not in query_get_table_names(Server1) or batch_size < 1:
+        return jsonify(error='Unknown table or format, or invalid batch size'), 400
+
+    raw = upload.stream if upload else request.stream
+    stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    report = query_bulk_import(Server1, table, stream, file_format, batch_size)
+    return jsonify(report), 500 if 'error' in report else 200
+
+
+# Streaming export of a table or of every dive ('dives'): /export/combat?format=csv|jsonl|columnar&gzip=1
+# Sent with chunked transfer encoding while the rows are read, memory use does not grow with the table
+@app.route('/export/<name>')
+def export_table(name):
+    from SQL.bulk import DIVES_VIEW, EXPORT_EXTENSIONS, EXPORT_MIMETYPES, query_bulk_export
+
+    file_format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '0') not in ('0', '', 'false')
+    if file_format not in EXPORT_MIMETYPES or (name != DIVES_VIEW and name not in query_get_table_names(Server1)):
+        return jsonify(error='Unknown table or format'), 400
+
+    try:
+        chunks = query_bulk_export(Server1, name, file_format, compress)  # raises before the first chunk
+    except pymysql.err.NotSupportedError as e:
+        return jsonify(error=str(e)), 501
+    response = Response(chunks, mimetype=EXPORT_MIMETYPES[file_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{EXPORT_EXTENSIONS[file_format]}'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# Aggregates computed in SQL: per-column min/max/avg/sum, rolling combat averages over the last dives,
+# deaths vs stims used and samples per mission. /stats?window=10&last=50, add format=json for JSON
+@app.route('/stats')
+@conditional(DIVE_TABLES)
+def stats():
+    from SQL.analytics import query_dive_stats
+
+    window = max(1, min(request.args.get('window', 10, type=int), 500))
+    last = max(1, min(request.args.get('last', 50, type=int), 5000))
+    dive_stats = query_dive_stats(Server1, window, last)
+    if request.args.get('format') == 'json':
+        return jsonify(dive_stats)
+    return render_template('stats.html', stats=dive_stats, window=window, last=last)
+
+
+# Whole-history analytics on NumPy arrays: distribution, rolling mean, z-score outliers and correlations.
+# /analytics?metrics=kills,accuracy,shots_fired&window=10&last=50&threshold=3
+@app.route('/analytics')
+@conditional(DIVE_TABLES)
+def analytics():
+    from SQL.arrays import DERIVED_METRICS, dive_report, query_dive_arrays
+
+    arrays = query_dive_arrays(Server1)
+    if arrays is None:
+        return jsonify(error='Could not load dive history'), 500
+    metrics = request.args.get('metrics', 'kills,accuracy,shots_fired,kills_per_death').split(',')
+    unknown = [name for name in metrics if name not in arrays.columns]
+    if unknown:
+        return jsonify(error=f"Unknown metrics: {', '.join(unknown)}",
+                       metrics=sorted(arrays.columns), derived=list(DERIVED_METRICS)), 400
+    window = max(1, min(request.args.get('window', 10, type=int), 500))
+    last = max(1, min(request.args.get('last', 50, type=int), 5000))
+    threshold = request.args.get('threshold', 3.0, type=float)
+    return jsonify(dive_report(arrays, metrics, window, last, threshold))
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route('/pool_stats')
+def pool_stats():
+    # Connection pool of the MySQL backend: size, idle, in_use, max_size (empty for SQLite/in-memory)
+    return jsonify(get_pool(Server1).stats() if Server1.backend == 'mysql' else {})
+
+
+# Readiness probe: 200 once the database and tables are set up, 503 before
+@app.route('/ready')
+def ready():
+    status = bootstrap.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition format
+    return Response(metrics_text(Server1), mimetype='text/plain; version=0.0.4')
+
+
+# Statements slower than SLOW_QUERY_MS with their EXPLAIN plan, newest first. add format=json for JSON
+# The statements carry their parameters, so this needs the profile token too, anyone else gets a 404
+@app.route('/debug/slow_queries')
+def slow_queries():
+    if not token_matches(request.headers.get('X-Profile-Token') or request.args.get('profile_token')):
+        abort(404)
+    entries = slow_query_log.entries()
+    if request.args.get('format') == 'json':
+        return jsonify(threshold_ms=slow_query_log.threshold * 1000, entries=entries)
+    return render_template('slow_queries.html', entries=entries, threshold_ms=slow_query_log.threshold * 1000,
+                           backend=Server1.backend)
+
+
+# Profiles written by RequestProfiler: /debug/profiles lists them, /debug/profiles/<id>.txt|.collapsed|.prof
+# Needs the profile token like the profiling itself, anyone else gets a 404
+@app.route('/debug/profiles')
+@app.route('/debug/profiles/<name>')
+def profiles(name=None):
+    if not token_matches(request.headers.get('X-Profile-Token') or request.args.get('profile_token')):
+        abort(404)
+    if name is None:
+        return jsonify(profiles=profile_artifacts())
+    if not ARTIFACT_NAME.match(name):
+        abort(404)
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name,
+                               mimetype='application/octet-stream' if name.endswith('.prof') else 'text/plain')
 
 
 @app.route('/about')
@@ -206,24 +496,11 @@ def about():
 
 @app.route('/update_data_combat', methods=['POST'])
 def update_data_combat():
-    id_ = query_get_last_id_value(Server1, 'combat')
+    id_ = query_get_last_id_value(Server1, 'combat', fresh=True)
     if id_ is None:
         return 'No rows to update in combat data'
 
-    data = {
-        'kills': int(request.form['kills']),
-        'accuracy': float(request.form['accuracy']),
-        'shots_fired': int(request.form['shots_fired']),
-        'deaths': int(request.form['deaths']),
-        'stims_used': int(request.form['stims_used']),
-        'accidentals': int(request.form['accidentals']),
-        'samples_extracted': int(request.form['samples_extracted']),
-        'stratagems_used': int(request.form['stratagems_used']),
-        'melee_kills': int(request.form['melee_kills']),
-        'times_reinforcing': int(request.form['times_reinforcing']),
-        'friendly_fire_damage': int(request.form['friendly_fire_damage']),
-        'distance_travelled': int(request.form['distance_travelled']),
-    }
+    data = parse_form('combat', request.form)
 
     query_update_row(Server1, 'combat', id_, data)
     return render_template('submit_success.html')
@@ -231,15 +508,11 @@ def update_data_combat():
 
 @app.route('/update_data_currency_gained', methods=['POST'])
 def update_data_currency_gained():
-    id_ = query_get_last_id_value(Server1, 'currency_gained')
+    id_ = query_get_last_id_value(Server1, 'currency_gained', fresh=True)
     if id_ is None:
         return 'No rows to update in currency gained data'
 
-    data = {
-        'requisition': int(request.form['requisition']),
-        'medals': int(request.form['medals']),
-        'xp': int(request.form['xp'])
-    }
+    data = parse_form('currency_gained', request.form)
 
     query_update_row(Server1, 'currency_gained', id_, data)
     return render_template('submit_success.html')
@@ -247,19 +520,11 @@ def update_data_currency_gained():
 
 @app.route('/update_data_objectives_completed', methods=['POST'])
 def update_data_objectives_completed():
-    id_ = query_get_last_id_value(Server1, 'objectives_completed')
+    id_ = query_get_last_id_value(Server1, 'objectives_completed', fresh=True)
     if id_ is None:
         return 'No rows to update in objectives completed data'
 
-    data = {
-        'main_objectives': int(request.form['main_objectives']),
-        'optional_objectives': int(request.form['optional_objectives']),
-        'helldivers_extracted': int(request.form['helldivers_extracted']),
-        'outposts_destroyed_light': int(request.form['outposts_destroyed_light']),
-        'outposts_destroyed_medium': int(request.form['outposts_destroyed_medium']),
-        'outposts_destroyed_heavy': int(request.form['outposts_destroyed_heavy']),
-        'mission_time_remaining': request.form['mission_time_remaining']
-    }
+    data = parse_form('objectives_completed', request.form)
 
     query_update_row(Server1, 'objectives_completed', id_, data)
     return render_template('submit_success.html')
@@ -267,15 +532,11 @@ def update_data_objectives_completed():
 
 @app.route('/update_data_samples_gained', methods=['POST'])
 def update_data_samples_gained():
-    id_ = query_get_last_id_value(Server1, 'samples_gained')
+    id_ = query_get_last_id_value(Server1, 'samples_gained', fresh=True)
     if id_ is None:
         return 'No rows to update in samples gained data'
 
-    data = {
-        'green_samples': int(request.form['green_samples']),
-        'orange_samples': int(request.form['orange_samples']),
-        'violet_samples': int(request.form['violet_samples']),
-    }
+    data = parse_form('samples_gained', request.form)
 
     query_update_row(Server1, 'samples_gained', id_, data)
     return render_template('submit_success.html')
@@ -283,7 +544,7 @@ def update_data_samples_gained():
 
 @app.route('/delete_last_row/<table_name>', methods=['POST'])
 def delete_last_row(table_name):
-    id_ = query_get_last_id_value(Server1, table_name)
+    id_ = query_get_last_id_value(Server1, table_name, fresh=True)
     if id_ is None:
         return f'No rows to delete in {table_name} data'
 
@@ -291,19 +552,15 @@ def delete_last_row(table_name):
     return render_template('submit_success.html')
 
 
+# The rows with the highest id of every table, deleted in one transaction
 @app.route('/delete_last_dive', methods=['POST'])
 def delete_last_dive():
-    # Get the maximum ID value across all tables
-    max_id = max(query_get_last_id_value(Server1, table) for table in query_get_table_names(Server1))
-
-    if max_id is not None:
-        # Delete rows with the maximum ID value from all tables
-        for table in query_get_table_names(Server1):
-            query_delete_row(Server1, table, max_id)
+    if query_delete_dive(Server1) is None:
+        return 'The last dive could not be deleted', 500
 
     return render_template('submit_success_all_dives.html', redirect_url='/all_dives')
 
 
 if __name__ == '__main__':
-    setup_db_and_tables(Server1)  # Ensure the database is set up before running the app
+    bootstrap.start(Server1)  # database and tables are set up in the background, /ready tells when they are
     app.run(debug=True)
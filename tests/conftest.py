@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+# The app runs on the in-memory backend (SQL/backends.py), no database server needed
+os.environ['DB_BACKEND'] = 'memory'
+
+
+@pytest.fixture
+def server():
+    from SQL.bootstrap import bootstrap
+    from SQL.queries import Server1, query_delete_all_tables
+
+    query_delete_all_tables(Server1)
+    bootstrap.run(Server1)
+    return Server1
+
+
+@pytest.fixture
+def client(server):
+    from app import app
+
+    return app.test_client()
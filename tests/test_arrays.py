@@ -0,0 +1,72 @@
+import math
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from SQL.arrays import dive_report, query_dive_arrays
+from SQL.queries import DBConnString, query_put_dive, query_put_row
+
+METRICS = ['kills', 'deaths', 'kills_per_death', 'samples_per_minute']
+
+
+def dive(kills, deaths, green, minutes_left):
+    return {'combat': {'kills': kills, 'deaths': deaths}, 'currency_gained': {'requisition': 5},
+            'objectives_completed': {'main_objectives': 1, 'mission_time_remaining': timedelta(minutes=minutes_left)},
+            'samples_gained': {'green_samples': green, 'orange_samples': 0, 'violet_samples': 0}}
+
+
+# The same checks on the in-memory backend and on a SQLite file
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend_server(request, tmp_path):
+    if request.param == 'memory':
+        return request.getfixturevalue('server')
+    from SQL.queries import setup_db_and_tables
+
+    server_name = DBConnString('', str(tmp_path / 'dives.db'), '', '', backend='sqlite')
+    assert setup_db_and_tables(server_name)
+    return server_name
+
+
+def test_tables_without_rows(backend_server):
+    arrays = query_dive_arrays(backend_server)
+    assert len(arrays) == 0
+    assert arrays.describe('kills') == {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+    assert arrays.percentiles('kills') == {5: None, 25: None, 50: None, 75: None, 95: None}
+    assert arrays.outliers('kills') == {}
+    assert len(arrays.rolling_mean('kills')) == 0
+
+    report = dive_report(arrays, METRICS)
+    assert report['dives'] == 0
+    assert report['correlations']['kills']['deaths'] is None
+
+
+def test_columns_aligned_on_dive_id(backend_server):
+    query_put_dive(backend_server, dive(kills=10, deaths=2, green=6, minutes_left=10))
+    query_put_dive(backend_server, dive(kills=20, deaths=0, green=3, minutes_left=25))
+    query_put_row(backend_server, 'combat', kills=30, deaths=3)  # a dive with only its combat row
+
+    arrays = query_dive_arrays(backend_server)
+    assert arrays.ids.tolist() == [1, 2, 3]
+    assert arrays.column('kills').tolist() == [10, 20, 30]
+    assert arrays.column('mission_time_remaining')[:2].tolist() == [600, 1500]  # TIME as seconds
+    assert math.isnan(arrays.column('requisition')[2])
+
+    assert arrays.column('kills_per_death')[[0, 2]].tolist() == [5, 10]
+    assert math.isnan(arrays.column('kills_per_death')[1])  # no deaths
+    assert arrays.column('samples_per_minute')[:2].tolist() == [0.2, 0.2]  # 6 in 30 min, 3 in 15 min
+    assert arrays.describe('kills') == {'count': 3, 'mean': 20.0, 'std': pytest.approx(8.165, abs=1e-3),
+                                        'min': 10.0, 'max': 30.0}
+    assert np.allclose(arrays.rolling_mean('kills', window=2), [10, 15, 25])
+
+    report = dive_report(arrays, METRICS, window=2)
+    assert report['dives'] == 3
+    assert report['metrics']['kills']['rolling_mean'] == {1: 10.0, 2: 15.0, 3: 25.0}
+    assert report['correlations']['kills']['deaths'] is None  # only dive 1 has every metric
+    assert arrays.correlations(['kills', 'deaths'])['kills']['deaths'] == pytest.approx(0.3273, abs=1e-4)
+
+
+def test_reloaded_after_a_write(backend_server):
+    assert len(query_dive_arrays(backend_server)) == 0
+    query_put_dive(backend_server, dive(kills=10, deaths=2, green=6, minutes_left=10))
+    assert len(query_dive_arrays(backend_server)) == 1
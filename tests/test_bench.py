@@ -0,0 +1,42 @@
+from SQL.bench import route_cases
+
+
+def test_update_last_dive_redirects_to_all_dives(client, server):
+    from SQL.queries import query_get_data_from_table, query_put_row
+
+    query_put_row(server, 'combat', kills=1, deaths=1)
+    response = client.post('/update_last_dive/combat', data={'kills': '3'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/all_dives')
+    columns, *rows = query_get_data_from_table(server, 'combat')
+    assert dict(zip(columns, rows[-1]))['kills'] == 3
+
+
+def test_update_last_dive_rejects_unknown_tables_and_columns(client, server):
+    from SQL.queries import query_get_data_from_table, query_put_row
+
+    query_put_row(server, 'combat', kills=1, deaths=1)
+    assert client.post('/update_last_dive/dive_totals', data={'kills': '3'}).status_code == 400
+    assert client.post('/update_last_dive/combat', data={'kills = 0, deaths': '3'}).status_code == 400
+    assert client.post('/update_last_dive/combat', data={'kills': '3; DROP TABLE combat'}).status_code == 400
+    assert client.post('/update_last_dive/combat', data={}).status_code == 400
+    columns, *rows = query_get_data_from_table(server, 'combat')
+    assert dict(zip(columns, rows[-1]))['kills'] == 1
+
+
+def test_update_last_dive_reads_time_like_the_form(client, server):
+    from datetime import timedelta
+
+    from SQL.queries import query_get_data_from_table, query_put_row
+
+    query_put_row(server, 'objectives_completed', main_objectives=1)
+    response = client.post('/update_last_dive/objectives_completed', data={'mission_time_remaining': '12:34'})
+    assert response.status_code == 302
+    columns, *rows = query_get_data_from_table(server, 'objectives_completed')
+    assert dict(zip(columns, rows[-1]))['mission_time_remaining'] == timedelta(minutes=12, seconds=34)
+
+
+# Every route the bench times must succeed, or it times an error page
+def test_bench_route_cases_succeed(server):
+    for _, case in route_cases(server, dives=10):
+        case()  # raises when the route answers 4xx/5xx
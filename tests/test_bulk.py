@@ -0,0 +1,117 @@
+import io
+import re
+from contextlib import contextmanager
+
+import pymysql
+import pytest
+
+import SQL.bulk as bulk
+from SQL.bulk import RowRejected, query_bulk_import, read_csv
+from SQL.queries import DBConnString, schema_registry
+
+INSERT = re.compile(r'INSERT INTO currency_gained \(([^)]*)\)')
+
+
+# Enough of MySQL for _insert_batch: the ids of a table, duplicate keys refused. A multi-row INSERT fails as a
+# whole, a failed single-row INSERT only undoes itself.
+class FakeDatabase:
+    def __init__(self, ids=()):
+        self.ids = set(ids)
+        self.transactions = []  # 'commit' / 'rollback'
+        self.statements = []
+
+    @contextmanager
+    def connection(self, server_name):
+        yield FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.pending = set()
+
+    def begin(self):
+        self.pending = set()
+
+    def commit(self):
+        self.database.ids |= self.pending
+        self.database.transactions.append('commit')
+
+    def rollback(self):
+        self.pending = set()
+        self.database.transactions.append('rollback')
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _insert(self, columns, values):
+        if values[columns.index('id')] is None:
+            return
+        id_ = values[columns.index('id')]
+        if id_ in self.connection.database.ids | self.connection.pending:
+            raise pymysql.IntegrityError(1062, f"Duplicate entry '{id_}' for key 'PRIMARY'")
+        self.connection.pending.add(id_)
+
+    def execute(self, sql, args=()):
+        self.connection.database.statements.append(sql)
+        if match := INSERT.match(sql):
+            self._insert([column.strip() for column in match.group(1).split(',')], args)
+
+    def executemany(self, sql, rows):
+        self.connection.database.statements.append(sql)
+        columns = [column.strip() for column in INSERT.match(sql).group(1).split(',')]
+        for row in rows:
+            self._insert(columns, row)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase(ids={2})
+    monkeypatch.setattr(bulk, 'pooled_connection', database.connection)
+    monkeypatch.setattr(schema_registry, 'table_names', lambda server_name: ['currency_gained'])
+    return database
+
+
+def _import(text, **options):
+    server = DBConnString('host', 'db', 'user', 'password')
+    return query_bulk_import(server, 'currency_gained', io.StringIO(text), **options)
+
+
+def test_short_and_long_csv_rows_are_rejected():
+    rows = list(read_csv(io.StringIO('kills,deaths\n1,2\n3\n4,5,6\n\n7,8\n')))
+    assert [line for line, _ in rows] == [2, 3, 4, 6]
+    assert rows[0][1] == {'kills': '1', 'deaths': '2'} and rows[3][1] == {'kills': '7', 'deaths': '8'}
+    assert isinstance(rows[1][1], RowRejected) and str(rows[1][1]) == '1 values for 2 columns'
+    assert isinstance(rows[2][1], RowRejected) and str(rows[2][1]) == '3 values for 2 columns'
+
+
+def test_batch_is_one_transaction(database):
+    report = _import('id,requisition,medals,xp\n10,1,1,1\n11,2,1,1\n')
+    assert report['inserted'] == 2 and report['rejected'] == 0 and report['batches'] == 1
+    assert database.transactions == ['commit'] and database.ids == {2, 10, 11}
+
+
+def test_refused_row_falls_back_to_row_by_row(database):
+    report = _import('id,requisition,medals,xp\n1,1,1,1\n2,2,1,1\n3,3,1,1\n4,4,1\n5,x,1,1\n')
+    assert database.transactions == ['rollback', 'commit']  # the batch failed, then one row at a time
+    assert database.ids == {1, 2, 3}
+    assert report['inserted'] == 2 and report['rejected'] == 3
+    assert [row['line'] for row in report['rejected_rows']] == [5, 6, 3]
+    assert 'Duplicate entry' in report['rejected_rows'][2]['reason']
+
+
+def test_reported_rejects_are_capped(database, monkeypatch):
+    monkeypatch.setattr(bulk, 'MAX_REPORTED_REJECTS', 2)
+    report = _import('requisition,medals,xp\n' + 'x,1,1\n' * 5)
+    assert report['rejected'] == 5 and len(report['rejected_rows']) == 2
@@ -0,0 +1,72 @@
+from SQL.cache import ResultCache, result_cache
+
+
+def _read(server):
+    from SQL.queries import query_get_data_from_table
+
+    misses = result_cache.misses
+    columns, *rows = query_get_data_from_table(server, 'combat')
+    return {row[0]: dict(zip(columns, row)) for row in rows}, result_cache.misses > misses
+
+
+def test_writes_invalidate_cached_reads(server):
+    from SQL.queries import query_delete_row, query_get_last_id_value, query_put_row, query_update_row
+
+    id_ = query_put_row(server, 'combat', kills=1, deaths=1)
+    rows, missed = _read(server)
+    assert missed and rows[id_]['kills'] == 1
+    assert _read(server) == (rows, False)  # served from the cache
+    assert query_get_last_id_value(server, 'combat') == id_
+
+    new_id = query_put_row(server, 'combat', kills=2, deaths=1)
+    rows, missed = _read(server)
+    assert missed and set(rows) == {id_, new_id}
+    assert query_get_last_id_value(server, 'combat') == new_id
+
+    query_update_row(server, 'combat', new_id, {'kills': 5})
+    rows, missed = _read(server)
+    assert missed and rows[new_id]['kills'] == 5
+
+    query_delete_row(server, 'combat', new_id)
+    rows, missed = _read(server)
+    assert missed and set(rows) == {id_}
+    assert query_get_last_id_value(server, 'combat') == id_
+
+
+def test_write_to_another_table_keeps_the_entry(server):
+    from SQL.queries import query_put_row
+
+    query_put_row(server, 'combat', kills=1, deaths=1)
+    _read(server)
+    query_put_row(server, 'currency_gained', requisition=5)
+    assert _read(server)[1] is False
+
+
+def test_load_racing_a_write_is_not_stored():
+    cache = ResultCache()
+
+    def load_while_a_write_commits():
+        cache.invalidate('combat')
+        return 'read before the write'
+
+    assert cache.get_or_load('key', ['combat'], load_while_a_write_commits) == 'read before the write'
+    assert cache.get_or_load('key', ['combat'], lambda: 'fresh') == 'fresh'
+    assert cache.get_or_load('key', ['combat'], lambda: 'not loaded again') == 'fresh'
+
+
+def test_ttl_and_size_limit():
+    cache = ResultCache(max_entries=2, ttl=0)
+    cache.get_or_load('key', ['combat'], lambda: 'old')
+    assert cache.get_or_load('key', ['combat'], lambda: 'new') == 'new'  # expired
+
+    cache = ResultCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.get_or_load(key, ['combat'], lambda: key)
+    assert cache.stats()['entries'] == 2
+    assert cache.get_or_load('a', ['combat'], lambda: 'reloaded') == 'reloaded'  # the least recently used went
+
+
+def test_errors_are_not_cached():
+    cache = ResultCache()
+    assert cache.get_or_load('key', ['combat'], lambda: None) is None
+    assert cache.get_or_load('key', ['combat'], lambda: 'ok') == 'ok'
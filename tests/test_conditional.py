@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+from SQL.cache import TableVersions
+
+
+def test_no_last_modified_in_the_second_of_a_write():
+    versions = TableVersions()
+    versions.bump('combat')
+    _, last_modified = versions.etag(['combat'])
+    assert last_modified is None  # a second write in this second would keep the same HTTP date
+
+
+def test_last_modified_once_the_second_is_over():
+    versions = TableVersions()
+    two_seconds_ago = datetime.now(timezone.utc) - timedelta(seconds=2)
+    versions._epoch = (0, two_seconds_ago)  # process start
+    versions._versions['combat'] = (1, two_seconds_ago)
+    _, last_modified = versions.etag(['combat'])
+    assert last_modified is not None and last_modified.microsecond == 0
+
+
+def test_etags_off_by_default():
+    import app
+
+    assert app.ETAGS is False  # gunicorn -w N doesn't tell the app it has several processes
+
+
+def test_etag_changes_with_a_write(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'ETAGS', True)
+    etag = client.get('/combat').headers['ETag']
+    assert client.get('/combat', headers={'If-None-Match': etag}).status_code == 304
+    client.post('/submit_data_combat', data={column: '1' for column in (
+        'kills', 'accuracy', 'shots_fired', 'deaths', 'stims_used', 'accidentals', 'samples_extracted',
+        'stratagems_used', 'melee_kills', 'times_reinforcing', 'friendly_fire_damage', 'distance_travelled')})
+    assert client.get('/combat', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_etags_off(client, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'ETAGS', False)
+    response = client.get('/combat')
+    assert response.status_code == 200 and 'ETag' not in response.headers
@@ -0,0 +1,37 @@
+from SQL.queries import DIVE_TABLES, query_get_last_id_value, query_put_dive
+
+DIVE = {'combat': {'kills': 10, 'deaths': 1}, 'currency_gained': {'requisition': 5},
+        'objectives_completed': {'main_objectives': 1}, 'samples_gained': {'green_samples': 3}}
+
+
+def _last_ids(server):
+    return [query_get_last_id_value(server, table) for table in DIVE_TABLES]
+
+
+def test_delete_last_dive_removes_every_row_of_it(client, server):
+    first, second = query_put_dive(server, DIVE), query_put_dive(server, DIVE)
+    assert _last_ids(server) == [second] * 4
+
+    assert client.post('/delete_last_dive').status_code == 200
+    assert _last_ids(server) == [first] * 4
+
+
+def test_delete_last_dive_is_all_or_nothing(client, server, monkeypatch):
+    from SQL.backends import get_backend
+
+    dive_id = query_put_dive(server, DIVE)
+    backend = get_backend(server)
+    delete = backend.delete
+
+    def delete_failing_on_the_third_table(table, ids):
+        if table == DIVE_TABLES[2]:
+            raise RuntimeError('connection lost')
+        delete(table, ids)
+
+    monkeypatch.setattr(backend, 'delete', delete_failing_on_the_third_table)
+    assert client.post('/delete_last_dive').status_code == 500
+    assert _last_ids(server) == [dive_id] * 4
+
+
+def test_delete_last_dive_without_rows(client, server):
+    assert client.post('/delete_last_dive').status_code == 200
@@ -0,0 +1,134 @@
+import re
+import threading
+from contextlib import contextmanager
+
+import pymysql
+
+import SQL.queries as queries
+from SQL.queries import DBConnString, DIVE_TABLES, query_put_dive, query_put_row
+
+COMBAT = {'kills': 10, 'deaths': 1}
+DIVE = {'combat': COMBAT, 'currency_gained': {'requisition': 5}, 'objectives_completed': {'main_objectives': 1},
+        'samples_gained': {'green_samples': 3}}
+
+
+# Enough of MySQL for the insert paths: AUTO_INCREMENT per table, dive_sequence, duplicate keys
+class FakeDatabase:
+    def __init__(self):
+        self.rows = {table: set() for table in DIVE_TABLES}
+        self.auto_increment = {table: 0 for table in DIVE_TABLES}
+        self.sequence = 0
+        self.on_next_id = None  # runs once, right after the next id is handed out
+
+    @contextmanager
+    def connection(self, server_name):
+        yield FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def begin(self):
+        pass
+
+    commit = rollback = begin
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.lastrowid = None
+        self.description = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=()):
+        database = self.database
+        if sql.startswith('INSERT INTO dive_sequence ()'):
+            database.sequence += 1
+            self.lastrowid = database.sequence
+            hook, database.on_next_id = database.on_next_id, None
+            if hook:
+                hook()
+        elif sql.startswith('INSERT IGNORE INTO dive_sequence'):
+            database.sequence = max(database.sequence, args[0])
+        elif match := re.match(r'INSERT INTO (\w+) \(([^)]*)\)', sql):
+            table, columns = match.group(1), [column.strip() for column in match.group(2).split(',')]
+            if table not in database.rows:
+                return
+            id_ = args[columns.index('id')] if 'id' in columns else database.auto_increment[table] + 1
+            if id_ in database.rows[table]:
+                raise pymysql.IntegrityError(1062, f"Duplicate entry '{id_}' for key 'PRIMARY'")
+            database.rows[table].add(id_)
+            database.auto_increment[table] = max(database.auto_increment[table], id_)
+            self.lastrowid = id_
+
+    def fetchall(self):
+        return []
+
+
+def test_single_row_between_dive_id_and_dive_insert(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(queries, 'pooled_connection', database.connection)
+    server = DBConnString('host', 'db', 'user', 'password')
+    row_ids = []
+    database.on_next_id = lambda: row_ids.append(query_put_row(server, 'combat', **COMBAT))
+
+    dive_id = query_put_dive(server, DIVE)
+
+    # The row took combat's AUTO_INCREMENT id 1, the dive hit the duplicate and retried with the next id
+    assert row_ids == [1] and dive_id == 2
+    assert all(database.rows[table] == {2} for table in DIVE_TABLES if table != 'combat')
+    assert database.rows['combat'] == {1, 2}
+
+
+def test_concurrent_rows_and_dives(server):
+    row_ids, dive_ids = [], []
+
+    def submit():
+        for _ in range(20):
+            row_ids.append(query_put_row(server, 'combat', **COMBAT))
+            dive_ids.append(query_put_dive(server, DIVE))
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert None not in row_ids and None not in dive_ids
+    assert len(set(row_ids) | set(dive_ids)) == len(row_ids) + len(dive_ids)
+
+
+FORMS = {
+    'combat': {'kills': '10', 'accuracy': '55.5', 'shots_fired': '100', 'deaths': '1', 'stims_used': '2',
+               'accidentals': '0', 'samples_extracted': '3', 'stratagems_used': '4', 'melee_kills': '1',
+               'times_reinforcing': '0', 'friendly_fire_damage': '0', 'distance_travelled': '1000'},
+    'currency_gained': {'requisition': '5', 'medals': '1', 'xp': '2140'},
+    'objectives_completed': {'main_objectives': '1', 'optional_objectives': '2', 'helldivers_extracted': '3',
+                             'outposts_destroyed_light': '0', 'outposts_destroyed_medium': '1',
+                             'outposts_destroyed_heavy': '0', 'mission_time_remaining': '12:34.56'},
+    'samples_gained': {'green_samples': '3', 'orange_samples': '2', 'violet_samples': '1'},
+}
+
+
+def test_per_table_forms_make_one_dive(client, server):
+    from SQL.queries import query_get_latest_dive, query_get_last_id_value
+
+    query_put_dive(server, DIVE)  # an earlier dive, the forms continue after it
+    for table in DIVE_TABLES:
+        assert client.post(f'/submit_data_{table}', data=FORMS[table]).status_code == 200
+
+    assert {query_get_last_id_value(server, table) for table in DIVE_TABLES} == {2}
+    dive_id, rows = query_get_latest_dive(server)
+    assert dive_id == 2 and all(rows[table] for table in DIVE_TABLES)
+
+    assert query_put_dive(server, DIVE) == 3  # the sequence is past the ids the forms took
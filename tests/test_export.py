@@ -0,0 +1,15 @@
+import pymysql
+import pytest
+
+
+def test_export_needs_mysql(client):
+    response = client.get('/export/combat?format=csv')
+    assert response.status_code == 501
+    assert 'MySQL' in response.get_json()['error']
+
+
+def test_stream_select_fails_when_called(server):
+    from SQL.queries import query_stream_select
+
+    with pytest.raises(pymysql.err.NotSupportedError):
+        query_stream_select(server, "SELECT 1")  # not only once iterated
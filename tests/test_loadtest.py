@@ -0,0 +1,13 @@
+import random
+
+from SQL.bench import generate_dive
+from SQL.loadtest import form_values
+
+
+def test_mission_time_is_sent_as_the_form_asks_for_it():
+    from app import form_time
+
+    time_remaining = generate_dive(random.Random(7))['objectives_completed']['mission_time_remaining']
+    sent = form_values(random.Random(7), 'objectives_completed')['mission_time_remaining']
+    assert form_time(sent) == time_remaining
+    assert len(sent.split(':')[1]) == 5  # SS.dd
@@ -0,0 +1,47 @@
+import pymysql
+import pytest
+
+from SQL.migrations import MODIFY_COLUMN_OPTIONS, MigrationRefused, _alter, out_of_range, plan_table
+from SQL.queries import SQLQuery
+
+definition = SQLQuery(table_name='samples', green_samples='SMALLINT UNSIGNED')
+LIVE_INT = {'id': 'int unsigned', 'green_samples': 'int'}
+
+
+class FakeCursor:
+    def __init__(self, result=None, fail=False):
+        self.result = result
+        self.fail = fail
+        self.statements = []
+
+    def execute(self, sql, args=None):
+        self.statements.append(sql)
+        if self.fail:
+            raise pymysql.OperationalError(1846, 'ALGORITHM=INPLACE is not supported')
+
+    def fetchone(self):
+        return self.result
+
+
+def test_type_changes_are_not_planned_at_startup():
+    assert plan_table(definition, LIVE_INT, {}) == []
+
+
+def test_type_changes_are_planned_online_only():
+    [(clauses, options)] = plan_table(definition, LIVE_INT, {}, modify=True)
+    assert clauses == ['MODIFY COLUMN green_samples SMALLINT UNSIGNED']
+    assert options == ['ALGORITHM=INPLACE, LOCK=NONE']
+
+
+def test_out_of_range_values_are_found():
+    assert out_of_range(FakeCursor((-1, 70000)), definition, LIVE_INT) == [
+        'samples.green_samples holds -1..70000, SMALLINT UNSIGNED holds 0..65535']
+    assert out_of_range(FakeCursor((0, 65535)), definition, LIVE_INT) == []
+    assert out_of_range(FakeCursor((None, None)), definition, LIVE_INT) == []
+
+
+def test_no_silent_table_copy():
+    cursor = FakeCursor(fail=True)
+    with pytest.raises(MigrationRefused, match='--allow-copy'):
+        _alter(cursor, 'samples', ['MODIFY COLUMN green_samples SMALLINT UNSIGNED'], MODIFY_COLUMN_OPTIONS)
+    assert not any('COPY' in statement for statement in cursor.statements)
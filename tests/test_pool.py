@@ -0,0 +1,122 @@
+import pymysql
+import pytest
+from pymysql.constants import SERVER_STATUS
+
+from SQL.pool import ConnectionPool, PoolTimeout
+from SQL.queries import DBConnString
+
+
+# Enough of a PyMySQL connection for the pool: open/close, ping, rollback and the in-transaction flag
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.open = True
+        self.alive = True
+        self.server_status = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def close(self):
+        self.open = False
+
+
+def make_pool(fail_open=False, **options):
+    pool = ConnectionPool(DBConnString('host', 'db', 'user', 'password'), **options)
+    pool.opened = []
+
+    def open_connection():
+        if fail_open:
+            raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+        pool.opened.append(FakeConnection(len(pool.opened)))
+        return pool.opened[-1]
+
+    pool._open = open_connection
+    return pool
+
+
+def test_borrow_and_return():
+    pool = make_pool(max_size=2)
+    connection = pool.acquire()
+    assert pool.stats() == {'size': 1, 'idle': 0, 'in_use': 1, 'max_size': 2}
+    pool.release(connection)
+    assert pool.stats() == {'size': 1, 'idle': 1, 'in_use': 0, 'max_size': 2}
+
+    with pool.connection() as again:
+        assert again is connection  # reused, not opened again
+    assert len(pool.opened) == 1
+
+
+def test_full_pool_times_out_until_a_connection_comes_back():
+    pool = make_pool(max_size=1, acquire_timeout=0.05)
+    connection = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+
+
+def test_dead_idle_connection_is_replaced():
+    pool = make_pool(check_after=0)
+    with pool.connection() as connection:
+        pass
+    connection.alive = False  # e.g. the server restarted while it was idle
+
+    with pool.connection() as replacement:
+        assert replacement is not connection
+    assert not connection.open
+    assert pool.stats()['size'] == 1
+
+
+def test_connection_broken_while_borrowed_is_dropped():
+    pool = make_pool()
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as connection:
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+    assert not connection.open
+    assert pool.stats() == {'size': 0, 'idle': 0, 'in_use': 0, 'max_size': 10}
+
+
+def test_open_transaction_is_rolled_back_on_return():
+    pool = make_pool()
+    with pool.connection() as connection:
+        connection.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+    assert connection.rollbacks == 1
+    assert pool.stats()['idle'] == 1
+
+
+def test_failed_open_frees_its_slot():
+    pool = make_pool(fail_open=True, max_size=1, acquire_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(pymysql.err.OperationalError) as error:
+            pool.acquire()
+        assert not isinstance(error.value, PoolTimeout)  # the slot came back, no waiting for it
+    assert pool.stats()['size'] == 0
+
+
+def test_warm_and_idle_eviction():
+    pool = make_pool(min_size=2, max_size=4, idle_timeout=0)
+    pool.warm()
+    assert pool.stats() == {'size': 2, 'idle': 2, 'in_use': 0, 'max_size': 4}
+
+    connections = [pool.acquire() for _ in range(3)]
+    for connection in connections:
+        pool.release(connection)
+    pool.acquire()  # idle connections above min_size are closed first
+    assert pool.stats() == {'size': 2, 'idle': 1, 'in_use': 1, 'max_size': 4}
+
+
+def test_closed_pool_refuses_and_closes_returned_connections():
+    pool = make_pool()
+    connection = pool.acquire()
+    pool.close()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(connection)
+    assert not connection.open and pool.stats()['size'] == 0
@@ -0,0 +1,36 @@
+from SQL.metrics import query_duration, query_rows
+
+
+def _observed():
+    counts, _ = query_duration._values.get(('query_stream_table',), ([0], 0.0))
+    return sum(counts), query_rows._values.get(('query_stream_table',), 0)
+
+
+def _add_combat_rows(server, count):
+    from SQL.queries import query_put_row
+
+    for kills in range(count):
+        query_put_row(server, 'combat', kills=kills, deaths=1)
+
+
+def test_stream_is_timed_once_exhausted(server):
+    from SQL.queries import query_stream_table
+
+    _add_combat_rows(server, 3)
+    calls, rows = _observed()
+    stream = query_stream_table(server, 'combat')
+    assert _observed() == (calls, rows)  # nothing ran yet
+
+    assert len(list(stream)) == 3
+    assert _observed() == (calls + 1, rows + 3)
+
+
+def test_stream_closed_early_is_timed(server):
+    from SQL.queries import query_stream_table
+
+    _add_combat_rows(server, 3)
+    calls, rows = _observed()
+    stream = query_stream_table(server, 'combat')
+    next(stream)
+    stream.close()
+    assert _observed() == (calls + 1, rows + 1)
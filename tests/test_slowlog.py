@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+
+import pymysql
+
+from SQL.slowlog import SlowQueryLog
+
+
+def _record(log, connection):
+    log.record(connection, 'SELECT * FROM combat', None, None, 'query_get_data_from_table', 'combat', 1.0, 10)
+
+
+def _wait_for_plans(log, count):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        entries = log.entries()
+        if len(entries) == count and all(entry['explain'] is not None for entry in entries):
+            return entries
+        time.sleep(0.01)
+    raise AssertionError('EXPLAIN did not finish')
+
+
+def test_slow_queries_need_the_profile_token(client, monkeypatch):
+    monkeypatch.setattr('SQL.profiler.PROFILE_TOKEN', 'secret')
+    assert client.get('/debug/slow_queries').status_code == 404
+    assert client.get('/debug/slow_queries?format=json&profile_token=wrong').status_code == 404
+    assert client.get('/debug/slow_queries?format=json', headers={'X-Profile-Token': 'secret'}).status_code == 200
+
+
+def test_slow_queries_off_without_a_token(client, monkeypatch):
+    monkeypatch.setattr('SQL.profiler.PROFILE_TOKEN', '')
+    assert client.get('/debug/slow_queries?format=json').status_code == 404
+
+
+def test_explain_thread_survives_any_error(monkeypatch):
+    failures = iter([RuntimeError('pool closed'), pymysql.OperationalError(2013, 'Lost connection')])
+
+    def get_pool(conn_string):
+        raise next(failures)
+
+    monkeypatch.setattr('SQL.pool.get_pool', get_pool)
+    log = SlowQueryLog(threshold_ms=0)
+    connection = SimpleNamespace(conn_string='server')
+    _record(log, connection)
+    _record(log, connection)
+
+    second, first = _wait_for_plans(log, 2)
+    assert first['explain'] == 'EXPLAIN failed: RuntimeError: pool closed'
+    assert second['explain'].startswith('EXPLAIN failed: ')
+    assert log._worker.is_alive()
@@ -0,0 +1,84 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pymysql
+import pytest
+
+from SQL.totals import SUMMARY_TABLE, apply_totals, row_totals
+
+OBJECTIVES_FORM = {'main_objectives': '1', 'optional_objectives': '2', 'helldivers_extracted': '3',
+                   'outposts_destroyed_light': '0', 'outposts_destroyed_medium': '1', 'outposts_destroyed_heavy': '0'}
+
+
+# Cursor that records the statements, raising on the one containing `fail_on`
+class FakeCursor:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.statements = []
+
+    def execute(self, sql, args=None):
+        self.statements.append((sql, args))
+        if self.fail_on and self.fail_on in sql:
+            raise pymysql.OperationalError(1205, 'Lock wait timeout exceeded')
+
+
+def _last_row(server):
+    from SQL.queries import query_get_data_from_table
+
+    columns, *rows = query_get_data_from_table(server, 'objectives_completed')
+    return dict(zip(columns, rows[-1]))
+
+
+def test_form_time_is_minutes_and_seconds(client, server):
+    response = client.post('/submit_data_objectives_completed',
+                           data={**OBJECTIVES_FORM, 'mission_time_remaining': '12:34.56'})
+    assert response.status_code == 200
+    assert _last_row(server)['mission_time_remaining'] == timedelta(minutes=12, seconds=35)
+
+    response = client.post('/submit_data_objectives_completed',
+                           data={**OBJECTIVES_FORM, 'mission_time_remaining': '12:34'})
+    assert response.status_code == 200
+    assert _last_row(server)['mission_time_remaining'] == timedelta(minutes=12, seconds=34)
+
+
+def test_bad_form_time_is_rejected(client):
+    response = client.post('/submit_data_objectives_completed',
+                           data={**OBJECTIVES_FORM, 'mission_time_remaining': '12:99'})
+    assert response.status_code == 400
+
+
+def _written_totals(cursor):
+    totals_statements = [args for sql, args in cursor.statements if SUMMARY_TABLE in sql]
+    assert len(totals_statements) == 1
+    args = totals_statements[0]
+    return dict(zip(args[1::3], args[2::3]))
+
+
+def test_totals_count_what_mysql_stores():
+    # MySQL stores the string '12:34' as 12:34:00 and 55.555 in a DECIMAL(5,2) as 55.56
+    cursor = FakeCursor()
+    apply_totals(cursor, 'objectives_completed', new_rows=[{'main_objectives': 1, 'mission_time_remaining': '12:34'}])
+    assert _written_totals(cursor)['mission_time_remaining'] == Decimal(45240)
+    assert row_totals('objectives_completed', {'mission_time_remaining': timedelta(seconds=754.56)})[
+        'mission_time_remaining'] == Decimal(755)
+    assert row_totals('combat', {'accuracy': 55.555})['accuracy'] == Decimal('55.56')
+
+
+def test_update_totals_come_from_the_rows_the_caller_has():
+    old = {'id': 1, 'main_objectives': 1, 'helldivers_extracted': 0}
+    cursor = FakeCursor()
+    apply_totals(cursor, 'objectives_completed', new_rows=[{**old, 'main_objectives': 3, 'helldivers_extracted': 2}],
+                 old_rows=[old])
+    assert len(cursor.statements) == 1  # no read, just the upsert
+    assert _written_totals(cursor) == {'main_objectives': 2, 'helldivers_extracted': 2, 'extracted_dives': 1}
+
+
+def test_totals_failure_fails_the_write():
+    cursor = FakeCursor(fail_on=SUMMARY_TABLE)
+    with pytest.raises(pymysql.OperationalError):
+        apply_totals(cursor, 'objectives_completed', new_rows=[{'main_objectives': 1}])
+
+
+def test_bad_value_fails_the_write():
+    with pytest.raises(ValueError):
+        apply_totals(FakeCursor(), 'combat', new_rows=[{'kills': 'many'}])
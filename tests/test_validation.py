@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+import pytest
+
+from SQL.bulk import RowRejected, _parse_time
+
+COMBAT_FORM = {'kills': '10', 'accuracy': '55.5', 'shots_fired': '100', 'deaths': '1', 'stims_used': '2',
+               'accidentals': '0', 'samples_extracted': '3', 'stratagems_used': '4', 'melee_kills': '1',
+               'times_reinforcing': '0', 'friendly_fire_damage': '0', 'distance_travelled': '1000'}
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('12:34', timedelta(hours=12, minutes=34)),  # HH:MM, not MM:SS
+    ('12:34.56', timedelta(hours=12, minutes=34, seconds=1)),  # 12:34:00.56, rounded
+    ('12:34:56', timedelta(hours=12, minutes=34, seconds=56)),
+    ('1234', timedelta(minutes=12, seconds=34)),  # [[HH]MM]SS
+    ('45', timedelta(seconds=45)),
+    ('1 02:03:04', timedelta(hours=26, minutes=3, seconds=4)),
+    ('-00:00:05', timedelta(seconds=-5)),
+    (754.56, timedelta(minutes=12, seconds=35)),  # numbers are seconds
+    (timedelta(minutes=12, seconds=34.5), timedelta(minutes=12, seconds=35)),
+])
+def test_time_like_mysql(value, expected):
+    assert _parse_time(value) == expected
+
+
+@pytest.mark.parametrize('value', ['12:60', '12:34:60', 'abc', '839:00:00', float('inf')])
+def test_time_rejected(value):
+    with pytest.raises(RowRejected):
+        _parse_time(value)
+
+
+def test_backend_coerce_reads_time_like_mysql(server):
+    from SQL.backends import get_backend
+
+    row = get_backend(server).coerce('objectives_completed', {'mission_time_remaining': '12:34.56'})
+    assert row['mission_time_remaining'] == timedelta(hours=12, minutes=34, seconds=1)
+
+
+def test_out_of_range_form_value_is_a_400(client):
+    assert client.post('/submit_data_combat', data=COMBAT_FORM).status_code == 200
+    response = client.post('/submit_data_combat', data={**COMBAT_FORM, 'kills': '-1'})
+    assert response.status_code == 400
+    assert b'kills' in response.data
+
+    response = client.post('/update_data_combat', data={**COMBAT_FORM, 'accuracy': '1000'})
+    assert response.status_code == 400